@@ -1,102 +1,238 @@
-import pygame
-import os
+import queue
 import threading
 import time
+from collections import deque
+
+import config
+import tones
+
+# Playback priorities: lower plays first, and critical alerts preempt short ones
+PRIORITY = {"long": 0, "short": 1}
+
+# Nominal tone durations (seconds), used by backends that do not play audio
+DURATIONS = {"short": 0.5, "long": 2.0}
+
+OUTPUTS = ("driver", "passenger")
+
+
+class PygameAudioBackend:
+    """
+    Plays preloaded sounds through pygame, one reserved mixer channel
+    per output. Tones missing from the sound directory are synthesised in
+    memory (and cached there) instead of needing generate_assets.py first.
+    """
+
+    def __init__(self, sound_dir, buffer_size):
+        import pygame
+        self.pygame = pygame
 
-class SoundManager:
-    def __init__(self, sound_dir="sounds"):
-        self.sound_dir = sound_dir
         # Initialize mixer with specific settings for better compatibility
-        try:
-            pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=4096)
-        except Exception as e:
-            print(f"Failed to initialize pygame mixer: {e}")
-            
+        pygame.mixer.init(frequency=config.AUDIO_FREQUENCY, size=-16, channels=2, buffer=buffer_size)
+        pygame.mixer.set_reserved(len(OUTPUTS))
+        # Audio sitting in the mixer buffer before it reaches the speaker
+        self.buffer_latency = buffer_size / config.AUDIO_FREQUENCY
+        self.channels = {output: pygame.mixer.Channel(i) for i, output in enumerate(OUTPUTS)}
         self.sounds = {}
-        self.load_sounds()
-        self.playing = False
-        self.lock = threading.Lock()
+        self.load_sounds(sound_dir)
 
-    def load_sounds(self):
-        # Load sounds if they exist
+    def load_sounds(self, sound_dir):
         # Expected files: alert_short.wav, alert_long.wav
-        files = {
-            "short": "alert_short.wav",
-            "long": "alert_long.wav"
-        }
-        for name, filename in files.items():
-            path = os.path.join(self.sound_dir, filename)
-            if os.path.exists(path):
-                try:
-                    self.sounds[name] = pygame.mixer.Sound(path)
-                except Exception as e:
-                    print(f"Error loading sound {path}: {e}")
-            else:
-                print(f"Sound file not found: {path}")
+        frequency, _, channels = self.pygame.mixer.get_init()
+        for name in tones.TONES:
+            path = tones.tone_path(name, sound_dir)
+            try:
+                samples = tones.load_tone(name, frequency, channels, sound_dir)
+                if samples is not None:
+                    self.sounds[name] = self.pygame.mixer.Sound(buffer=samples.tobytes())
+                else:
+                    self.sounds[name] = self.pygame.mixer.Sound(path)
+            except Exception as e:
+                print(f"Error loading sound {path}: {e}")
+
+    def play(self, output, level):
+        if level in self.sounds:
+            self.channels[output].play(self.sounds[level])
+        else:
+            _play_fallback(level)
+
+    def stop(self, output=None):
+        for name, channel in self.channels.items():
+            if output is None or name == output:
+                channel.stop()
+
+    def is_busy(self, output):
+        return self.channels[output].get_busy()
+
+    def close(self):
+        self.pygame.mixer.quit()
+
+
+class NullAudioBackend:
+    """
+    Plays nothing but keeps a log of (time, output, level) for the last
+    config.AUDIO_EVENT_LOG_SIZE alerts, so alert timing can be measured and
+    tested without a sound device.
+    """
+
+    def __init__(self):
+        self.buffer_latency = 0.0
+        self.events = deque(maxlen=config.AUDIO_EVENT_LOG_SIZE)
+        self._busy_until = {output: 0.0 for output in OUTPUTS}
+
+    def play(self, output, level):
+        now = time.monotonic()
+        self.events.append((now, output, level))
+        self._busy_until[output] = now + DURATIONS[level]
+        self._write(now, output, level)
+
+    def _write(self, now, output, level):
+        pass
+
+    def stop(self, output=None):
+        for name in self._busy_until:
+            if output is None or name == output:
+                self._busy_until[name] = 0.0
+
+    def is_busy(self, output):
+        return time.monotonic() < self._busy_until[output]
+
+    def close(self):
+        pass
+
+
+class FileAudioBackend(NullAudioBackend):
+    """
+    Null backend that also appends every alert to a log file.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.file = open(path, "a", buffering=1)
+
+    def _write(self, now, output, level):
+        self.file.write(f"{now:.6f} {output} {level}\n")
+
+    def close(self):
+        self.file.close()
+
+
+def _play_fallback(level):
+    try:
+        import winsound
+        freq = 1000 if level == 'short' else 2000
+        dur = 500 if level == 'short' else 1500
+        winsound.Beep(freq, dur)
+    except ImportError:
+        pass # winsound only on Windows
+    except Exception as e:
+        print(f"Fallback sound error: {e}")
+
+
+class SoundManager:
+    """
+    Alert playback through a single long-lived audio worker.
+    Requests go into a priority queue and return immediately; the worker
+    starts them on the driver or passenger channel, letting a critical
+    (long) alert cut off a short one but never the other way round.
+    The time from request to playback start is recorded per alert.
+    """
+
+    def __init__(self, sound_dir=None, backend=None, buffer_size=None):
+        self.sound_dir = sound_dir or config.SOUND_DIR
+        self.backend = self._create_backend(backend or config.AUDIO_BACKEND,
+                                            buffer_size or config.AUDIO_BUFFER)
+
+        self.playing = {output: None for output in OUTPUTS}
+        self.latencies = deque(maxlen=256)
+        self.queue = queue.PriorityQueue()
+        self._seq = 0
+        self.lock = threading.Lock()
+
+        self.worker = threading.Thread(target=self._run, name="audio", daemon=True)
+        self.worker.start()
+
+    def _create_backend(self, name, buffer_size):
+        if name == "pygame":
+            try:
+                return PygameAudioBackend(self.sound_dir, buffer_size)
+            except ImportError:
+                print("pygame is not installed, alerts will not be audible.")
+                return NullAudioBackend()
+            except Exception as e:
+                print(f"Failed to initialize pygame mixer: {e}")
+                return NullAudioBackend()
+        if name == "file":
+            return FileAudioBackend(config.AUDIO_LOG_FILE)
+        if name == "null":
+            return NullAudioBackend()
+        raise ValueError(f"Unknown audio backend: {name}")
 
     def play_driver_short_alarm(self):
         """Plays a short alert for the driver."""
-        self.play_alert('short')
+        self.play_alert('short', 'driver')
 
     def play_driver_long_alarm(self):
         """Plays a long alert for the driver."""
-        self.play_alert('long')
+        self.play_alert('long', 'driver')
 
     def play_passenger_long_alarm(self):
         """Plays a long alert for passengers (e.g. bus speaker)."""
-        # Currently uses the same sound, but logic is separated for future hardware routing.
-        self.play_alert('long')
+        self.play_alert('long', 'passenger')
 
-    def play_alert(self, level):
+    def play_alert(self, level, output='driver'):
         """
-        Plays an alert based on the level.
+        Queues an alert and returns immediately.
         level: 'short' or 'long'
+        output: 'driver' or 'passenger'
         """
         with self.lock:
-            # Always interrupt current sound to ensure new alert (especially Critical) is played
-            if self.playing:
-                try:
-                    pygame.mixer.stop()
-                except:
-                    pass
-                self.playing = False
-
-            self.playing = True
-        
-        # Play in a separate thread
-        threading.Thread(target=self._play_thread, args=(level,), daemon=True).start()
-
-    def _play_thread(self, level):
-        try:
-            if level in self.sounds:
-                sound = self.sounds[level]
-                channel = sound.play()
-                if channel:
-                    while channel.get_busy():
-                        pygame.time.wait(100)
-            else:
-                self._play_fallback(level)
-        except Exception as e:
-            print(f"Error playing sound: {e}")
-        finally:
-            with self.lock:
-                self.playing = False
-
-    def _play_fallback(self, level):
-        try:
-            import winsound
-            freq = 1000 if level == 'short' else 2000
-            dur = 500 if level == 'short' else 1500
-            winsound.Beep(freq, dur)
-        except ImportError:
-            pass # winsound only on Windows
-        except Exception as e:
-            print(f"Fallback sound error: {e}")
+            self._seq += 1
+            seq = self._seq
+        self.queue.put((PRIORITY[level], seq, output, level, time.monotonic()))
+
+    def _run(self):
+        while True:
+            priority, _, output, level, requested = self.queue.get()
+            if level is None:
+                break
+            try:
+                current = self.playing[output]
+                if current is not None and self.backend.is_busy(output):
+                    if PRIORITY[current] < priority:
+                        # Never cut off a critical alert with a short one
+                        continue
+                    self.backend.stop(output)
+
+                self.backend.play(output, level)
+                self.playing[output] = level
+                self.latencies.append(time.monotonic() - requested)
+            except Exception as e:
+                print(f"Error playing sound: {e}")
+
+    def latency_stats(self):
+        """
+        Request-to-playback latency of recent alerts, in milliseconds.
+        """
+        if not self.latencies:
+            return {"count": 0}
+        values = sorted(self.latencies)
+        return {
+            "count": len(values),
+            "mean_ms": 1000.0 * sum(values) / len(values),
+            "max_ms": 1000.0 * values[-1],
+            "buffer_ms": 1000.0 * self.backend.buffer_latency,
+        }
 
     def stop(self):
         try:
-            pygame.mixer.stop()
-        except:
+            self.backend.stop()
+        except Exception:
             pass
-        with self.lock:
-            self.playing = False
+        self.playing = {output: None for output in OUTPUTS}
+
+    def close(self):
+        self.stop()
+        # Stop item sorts after every real alert
+        self.queue.put((len(PRIORITY), float("inf"), None, None, 0.0))
+        self.worker.join(timeout=1.0)
+        self.backend.close()
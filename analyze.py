@@ -0,0 +1,158 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import config
+from seat import IdentityMap
+from smoothing import SignalStage
+from state_tracker import StateTracker
+
+# Output columns in file order
+FEATURE_COLUMNS = ["ear", "mar", "pitch", "yaw", "roll"]
+STATE_COLUMNS = ["overall", "eye", "yawn", "nod"]
+
+
+def analyze_video(path):
+    """
+    Streams a recorded video through DrowsinessDetector, the SignalStage
+    (with config.SMOOTHING_ENABLED) and StateTracker as fast as the CPU
+    allows, per face as main.py does. The tracker runs on the video clock,
+    so alarm cooldowns match what would have happened live.
+    Returns a dict of per-frame column arrays; ear/mar/pitch are the
+    driver's values as the tracker saw them ("conditioned" says whether
+    they went through the SignalStage).
+    """
+    from detector import DrowsinessDetector
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video: {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    detector = DrowsinessDetector()
+    trackers = IdentityMap(StateTracker)
+    signal_stages = IdentityMap(SignalStage)
+
+    timestamps = []
+    face_counts = []
+    features = []
+    states = []
+    actions = []
+
+    frame_idx = 0
+    while True:
+        success, image = cap.read()
+        if not success:
+            break
+        timestamp = frame_idx / fps
+
+        results, image = detector.detect(image)
+        img_h, img_w, _ = image.shape
+        faces = detector.extract_features(results, img_w, img_h)
+
+        # Default info, as in the live loop
+        status_info = {
+            "overall": StateTracker.STATE_NORMAL,
+            "eye": StateTracker.STATE_NONE,
+            "yawn": StateTracker.STATE_NONE,
+            "nod": StateTracker.STATE_NONE,
+            "action": None
+        }
+        row = (np.nan,) * len(FEATURE_COLUMNS)
+        for face_index, face in enumerate(faces):
+            ear, mar, pitch = face["ear"], face["mar"], face["pitch"]
+            if config.SMOOTHING_ENABLED:
+                ear, mar, pitch = signal_stages.get(face["identity"], timestamp).process(ear, mar, pitch, timestamp)
+            face_status = trackers.get(face["identity"], timestamp).update(ear, mar, pitch, timestamp)
+            # The driver's (first) face, as in the live loop
+            if face_index == 0:
+                status_info = face_status
+                row = tuple(dict(face, ear=ear, mar=mar, pitch=pitch)[name] for name in FEATURE_COLUMNS)
+
+        timestamps.append(timestamp)
+        face_counts.append(len(faces))
+        features.append(row)
+        states.append(tuple(StateTracker.STATE_CODES[status_info[name]] for name in STATE_COLUMNS))
+        actions.append(StateTracker.ACTION_CODES[status_info["action"]])
+        frame_idx += 1
+
+    cap.release()
+
+    features = np.asarray(features, dtype=np.float32).reshape(-1, len(FEATURE_COLUMNS))
+    states = np.asarray(states, dtype=np.int8).reshape(-1, len(STATE_COLUMNS))
+    columns = {
+        "frame": np.arange(frame_idx, dtype=np.int32),
+        "timestamp": np.asarray(timestamps, dtype=np.float64),
+        "faces": np.asarray(face_counts, dtype=np.int8),
+    }
+    for i, name in enumerate(FEATURE_COLUMNS):
+        columns[name] = features[:, i]
+    for i, name in enumerate(STATE_COLUMNS):
+        columns[name] = states[:, i]
+    columns["action"] = np.asarray(actions, dtype=np.int8)
+    columns["conditioned"] = np.full(frame_idx, config.SMOOTHING_ENABLED, dtype=np.int8)
+    return columns
+
+
+def write_columns(columns, out_path, fmt):
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+        pq.write_table(pa.table(columns), out_path, compression="zstd")
+    else:
+        # Store the code tables alongside the data so the file is self-describing
+        state_names = sorted(StateTracker.STATE_CODES, key=StateTracker.STATE_CODES.get)
+        action_names = [action or "" for action in StateTracker.ACTIONS]
+        np.savez_compressed(
+            out_path,
+            state_names=np.array(state_names),
+            action_names=np.array(action_names),
+            **columns
+        )
+
+
+def _process_file(args):
+    path, out_dir, fmt = args
+    start = time.perf_counter()
+    columns = analyze_video(path)
+    elapsed = time.perf_counter() - start
+
+    base = os.path.splitext(os.path.basename(path))[0]
+    out_path = os.path.join(out_dir, f"{base}.{fmt}")
+    write_columns(columns, out_path, fmt)
+    return path, out_path, len(columns["frame"]), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless drowsiness analysis of recorded video.")
+    parser.add_argument("videos", nargs="+", help="Video files to analyse")
+    parser.add_argument("-o", "--output-dir", default="analysis", help="Directory for the per-video output files")
+    parser.add_argument("-f", "--format", choices=["npz", "parquet"], default="npz", help="Output file format")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of videos processed in parallel")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [(path, args.output_dir, args.format) for path in args.videos]
+
+    start = time.perf_counter()
+    total_frames = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(jobs)))) as pool:
+        for path, out_path, frames, elapsed in pool.map(_process_file, jobs):
+            total_frames += frames
+            fps = frames / elapsed if elapsed > 0 else 0.0
+            print(f"{path}: {frames} frames in {elapsed:.1f}s ({fps:.1f} FPS) -> {out_path}")
+    elapsed = time.perf_counter() - start
+
+    fps = total_frames / elapsed if elapsed > 0 else 0.0
+    print(f"Total: {total_frames} frames in {elapsed:.1f}s ({fps:.1f} FPS)")
+
+
+if __name__ == "__main__":
+    main()
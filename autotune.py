@@ -0,0 +1,514 @@
+import argparse
+import hashlib
+import importlib.metadata
+import json
+import os
+import platform
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import config
+from sources import CameraSource, SyntheticSource, open_source
+
+# Knobs in the order they are given up when the target is missed: the
+# first costs no accuracy at all (drawing), the last the most (landmark model)
+KNOBS = ["render_level", "tracking_confidence", "roi_size", "resolution", "interval", "backend"]
+
+
+def candidates():
+    """
+    Values per knob, most accurate (or richest) first.
+    """
+    render_levels = ["none"] if config.HEADLESS else list(config.AUTOTUNE_RENDER_LEVELS)
+    return {
+        "render_level": render_levels,
+        "tracking_confidence": list(config.AUTOTUNE_TRACKING_CONFIDENCES),
+        "roi_size": list(config.AUTOTUNE_ROI_SIZES),
+        "resolution": [tuple(r) for r in config.AUTOTUNE_RESOLUTIONS],
+        "interval": list(config.AUTOTUNE_INTERVALS),
+        "backend": list(config.AUTOTUNE_BACKENDS),
+    }
+
+
+def _package_version(name):
+    # From the package metadata, so mediapipe is not imported just for this
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return "none"
+
+
+def machine_key():
+    """
+    Identifies this machine, the libraries doing the work and the tuning
+    targets, so a cached profile is only reused where it was measured and
+    for what it was measured.
+    """
+    parts = [
+        platform.node(), platform.machine(), platform.processor(), str(os.cpu_count()),
+        cv2.__version__, np.__version__, _package_version("mediapipe"),
+        str(config.AUTOTUNE_TARGET_FPS), str(config.AUTOTUNE_MAX_LATENCY_MS),
+        json.dumps(candidates(), sort_keys=True),
+    ]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def load_profile(path=None):
+    path = path or config.AUTOTUNE_PROFILE_FILE
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f).get(machine_key())
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable tuning profile {path}: {e}")
+        return None
+
+
+def save_profile(profile, path=None):
+    path = path or config.AUTOTUNE_PROFILE_FILE
+    profiles = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            pass
+    if profile is None:
+        profiles.pop(machine_key(), None)
+    else:
+        profiles[machine_key()] = profile
+    with open(path, "w") as f:
+        json.dump(profiles, f, indent=2)
+
+
+def invalidate_profile(path=None):
+    """
+    Drops this machine's cached profile, so the next start tunes again.
+    """
+    save_profile(None, path)
+
+
+def apply_profile(profile):
+    """
+    Writes a profile's settings into config, before the detector, camera
+    and renderer are created.
+    """
+    settings = profile["settings"]
+    config.RENDER_LEVEL = settings["render_level"]
+    config.FACEMESH_MIN_TRACKING_CONFIDENCE = settings["tracking_confidence"]
+    config.ROI_MAX_SIZE = settings["roi_size"]
+    config.CAMERA_WIDTH, config.CAMERA_HEIGHT = settings["resolution"]
+    config.SCHED_MAX_INTERVAL = settings["interval"]
+    config.ADAPTIVE_INFERENCE = settings["interval"] > 1
+    config.LANDMARK_BACKEND = settings["backend"]
+
+
+def face_frames(count, width, height, path=None):
+    """
+    Synthetic frames with the face photo at `path` (default
+    config.AUTOTUNE_FACE_IMAGE) pasted in, or None without a readable one.
+    """
+    path = path or config.AUTOTUNE_FACE_IMAGE
+    face_image = cv2.imread(path) if path else None
+    if face_image is None:
+        if path:
+            print(f"Could not read calibration face image {path}")
+        return None
+    source = SyntheticSource(width, height, count, face_image=face_image)
+    return [source.read()[1].copy() for _ in range(count)]
+
+
+def _repeat(frames, count):
+    frames = list(frames)
+    while len(frames) < count:
+        frames.append(frames[len(frames) % max(1, len(frames))])
+    return frames
+
+
+def calibration_frames(spec=None, count=None):
+    """
+    A short run of frames to tune on: from the camera (at the largest
+    candidate resolution), a video/image source, or synthetic frames.
+    tune() keeps only the frames with a face in them (see
+    Calibrator.face_mask).
+    """
+    count = count or config.AUTOTUNE_FRAMES
+    spec = config.AUTOTUNE_SOURCE if spec is None else spec
+    if spec is None:
+        spec = config.FRAME_SOURCE
+    width, height = max(tuple(r) for r in config.AUTOTUNE_RESOLUTIONS)
+
+    if spec is None or isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        source = CameraSource(config.CAMERA_INDEX if spec is None else int(spec), width, height)
+    elif spec == "synthetic":
+        source = SyntheticSource(width, height, count)
+    else:
+        source = open_source(spec)
+
+    frames = []
+    attempts = 0
+    try:
+        while len(frames) < count and attempts < 2 * count:
+            attempts += 1
+            success, frame = source.read()
+            if success:
+                # Sources reuse their buffers once recycled
+                frames.append(frame.copy())
+                source.recycle(frame)
+            elif not source.live:
+                break
+    finally:
+        source.release()
+
+    if not frames:
+        print("No calibration frames from the source, tuning on synthetic frames.")
+        frames = face_frames(count, width, height)
+        if frames is None:
+            source = SyntheticSource(width, height, count)
+            frames = [source.read()[1].copy() for _ in range(count)]
+    return _repeat(frames, count)
+
+
+class Calibrator:
+    """
+    Measures candidate settings on the calibration frames. Per frame, the
+    cost is detection, features, tracker and drawing run back to back on
+    one thread. The live pipeline overlaps them on separate threads, so
+    this errs on the safe side.
+    """
+
+    def __init__(self, frames):
+        self.detectors = {}
+        self.set_frames(frames)
+
+    def set_frames(self, frames):
+        """
+        Measures on `frames` from now on; earlier results are dropped.
+        """
+        self.frames = frames
+        self.native = frames[0].shape[1], frames[0].shape[0]
+        self.scaled = {}
+        self.results = {}
+        self.reference_features = None
+
+    def face_mask(self):
+        """
+        Per calibration frame, whether the first measured setting found a
+        face in it.
+        """
+        return ~np.isnan(self.reference_features[:, 0])
+
+    def _detector(self, backend, tracking_confidence):
+        key = (backend, tracking_confidence)
+        if key not in self.detectors:
+            from detector import DrowsinessDetector
+
+            try:
+                detector = DrowsinessDetector(backend=backend, min_tracking_confidence=tracking_confidence)
+            except (RuntimeError, OSError) as e:
+                print(f"Skipping landmark backend {backend}: {e}")
+                detector = None
+            self.detectors[key] = detector
+        return self.detectors[key]
+
+    def _frames_at(self, resolution):
+        if resolution not in self.scaled:
+            if resolution == self.native:
+                self.scaled[resolution] = self.frames
+            else:
+                self.scaled[resolution] = [cv2.resize(frame, resolution, interpolation=cv2.INTER_AREA)
+                                           for frame in self.frames]
+        return self.scaled[resolution]
+
+    def measure(self, settings):
+        """
+        Returns a result dict for `settings`, or None when the setting
+        cannot run here (e.g. a backend without its model files).
+        """
+        key = json.dumps(settings, sort_keys=True)
+        if key in self.results:
+            return self.results[key]
+
+        from renderer import render
+        from scheduler import AdaptiveScheduler
+        from state_tracker import StateTracker
+
+        detector = self._detector(settings["backend"], settings["tracking_confidence"])
+        if detector is None:
+            self.results[key] = None
+            return None
+        roi_max_size = config.ROI_MAX_SIZE
+        config.ROI_MAX_SIZE = settings["roi_size"]
+        try:
+            frames = self._frames_at(tuple(settings["resolution"]))
+            detector._face_box = None
+            scheduler = AdaptiveScheduler(detector, max_interval=settings["interval"]) \
+                if settings["interval"] > 1 else None
+            tracker = StateTracker()
+            canvas = np.empty_like(frames[0])
+            img_h, img_w = frames[0].shape[:2]
+
+            warmup = min(5, len(frames) // 4)
+            durations = []
+            inference = []
+            features = []
+            for i, frame in enumerate(frames):
+                timestamp = i / 30.0
+                start = time.perf_counter()
+                if scheduler is not None:
+                    results, _, faces, _ = scheduler.process(frame, timestamp)
+                else:
+                    results, _ = detector.detect(frame)
+                    faces = detector.extract_features(results, img_w, img_h)
+                inferred = time.perf_counter()
+                status_info = {"overall": "NORMAL", "eye": "NONE", "yawn": "NONE", "nod": "NONE", "action": None}
+                for face in faces:
+                    status_info = tracker.update(face["ear"], face["mar"], face["pitch"], timestamp)
+                if scheduler is not None:
+                    scheduler.notify_state(status_info["overall"])
+                duration = time.perf_counter() - start
+                if settings["render_level"] != "none":
+                    # The copy is not timed; the pipeline draws on the frame itself
+                    np.copyto(canvas, frame)
+                    drawn = time.perf_counter()
+                    render(detector, canvas, results, faces, status_info, settings["render_level"])
+                    duration += time.perf_counter() - drawn
+                if i >= warmup:
+                    durations.append(duration)
+                    inference.append(inferred - start)
+                features.append((faces[0]["ear"], faces[0]["mar"]) if faces else (np.nan, np.nan))
+        finally:
+            config.ROI_MAX_SIZE = roi_max_size
+
+        durations = np.array(durations)
+        result = {
+            "fps": float(len(durations) / durations.sum()),
+            "p95_ms": float(1000.0 * np.percentile(durations, 95)),
+            "inference_ms": float(1000.0 * np.mean(inference)),
+        }
+        result["meets_target"] = (result["fps"] >= config.AUTOTUNE_TARGET_FPS
+                                  and result["p95_ms"] <= config.AUTOTUNE_MAX_LATENCY_MS)
+
+        # Drift from the most accurate setting on the same frames, where both found a face
+        features = np.array(features)
+        if self.reference_features is None:
+            self.reference_features = features
+        both = ~np.isnan(features[:, 0]) & ~np.isnan(self.reference_features[:, 0])
+        if both.any():
+            errors = np.abs(features[both] - self.reference_features[both]).mean(axis=0)
+            result["ear_error"], result["mar_error"] = float(errors[0]), float(errors[1])
+        result["face_rate"] = float(np.mean(~np.isnan(features[:, 0])))
+        self.results[key] = result
+        return result
+
+
+def tune(frames=None, verbose=True):
+    """
+    Finds the most accurate settings that meet config.AUTOTUNE_TARGET_FPS
+    and config.AUTOTUNE_MAX_LATENCY_MS. Knobs are given up one step at a
+    time in KNOBS order until the target is met; then every knob given up
+    before the last one is restored as far as the target still allows.
+    Returns the profile dict.
+    """
+    if frames is None:
+        frames = calibration_frames()
+    calibrator = Calibrator(frames)
+    values = candidates()
+    native = calibrator.native
+    # Resolutions above what the source delivers cannot be had by asking the camera
+    fitting = [r for r in values["resolution"] if r[0] <= native[0] and r[1] <= native[1]]
+    values["resolution"] = fitting or [min(values["resolution"])]
+
+    steps = {knob: 0 for knob in KNOBS}
+
+    def settings_for(steps):
+        return {knob: values[knob][steps[knob]] for knob in KNOBS}
+
+    def evaluate(steps):
+        settings = settings_for(steps)
+        result = calibrator.measure(settings)
+        if verbose and result is not None:
+            print(f"  {settings}: {result['fps']:.1f} FPS, p95 {result['p95_ms']:.1f} ms"
+                  + ("" if result["meets_target"] else "  (misses target)"))
+        return result
+
+    # Start from the most accurate backend that can run here
+    result = evaluate(steps)
+    while result is None and steps["backend"] + 1 < len(values["backend"]):
+        steps["backend"] += 1
+        result = evaluate(steps)
+    if result is None:
+        raise RuntimeError("No landmark backend in config.AUTOTUNE_BACKENDS can run here")
+
+    # Time frames with a face only: without one FaceMesh skips the landmark
+    # model, which makes the load look lighter than with a driver in the seat
+    faces = calibrator.face_mask()
+    if not faces.any():
+        synthetic = face_frames(len(frames), native[0], native[1])
+        if synthetic is not None:
+            print("No face in the calibration frames, tuning on synthetic frames with config.AUTOTUNE_FACE_IMAGE.")
+            calibrator.set_frames(synthetic)
+            result = evaluate(steps)
+            faces = calibrator.face_mask()
+    if not faces.any():
+        print("Warning: no face in the calibration frames; the tuned settings may be too slow with a driver. "
+              "Set config.AUTOTUNE_FACE_IMAGE to a face photo to tune on one.")
+    elif not faces.all():
+        calibrator.set_frames(_repeat([f for f, face in zip(calibrator.frames, faces) if face], len(faces)))
+        result = evaluate(steps)
+
+    last_knob = None
+    while not result["meets_target"]:
+        knob = next((k for k in KNOBS if steps[k] + 1 < len(values[k])), None)
+        if knob is None:
+            print("Warning: even the cheapest settings miss the target; using them.")
+            break
+        steps[knob] += 1
+        last_knob = knob
+        candidate = evaluate(steps)
+        if candidate is None:
+            continue
+        result = candidate
+
+    if last_knob is not None and result["meets_target"]:
+        # Win back accuracy on the knobs given up earlier
+        for knob in reversed(KNOBS[:KNOBS.index(last_knob)]):
+            while steps[knob] > 0:
+                steps[knob] -= 1
+                candidate = evaluate(steps)
+                if candidate is None or not candidate["meets_target"]:
+                    steps[knob] += 1
+                    break
+                result = candidate
+
+    settings = settings_for(steps)
+    settings["resolution"] = list(settings["resolution"])
+    return {
+        "settings": settings,
+        "result": result,
+        "target_fps": config.AUTOTUNE_TARGET_FPS,
+        "max_latency_ms": config.AUTOTUNE_MAX_LATENCY_MS,
+        "frame_size": list(native),
+        "created": time.time(),
+    }
+
+
+def load_or_tune(force=False, verbose=True):
+    """
+    This machine's cached profile, or a fresh one (cached for next time).
+    """
+    profile = None if force else load_profile()
+    if profile is None:
+        print("Tuning performance settings for this machine...")
+        start = time.monotonic()
+        profile = tune(verbose=verbose)
+        try:
+            save_profile(profile)
+        except OSError as e:
+            print(f"Could not cache tuning profile: {e}")
+        print(f"Tuned in {time.monotonic() - start:.1f} s: {profile['settings']}")
+    return profile
+
+
+class DriftMonitor:
+    """
+    Watches the live inference time of frames with a face in them. The
+    first window of config.AUTOTUNE_DRIFT_WINDOW such frames sets the
+    baseline, so it is measured on this camera with the driver in view
+    rather than on the calibration frames. A later window whose mean is
+    more than config.AUTOTUNE_DRIFT_FACTOR times slower (thermal
+    throttling, other load) or faster (load gone) counts as drift.
+    """
+
+    def __init__(self, profile, window=None, factor=None):
+        self.profile = profile
+        self.expected = None
+        self.window = deque(maxlen=window or config.AUTOTUNE_DRIFT_WINDOW)
+        self.factor = factor or config.AUTOTUNE_DRIFT_FACTOR
+        self.drift_events = 0
+
+    def rebase(self):
+        """
+        Takes the next full window as the new baseline, e.g. after the
+        settings were stepped down.
+        """
+        self.expected = None
+        self.window.clear()
+
+    def observe(self, inference_time, face=True):
+        """
+        Returns "slow" or "fast" once a full window has drifted, else None.
+        Frames without a face (or with estimated features) are skipped.
+        """
+        if not face:
+            return None
+        self.window.append(inference_time)
+        if len(self.window) < self.window.maxlen:
+            return None
+        mean = sum(self.window) / len(self.window)
+        self.window.clear()
+        if self.expected is None:
+            self.expected = mean
+            return None
+        ratio = mean / self.expected
+        if ratio > self.factor:
+            self.drift_events += 1
+            return "slow"
+        if ratio < 1.0 / self.factor:
+            self.drift_events += 1
+            return "fast"
+        return None
+
+
+def step_down(scheduler=None, renderer=None):
+    """
+    Gives up one step of the knobs that can change while running: the
+    overlay level, the ROI size, then the inference interval. Returns a
+    description of the change, or None when nothing is left to give up.
+    """
+    if renderer is not None:
+        levels = list(config.AUTOTUNE_RENDER_LEVELS)
+        if renderer.level in levels and levels.index(renderer.level) + 1 < len(levels):
+            renderer.level = levels[levels.index(renderer.level) + 1]
+            return f"render level {renderer.level}"
+    sizes = list(config.AUTOTUNE_ROI_SIZES)
+    if config.ROI_MAX_SIZE in sizes and sizes.index(config.ROI_MAX_SIZE) + 1 < len(sizes):
+        config.ROI_MAX_SIZE = sizes[sizes.index(config.ROI_MAX_SIZE) + 1]
+        return f"ROI size {config.ROI_MAX_SIZE}"
+    if scheduler is not None and scheduler.max_interval < max(config.AUTOTUNE_INTERVALS):
+        scheduler.max_interval += 1
+        return f"inference interval {scheduler.max_interval}"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune capture, model and display settings to a target FPS.")
+    parser.add_argument("--source", default=None,
+                        help="Frames to tune on: camera index, video, image directory or \"synthetic\"")
+    parser.add_argument("--frames", type=int, default=None, help="Calibration frames per setting")
+    parser.add_argument("--fps", type=float, default=None, help="Target FPS (default: config.AUTOTUNE_TARGET_FPS)")
+    parser.add_argument("--latency", type=float, default=None, help="p95 frame time limit in ms")
+    parser.add_argument("--face-image", default=None,
+                        help="Face photo for synthetic frames when the source shows no face")
+    parser.add_argument("--no-cache", action="store_true", help="Do not write the profile file")
+    args = parser.parse_args()
+
+    if args.face_image:
+        config.AUTOTUNE_FACE_IMAGE = args.face_image
+    if args.fps:
+        config.AUTOTUNE_TARGET_FPS = args.fps
+    if args.latency:
+        config.AUTOTUNE_MAX_LATENCY_MS = args.latency
+    profile = tune(calibration_frames(args.source, args.frames))
+    print(json.dumps(profile, indent=2))
+    if not args.no_cache:
+        save_profile(profile)
+        print(f"Saved to {config.AUTOTUNE_PROFILE_FILE} for machine {machine_key()}")
+
+
+if __name__ == "__main__":
+    main()
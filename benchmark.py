@@ -0,0 +1,359 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import config
+from detector import (DetectionResult, DrowsinessDetector, LEFT_EYE, RIGHT_EYE,
+                      MOUTH_INDICES, POSE_INDICES, pose_image_points)
+from pose import MODEL_POINTS
+from sources import SyntheticSource, VideoFileSource
+from state_tracker import BatchStateTracker, StateTracker
+
+NUM_LANDMARKS = 478
+
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+
+
+def synthetic_landmarks(frames, img_w=640, img_h=480, seed=0):
+    """
+    Generates a (frames, 478, 3) landmark sequence with a plausible head
+    pose and eye/mouth geometry: the pose points are projections of the
+    3D model, and EAR/MAR drift between open and closed values.
+    """
+    rng = np.random.default_rng(seed)
+    camera_matrix = np.array([[img_w, 0, img_w / 2], [0, img_w, img_h / 2], [0, 0, 1]], dtype=np.float64)
+    scale = np.array([img_w, img_h], dtype=np.float64)
+
+    out = np.empty((frames, NUM_LANDMARKS, 3), dtype=np.float32)
+    base = rng.uniform(0.35, 0.65, size=(NUM_LANDMARKS, 3))
+    base[:, 2] = rng.normal(scale=0.02, size=NUM_LANDMARKS)
+
+    for i in range(frames):
+        phase = i / 30.0
+        rvec = np.array([np.pi + 0.15 * np.sin(phase * 0.7), 0.2 * np.sin(phase * 0.3), 0.05 * np.sin(phase)])
+        tvec = np.array([0.0, 0.0, 3000.0])
+        projected, _ = cv2.projectPoints(MODEL_POINTS, rvec, tvec, camera_matrix, np.zeros(4))
+        projected = projected.reshape(-1, 2)
+
+        points = base.copy()
+        points[:, :2] += rng.normal(scale=0.001, size=(NUM_LANDMARKS, 2))
+        points[POSE_INDICES, :2] = projected / scale
+
+        # Eyes: outer corners come from the pose points, inner corners
+        # part way towards the other eye
+        ear = 0.3 if (i // 45) % 4 else 0.12
+        left_outer, right_outer = projected[2], projected[3]
+        for indices, outer, other, outer_is_p1 in ((LEFT_EYE, left_outer, right_outer, False),
+                                                   (RIGHT_EYE, right_outer, left_outer, True)):
+            inner = outer + 0.4 * (other - outer)
+            p1, p4 = (outer, inner) if outer_is_p1 else (inner, outer)
+            d = p4 - p1
+            n = np.array([-d[1], d[0]]) * (ear / 2.0)
+            eye = [p1, p1 + d / 3 - n, p1 + 2 * d / 3 - n, p4, p1 + 2 * d / 3 + n, p1 + d / 3 + n]
+            points[indices, :2] = np.array(eye) / scale
+
+        # Mouth: corners from the pose points, opening varies
+        mar = 0.7 if (i // 60) % 5 == 0 else 0.2
+        left, right = projected[4], projected[5]
+        mid = (left + right) / 2.0
+        d = right - left
+        n = np.array([-d[1], d[0]]) * (mar / 2.0)
+        points[MOUTH_INDICES[0], :2] = (mid - n) / scale
+        points[MOUTH_INDICES[1], :2] = (mid + n) / scale
+
+        out[i] = points
+    return out
+
+
+def to_landmark_list(points):
+    """
+    Wraps a (478, 3) array in a MediaPipe NormalizedLandmarkList.
+    """
+    from mediapipe.framework.formats import landmark_pb2
+
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z in points.tolist():
+        landmark_list.landmark.add(x=x, y=y, z=z)
+    return landmark_list
+
+
+def synthetic_frames(count, img_w, img_h, face_image=None, seed=0):
+    """
+    Noise frames, with `face_image` pasted into the middle when given.
+    """
+    # Never recycled, so the list holds distinct frames
+    source = SyntheticSource(img_w, img_h, count, face_image, seed)
+    return [source.read()[1] for _ in range(count)]
+
+
+def summarize(durations, items_per_call=1):
+    """
+    Throughput and latency percentiles from per-call durations in seconds.
+    """
+    values = np.asarray(durations, dtype=np.float64)
+    total = values.sum()
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000.0
+    return {
+        "calls": int(len(values)),
+        "throughput_per_s": float(len(values) * items_per_call / total) if total > 0 else float("inf"),
+        "mean_ms": float(values.mean() * 1000.0),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def measure(fn, args_list, warmup=10, items_per_call=1):
+    """
+    Calls fn(*args) for every entry in args_list and times each call.
+    """
+    for args in args_list[:warmup]:
+        fn(*args)
+    durations = []
+    perf_counter = time.perf_counter
+    for args in args_list:
+        start = perf_counter()
+        fn(*args)
+        durations.append(perf_counter() - start)
+    return summarize(durations, items_per_call)
+
+
+def bench_features(detector, frames):
+    img_w, img_h = 640, 480
+    points = synthetic_landmarks(frames, img_w, img_h)
+    landmark_lists = [to_landmark_list(p) for p in points[:min(frames, 500)]]
+    rotations = [detector.get_head_pose(p, img_w, img_h)[0] for p in points]
+    results = [DetectionResult([ll], [p], None) for ll, p in zip(landmark_lists, points)]
+
+    single = [(p,) for p in points]
+    return {
+        "landmarks_to_array": measure(detector.landmarks_to_array, [(ll.landmark,) for ll in landmark_lists]),
+        "calculate_ear": measure(detector.calculate_ear, [(p, RIGHT_EYE) for p in points]),
+        "get_eye_landmarks": measure(detector.get_eye_landmarks, single),
+        "calculate_mar": measure(detector.calculate_mar, single),
+        "pose_image_points": measure(pose_image_points, [(p, img_w, img_h) for p in points]),
+        "get_head_pose": measure(detector.get_head_pose, [(p, img_w, img_h) for p in points]),
+        "get_euler_angles": measure(detector.get_euler_angles, [(r,) for r in rotations]),
+        "extract_features": measure(detector.extract_features, [(r, img_w, img_h) for r in results]),
+        "batch_features": measure(detector.batch_features, [(points, img_w, img_h)], warmup=1,
+                                  items_per_call=len(points)),
+    }
+
+
+def bench_tracker(frames):
+    points = synthetic_landmarks(frames)
+    from detector import compute_features
+    features = compute_features(points)
+    pitch = np.where(np.arange(frames) % 200 < 40, -20.0, 5.0)
+    rows = [(float(e), float(m), float(p), i / 30.0)
+            for i, (e, m, p) in enumerate(zip(features["ear"], features["mar"], pitch))]
+
+    results = {}
+    for mode in (StateTracker.MODE_FRAMES, StateTracker.MODE_TIME):
+        tracker = StateTracker(mode=mode)
+        results[f"state_tracker_update[{mode}]"] = measure(tracker.update, rows)
+
+    # Many drivers per tick, each with its own phase of the same stream
+    drivers = 500
+    shifts = np.arange(drivers) * 7
+    ticks = [(features["ear"][(i + shifts) % frames], features["mar"][(i + shifts) % frames],
+              pitch[(i + shifts) % frames], i / 30.0) for i in range(frames)]
+    tracker = BatchStateTracker(drivers)
+    results[f"batch_state_tracker_update[{drivers} drivers]"] = measure(tracker.update, ticks)
+    return results
+
+
+def bench_alerts(count):
+    from alert import SoundManager
+
+    sound_manager = SoundManager(backend="null")
+    enqueue = measure(sound_manager.play_alert, [("long" if i % 2 else "short", "driver") for i in range(count)])
+    time.sleep(0.2)
+    playback = sound_manager.latency_stats()
+    sound_manager.close()
+    return {"play_alert_enqueue": enqueue, "alert_request_to_playback": playback}
+
+
+def bench_detect(frames, face_image):
+    results = {}
+    for img_w, img_h in RESOLUTIONS:
+        detector = DrowsinessDetector()
+        images = synthetic_frames(frames, img_w, img_h, face_image)
+        results[f"detect[{img_w}x{img_h}]"] = measure(detector.detect, [(img,) for img in images])
+    return results
+
+
+def bench_backends(frames, face_image, img_w=640, img_h=480):
+    """
+    Speed of every landmark backend, next to how far its EAR, MAR and pitch
+    are from the reference backend's on the same frames. The errors need
+    frames with a face (`face_image`); on frames where the reference or the
+    backend found none there is nothing to compare, so they are left out.
+    """
+    from landmarks import BACKEND_MESH_REFINED, BACKENDS
+
+    images = synthetic_frames(frames, img_w, img_h, face_image)
+    features = {}
+    results = {}
+    for name in BACKENDS:
+        try:
+            detector = DrowsinessDetector(backend=name)
+        except (RuntimeError, OSError) as e:
+            print(f"Skipping landmark backend {name}: {e}")
+            continue
+        detector.warm_up(img_w, img_h)
+
+        rows = []
+        def step(image):
+            detection, _ = detector.detect(image)
+            faces = detector.extract_features(detection, img_w, img_h)
+            rows.append((faces[0]["ear"], faces[0]["mar"], faces[0]["pitch"]) if faces else (np.nan,) * 3)
+
+        result = measure(step, [(img,) for img in images], warmup=0)
+        features[name] = np.array(rows)
+        result["detection_rate"] = float(np.mean(~np.isnan(features[name][:, 0])))
+
+        reference = features.get(BACKEND_MESH_REFINED)
+        if reference is not None:
+            both = ~np.isnan(reference[:, 0]) & ~np.isnan(features[name][:, 0])
+            if both.any():
+                errors = np.abs(features[name][both] - reference[both])
+                for i, column in enumerate(("ear", "mar", "pitch")):
+                    result[f"{column}_mae"] = float(errors[:, i].mean())
+        results[f"backend[{name}]"] = result
+
+    if not any("ear_mae" in result for result in results.values()):
+        print("No face found on the benchmark frames, so backend accuracy is not compared; "
+              "pass --face-image (or set config.AUTOTUNE_FACE_IMAGE)")
+    return results
+
+
+def bench_end_to_end(frames, face_image, img_w=640, img_h=480, fps=30):
+    """
+    Runs main.run() headless on a video file delivered at a camera's `fps`,
+    so the numbers are steady-state latency rather than how many frames
+    get dropped. The file is an MJPEG clip of the synthetic frames, so
+    capture includes decoding as it does from a file or a USB camera.
+    """
+    import main
+    from clips import write_mjpeg_avi
+
+    config.HEADLESS = True
+    config.AUDIO_BACKEND = "null"
+    config.TELEMETRY_ENABLED = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "e2e.avi")
+        jpegs = [cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, config.CLIP_JPEG_QUALITY])[1].tobytes()
+                 for image in synthetic_frames(frames, img_w, img_h, face_image)]
+        write_mjpeg_avi(path, jpegs, img_w, img_h, fps)
+
+        source = VideoFileSource(path, fps=fps)
+        stats = main.run(source)
+        source.release()
+
+    latencies = stats.pop("latencies")
+    result = summarize(latencies) if latencies else {}
+    result["throughput_per_s"] = stats["inferred"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    result["pipeline"] = stats
+    return {f"end_to_end[{img_w}x{img_h}]": result}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the p50 change against a previous run and returns the names of
+    benchmarks that got slower by more than `tolerance`.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or "p50_ms" not in current or "p50_ms" not in previous:
+            continue
+        change = current["p50_ms"] / previous["p50_ms"] - 1.0 if previous["p50_ms"] > 0 else 0.0
+        marker = " REGRESSION" if change > tolerance else ""
+        print(f"  {name:40s} p50 {previous['p50_ms']:9.4f} -> {current['p50_ms']:9.4f} ms ({change:+.1%}){marker}")
+        if marker:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detector, tracker, alerts and the end-to-end loop.")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="Where to write the JSON results")
+    parser.add_argument("--frames", type=int, default=300, help="Frames per benchmark")
+    parser.add_argument("--face-image", default=config.AUTOTUNE_FACE_IMAGE,
+                        help="Image with a face to paste into the generated frames (default "
+                             "config.AUTOTUNE_FACE_IMAGE); backend accuracy needs one")
+    parser.add_argument("--only", nargs="+", choices=["features", "tracker", "alerts", "detect", "backends", "e2e"],
+                        help="Run only these groups")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Allowed p50 slowdown before flagging")
+    args = parser.parse_args()
+
+    groups = args.only or ["features", "tracker", "alerts", "detect", "backends", "e2e"]
+    face_image = cv2.imread(args.face_image) if args.face_image else None
+
+    results = {}
+    if "features" in groups:
+        results.update(bench_features(DrowsinessDetector(), args.frames))
+    if "tracker" in groups:
+        results.update(bench_tracker(max(args.frames, 1000)))
+    if "alerts" in groups:
+        results.update(bench_alerts(200))
+    if "detect" in groups:
+        results.update(bench_detect(args.frames, face_image))
+    if "backends" in groups:
+        results.update(bench_backends(args.frames, face_image))
+    if "e2e" in groups:
+        results.update(bench_end_to_end(args.frames, face_image))
+
+    for name, result in results.items():
+        if "p50_ms" in result:
+            line = (f"{name:40s} {result['throughput_per_s']:12.1f}/s  p50 {result['p50_ms']:9.4f} ms  "
+                    f"p95 {result['p95_ms']:9.4f} ms  p99 {result['p99_ms']:9.4f} ms")
+            if "detection_rate" in result:
+                line += f"  detected {result['detection_rate']:.0%}"
+                if "ear_mae" in result:
+                    line += (f"  EAR err {result['ear_mae']:.4f}  MAR err {result['mar_mae']:.4f}"
+                             f"  pitch err {result['pitch_mae']:.2f}")
+            print(line)
+        else:
+            print(f"{name:40s} {result}")
+
+    import mediapipe
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "mediapipe": getattr(mediapipe, "__version__", "unknown"),
+            "frames": args.frames,
+            "face_image": args.face_image,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare}:")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
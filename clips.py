@@ -0,0 +1,240 @@
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import config
+from pipeline import FrameHandoff
+
+# Clip container formats for config.CLIP_FORMAT
+FORMAT_MJPEG = "mjpeg"   # AVI holding the ring's JPEGs as they are; no re-encoding
+FORMAT_MP4 = "mp4"       # MPEG-4 Part 2 through cv2.VideoWriter; smaller, costs a decode and encode
+
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+
+
+def _chunk(fourcc, data):
+    return fourcc + struct.pack("<I", len(data)) + data + (b"\0" if len(data) % 2 else b"")
+
+
+def _list(list_type, data):
+    return _chunk(b"LIST", list_type + data)
+
+
+def write_mjpeg_avi(path, jpegs, width, height, fps):
+    """
+    Writes already-encoded JPEG frames into an MJPEG AVI file, so a clip
+    costs no more than writing the bytes out.
+    """
+    fps_milli = max(1, int(round(fps * 1000)))
+    largest = max(len(jpeg) for jpeg in jpegs)
+    avih = struct.pack(
+        "<10I16x", int(1e6 / fps), int(largest * fps), 0, AVIF_HASINDEX, len(jpegs), 0, 1, largest, width, height
+    )
+    strh = struct.pack(
+        "<4s4sIHHIIIIIIIIhhhh", b"vids", b"MJPG", 0, 0, 0, 0, 1000, fps_milli, 0, len(jpegs), largest,
+        0xFFFFFFFF, 0, 0, 0, width, height
+    )
+    strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+    hdrl = _list(b"hdrl", _chunk(b"avih", avih) + _list(b"strl", _chunk(b"strh", strh) + _chunk(b"strf", strf)))
+
+    movi = bytearray(b"movi")
+    index = bytearray()
+    for jpeg in jpegs:
+        # idx1 offsets count from the "movi" tag
+        index += struct.pack("<4sIII", b"00dc", AVIIF_KEYFRAME, len(movi), len(jpeg))
+        movi += _chunk(b"00dc", jpeg)
+
+    body = b"AVI " + hdrl + _chunk(b"LIST", bytes(movi)) + _chunk(b"idx1", bytes(index))
+    with open(path, "wb") as f:
+        f.write(b"RIFF" + struct.pack("<I", len(body)) + body)
+
+
+def write_mp4(path, jpegs, width, height, fps):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    try:
+        for jpeg in jpegs:
+            writer.write(cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR))
+    finally:
+        writer.release()
+
+
+class ClipRecorder(threading.Thread):
+    """
+    Keeps the last config.CLIP_PRE_SEC seconds of video as JPEGs in memory
+    and saves them, followed by config.CLIP_POST_SEC seconds after the
+    event, when trigger() is called on a critical alert.
+
+    submit() takes frames from the detection loop at config.CLIP_FPS and
+    only copies/downscales them (see pipeline.FrameHandoff); the JPEG
+    encoding runs on this thread and clips are written on their own
+    threads. The ring holds at most config.CLIP_RING_MAX_BYTES, as does
+    each clip being collected; the oldest frames go first.
+    """
+
+    def __init__(self, directory=None, fps=None, width=None, quality=None, pre_sec=None, post_sec=None,
+                 max_bytes=None, clip_format=None):
+        super().__init__(name="clips", daemon=True)
+        self.directory = directory or config.CLIP_DIR
+        self.interval = 1.0 / (fps or config.CLIP_FPS)
+        self.width = width or config.CLIP_WIDTH
+        self.quality = quality or config.CLIP_JPEG_QUALITY
+        self.pre_sec = config.CLIP_PRE_SEC if pre_sec is None else pre_sec
+        self.post_sec = config.CLIP_POST_SEC if post_sec is None else post_sec
+        self.max_bytes = max_bytes or config.CLIP_RING_MAX_BYTES
+        self.clip_format = clip_format or config.CLIP_FORMAT
+        if self.clip_format not in (FORMAT_MJPEG, FORMAT_MP4):
+            raise ValueError(f"Unknown clip format: {self.clip_format}")
+
+        self.handoff = FrameHandoff()
+        self.stop_event = threading.Event()
+        self.next_frame_time = None
+
+        # (timestamp, jpeg bytes), oldest first
+        self.ring = deque()
+        self.ring_bytes = 0
+        self.peak_bytes = 0
+        self.frame_size = None
+
+        self.lock = threading.Lock()
+        self.triggers = []
+        self.clip = None
+        self.writers = []
+        self.saved = []
+        self.encode_times = deque(maxlen=256)
+
+    def submit(self, image, timestamp):
+        """
+        Offers a frame from the detection loop; frames beyond the clip
+        rate are skipped before any copying.
+        """
+        if self.next_frame_time is not None and timestamp < self.next_frame_time:
+            return
+        if self.next_frame_time is None or timestamp - self.next_frame_time > self.interval:
+            self.next_frame_time = timestamp
+        self.next_frame_time += self.interval
+
+        h, w = image.shape[:2]
+        size = None
+        if w > self.width:
+            # Even dimensions, which most players expect
+            size = (self.width // 2 * 2, int(h * self.width / w) // 2 * 2)
+        self.handoff.put(image, timestamp, size)
+
+    def trigger(self, timestamp):
+        """
+        Requests a clip around `timestamp` (the frame's capture time).
+        Triggers during a clip's post-event window extend that clip.
+        """
+        with self.lock:
+            self.triggers.append(timestamp)
+
+    def _encode(self, image, timestamp):
+        start = time.monotonic()
+        ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self.encode_times.append(time.monotonic() - start)
+        if not ok:
+            return
+        jpeg = jpeg.tobytes()
+        self.frame_size = (image.shape[1], image.shape[0])
+
+        self.ring.append((timestamp, jpeg))
+        self.ring_bytes += len(jpeg)
+        while self.ring and (timestamp - self.ring[0][0] > self.pre_sec or self.ring_bytes > self.max_bytes):
+            self.ring_bytes -= len(self.ring.popleft()[1])
+        self.peak_bytes = max(self.peak_bytes, self.ring_bytes)
+
+        clip = self.clip
+        if clip is not None and timestamp <= clip["end"] and clip["bytes"] + len(jpeg) <= self.max_bytes:
+            clip["frames"].append((timestamp, jpeg))
+            clip["bytes"] += len(jpeg)
+
+    def _handle_triggers(self):
+        with self.lock:
+            triggers, self.triggers = self.triggers, []
+        for timestamp in triggers:
+            if self.clip is not None:
+                self.clip["end"] = max(self.clip["end"], timestamp + self.post_sec)
+                continue
+            frames = [frame for frame in self.ring if frame[0] >= timestamp - self.pre_sec]
+            self.clip = {
+                "trigger": timestamp,
+                "end": timestamp + self.post_sec,
+                "frames": frames,
+                "bytes": sum(len(jpeg) for _, jpeg in frames),
+            }
+
+    def _finish_clip(self):
+        clip, self.clip = self.clip, None
+        if not clip["frames"] or self.frame_size is None:
+            return
+        writer = threading.Thread(target=self._write_clip, args=(clip, self.frame_size), name="clip-writer")
+        writer.start()
+        self.writers = [w for w in self.writers if w.is_alive()] + [writer]
+
+    def _write_clip(self, clip, frame_size):
+        frames = clip["frames"]
+        duration = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / duration if duration > 0 else 1.0 / self.interval
+        # Named after the wall time of the alert, to the millisecond
+        wall = time.time() - (time.monotonic() - clip["trigger"])
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(wall)) + f"-{int(wall % 1 * 1000):03d}"
+        extension = ".avi" if self.clip_format == FORMAT_MJPEG else ".mp4"
+        path = os.path.join(self.directory, f"event_{stamp}{extension}")
+        jpegs = [jpeg for _, jpeg in frames]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.clip_format == FORMAT_MJPEG:
+                write_mjpeg_avi(path, jpegs, frame_size[0], frame_size[1], fps)
+            else:
+                write_mp4(path, jpegs, frame_size[0], frame_size[1], fps)
+        except (OSError, cv2.error) as e:
+            print(f"Could not save event clip {path}: {e}")
+            return
+        self.saved.append(path)
+        print(f"Saved event clip {path} ({len(frames)} frames, {duration:.1f} s)")
+
+    def run(self):
+        while not self.stop_event.is_set():
+            taken = self.handoff.take(timeout=0.1)
+            self._handle_triggers()
+            if taken is not None:
+                image, timestamp = taken
+                self._encode(image, timestamp)
+            # Also closes a clip when frames stopped arriving (camera gone)
+            last = self.ring[-1][0] if self.ring else None
+            if self.clip is not None and (
+                    (last is not None and last > self.clip["end"]) or time.monotonic() > self.clip["end"] + 1.0):
+                self._finish_clip()
+        self._handle_triggers()
+        if self.clip is not None:
+            self._finish_clip()
+
+    def stop(self):
+        """
+        Stops recording; a clip still collecting post-event frames is saved
+        with what it has.
+        """
+        self.stop_event.set()
+        self.handoff.close()
+        self.join(timeout=1.0)
+        for writer in self.writers:
+            writer.join()
+
+    def stats(self):
+        stats = {
+            "ring_frames": len(self.ring),
+            "ring_bytes": self.ring_bytes,
+            "peak_ring_bytes": self.peak_bytes,
+            "max_bytes": self.max_bytes,
+            "dropped": self.handoff.dropped,
+            "clips": list(self.saved),
+        }
+        if self.encode_times:
+            stats["encode_ms"] = 1000.0 * sum(self.encode_times) / len(self.encode_times)
+        return stats
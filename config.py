@@ -19,13 +19,158 @@ YAWN_CRIT_FRAMES = 200       # >= 20 is CRITICAL 20
 NOD_WARN_FRAMES = 8         # > 8 and < 16 is WARNING 8
 NOD_CRIT_FRAMES = 32        # >= 16 is CRITICAL 16
 
+# Duration Thresholds (Seconds), used when TRACKER_MODE = "time"
+# Same limits as the frame counts above at 30 FPS, but independent of frame rate
+TRACKER_MODE = "frames"     # "frames" counts frames, "time" accumulates elapsed capture time
+BLINK_MAX_SEC = 0.67        # BLINK_MAX_FRAMES / 30
+EYE_CRIT_SEC = 3.67         # EYE_CRIT_FRAMES / 30
+YAWN_WARN_SEC = 1.67        # YAWN_WARN_FRAMES / 30
+YAWN_CRIT_SEC = 6.67        # YAWN_CRIT_FRAMES / 30
+NOD_WARN_SEC = 0.27         # NOD_WARN_FRAMES / 30
+NOD_CRIT_SEC = 1.07         # NOD_CRIT_FRAMES / 30
+MAX_FRAME_GAP_SEC = 0.5     # Longer gaps between frames (stalls) count as this much
+
 # 3. Alarm Settings
 ALARM_COOLDOWN = 2.0        # Seconds between alarms
 
+# Adaptive Inference Scheduling (scheduler.py)
+ADAPTIVE_INFERENCE = False  # Skip FaceMesh on some frames while the driver is clearly alert
+SCHED_MAX_INTERVAL = 3      # Run FaceMesh at least every Nth frame
+SCHED_EAR_MARGIN = 0.08     # Full rate once EAR is within this of EAR_THRESHOLD
+SCHED_MAR_MARGIN = 0.15     # Full rate once MAR is within this of MAR_THRESHOLD
+SCHED_PITCH_MARGIN = 10.0   # Full rate once pitch is within this of PITCH_THRESHOLD
+
+# Face ROI Cropping (DrowsinessDetector.detect)
+ROI_CROP = True             # Run FaceMesh on a padded crop around the last face
+ROI_PADDING = 0.4           # Padding on each side, as a fraction of the face box size
+ROI_MAX_SIZE = 320          # Crops are downscaled so their longer side is at most this
+ROI_FULL_FRAME_INTERVAL = 30  # Force a full-frame pass every N frames to pick up new faces
+
+# Landmark Backend (landmarks.py)
+LANDMARK_BACKEND = "mesh_refined"   # "mesh_refined" (FaceMesh + iris, reference), "mesh" (no iris) or "opencv"
+OPENCV_FACE_DETECTOR_MODEL = "models/face_detection_yunet_2023mar.onnx"  # YuNet .onnx or Haar cascade .xml
+OPENCV_FACEMARK_MODEL = "models/lbfmodel.yaml"  # Facemark LBF 68-point model (opencv-contrib-python)
+OPENCV_REDETECT_INTERVAL = 10       # Run the face detector every N frames; track from the landmarks in between
+FACEMESH_MIN_DETECTION_CONFIDENCE = 0.5  # Face detector score needed to start tracking
+FACEMESH_MIN_TRACKING_CONFIDENCE = 0.5   # Below this the face is re-detected; lower re-detects less often
+
+# Display Settings (renderer.py)
+HEADLESS = False            # No drawing and no GUI window at all (units without a screen)
+RENDER_LEVEL = "mesh"       # "none", "hud", "contours" or "mesh"
+RENDER_MAX_FPS = 15         # Display rate cap; detection runs independently of it
+
+# Audio Settings (alert.py)
+AUDIO_BACKEND = "pygame"    # "pygame", "null" (no sound, timing only) or "file" (log alerts to AUDIO_LOG_FILE)
+AUDIO_FREQUENCY = 44100
+AUDIO_BUFFER = 512          # Mixer buffer in samples; smaller is lower latency (512 = ~12 ms)
+AUDIO_LOG_FILE = "alerts.log"
+AUDIO_EVENT_LOG_SIZE = 1024 # Recent alerts kept in memory by the "null" and "file" backends
+SOUND_DIR = "sounds"        # alert_short.wav / alert_long.wav; missing tones are synthesised and cached here
+
+# Metrics (metrics.py)
+METRICS_ENABLED = False     # Per-stage latency histograms and frame counters; no cost when off
+METRICS_PORT = 9108         # Local Prometheus endpoint (http://127.0.0.1:PORT/metrics); 0 disables
+METRICS_LOG_INTERVAL = 0    # Seconds between summary log lines; 0 disables
+METRICS_WINDOW = 1024       # Recent samples per stage kept for rolling percentiles
+
+# Telemetry (telemetry.py)
+TELEMETRY_ENABLED = False       # Log every frame's features and tracker state to a ring file
+TELEMETRY_FILE = "telemetry/telemetry.bin"  # Directory created on first use
+TELEMETRY_CAPACITY = 65536      # Records kept (64 bytes each, ~36 min of one face at 30 FPS)
+TELEMETRY_FLUSH_INTERVAL = 1.0  # Seconds between msyncs; bounds what a power cut can lose. 0 leaves it to the OS
+
+# Shared-Memory Publishing (publisher.py)
+SHM_PUBLISH_ENABLED = False     # Publish the newest frame and state for local dashboard/recorder processes
+SHM_NAME = "drowsiness_state"   # Segment name readers attach to
+SHM_ANNOTATE = True             # Draw the overlay (at RENDER_LEVEL) into published frames
+
+# Event Bus and Uplink (events.py)
+EVENT_SINKS = ["audio", "passenger_pa"]  # Any of "audio", "passenger_pa", "gpio", "uplink"
+EVENT_QUEUE_SIZE = 1024         # Events waiting per sink; beyond that new events are dropped for that sink
+GPIO_WARNING_PIN = 27           # Lamp lit while the driver is in WARNING (GPIO sink stub)
+GPIO_ALARM_PIN = 17             # Buzzer relay on while CRITICAL
+UPLINK_URL = None               # Back-office endpoint for the "uplink" sink (POST, gzip NDJSON)
+UPLINK_VEHICLE_ID = None        # Sent with every event; None uses the host name
+UPLINK_BATCH_SIZE = 50          # Events per POST
+UPLINK_BATCH_INTERVAL = 5.0     # Seconds before a partial batch is sent anyway
+UPLINK_TIMEOUT = 5.0            # Seconds per POST
+UPLINK_RETRY_MAX_DELAY = 60.0   # Longest backoff between retries while the uplink is down
+UPLINK_SPOOL_DIR = "spool"      # Batches waiting to be sent; kept across restarts
+UPLINK_SPOOL_MAX_BYTES = 10 * 1024 * 1024  # Oldest batches are dropped beyond this
+
+# Event Clips (clips.py)
+CLIP_ENABLED = False            # Keep recent frames in memory and save a clip around every critical alert
+CLIP_DIR = "clips"
+CLIP_FPS = 10                   # Frames per second kept in the ring
+CLIP_WIDTH = 640                # Frames wider than this are scaled down
+CLIP_JPEG_QUALITY = 75
+CLIP_PRE_SEC = 10.0             # Seconds before the alert included in the clip
+CLIP_POST_SEC = 5.0             # Seconds after the alert included in the clip
+CLIP_RING_MAX_BYTES = 32 * 1024 * 1024  # Cap on the ring, and on each clip being collected
+CLIP_FORMAT = "mjpeg"           # "mjpeg" (AVI of the stored JPEGs, no re-encode) or "mp4" (re-encoded, smaller)
+
+# Performance Auto-Tuning (autotune.py)
+AUTOTUNE_ENABLED = False        # Pick resolution, model and display settings for this machine at startup
+AUTOTUNE_TARGET_FPS = 25.0      # Frames per second the settings must sustain
+AUTOTUNE_MAX_LATENCY_MS = 60.0  # p95 processing time per frame the settings must stay under
+AUTOTUNE_FRAMES = 60            # Calibration frames measured per candidate setting
+AUTOTUNE_SOURCE = None          # Frames to tune on; None uses FRAME_SOURCE / the camera, or "synthetic"
+AUTOTUNE_FACE_IMAGE = None      # Face photo pasted into synthetic frames when the source shows no face
+AUTOTUNE_PROFILE_FILE = "autotune_profile.json"  # Tuned settings, cached per machine
+# Candidates per knob, most accurate first
+AUTOTUNE_RESOLUTIONS = [(1280, 720), (960, 540), (640, 480), (480, 360)]
+AUTOTUNE_BACKENDS = ["mesh_refined", "mesh"]
+AUTOTUNE_TRACKING_CONFIDENCES = [0.5, 0.3]
+AUTOTUNE_ROI_SIZES = [320, 256, 192]
+AUTOTUNE_INTERVALS = [1, 2, 3, 4]   # SCHED_MAX_INTERVAL; 1 runs FaceMesh on every frame
+AUTOTUNE_RENDER_LEVELS = ["mesh", "contours", "hud", "none"]
+AUTOTUNE_DRIFT_WINDOW = 150     # Frames with a face per drift check while running; the first sets the baseline
+AUTOTUNE_DRIFT_FACTOR = 1.5     # Inference this much slower/faster than the baseline counts as drift
+
+# Driver Seat Selection (seat.py)
+DRIVER_SELECTION_ENABLED = False    # Pick the driver's face by seat position; FaceMesh runs on that crop only
+DRIVER_SEAT_REGION = (0.0, 0.0, 1.0, 1.0)  # x0, y0, x1, y1 as fractions of the frame; the driver's face centre lies inside
+DRIVER_DETECTOR_RANGE = "full"      # Face detector model: "full" (~5 m, sees passengers further back) or "short" (~2 m, cheaper)
+DRIVER_DETECTION_CONFIDENCE = 0.5     # Minimum face detector score
+DRIVER_DETECT_INTERVAL = 10         # Frames between face detection passes while the driver is tracked
+DRIVER_SWITCH_RATIO = 1.5           # Another face in the seat region must be this much larger to replace the driver
+OCCUPANT_MATCH_IOU = 0.3            # Box overlap that keeps a face's identity between detection passes
+OCCUPANT_FORGET_SEC = 5.0           # Identities (and their trackers) unseen this long are dropped
+
 # Camera Settings
 CAMERA_INDEX = 0
+FRAME_SOURCE = None             # None for the camera, or a camera index, video file, image directory or "synthetic"
+CAMERA_WIDTH = 640              # Requested capture resolution; None keeps the driver default
+CAMERA_HEIGHT = 480
+CAMERA_FPS = 30                 # Requested frame rate; None keeps the driver default
+CAMERA_FOURCC = "MJPG"          # Compressed capture gets higher resolutions over USB 2; None keeps the default
+CAMERA_BUFFER_SIZE = 1          # Frames queued in the driver; 1 keeps the newest frame fresh
+CAPTURE_BUFFER_POOL = 8         # Free frame buffers kept for reuse; a frame is reused only once every stage released it
+CAMERA_RETRY_DELAY = 0.05       # First backoff after a failed read, doubled per failure in a row
+CAMERA_RETRY_MAX_DELAY = 2.0    # Longest backoff between reads of a missing camera
+CAMERA_RECONNECT_AFTER = 5      # Failed reads in a row before the device is closed and reopened
+CAMERA_CALIBRATION_FILE = None  # .npz or OpenCV YAML/XML intrinsics; None approximates from the frame size
+
+# Smoothing Windows (smoothing.py), in seconds
+EAR_WINDOW_SEC = 0.15           # About 5 frames at 30 FPS
+MAR_WINDOW_SEC = 0.15
+PITCH_WINDOW_SEC = 0.15
+
+# Signal Smoothing and Driver Calibration (smoothing.py)
+SMOOTHING_ENABLED = False       # Condition EAR/MAR/pitch between the detector and the tracker
+SMOOTHING_FILTER = "median"     # "median" (drops one-frame outliers), "mean" or "none"
+SMOOTHING_EMA_TAU = 0.0         # Extra EMA time constant in seconds (frame-rate independent); 0 disables
+CALIBRATION_ENABLED = False     # Learn each driver's open-eye EAR and neutral pitch at startup (with SMOOTHING_ENABLED)
+CALIBRATION_SEC = 10.0          # Seconds of face frames used for the baseline
+CALIBRATION_EAR_QUANTILE = 0.7  # Open-eye EAR level, high enough to ignore blinks
+CALIBRATION_REFERENCE_EAR = 0.30    # Open-eye EAR the EAR_THRESHOLD was tuned for
+# Neutral pitch is mapped here. Tilting down past facing the camera (180 deg x 360) wraps the
+# pitch from +64800 to -64800, below PITCH_THRESHOLD, so this leaves 10 deg of tilt before a nod
+CALIBRATION_REFERENCE_PITCH = 170.0 * 360
+CALIBRATION_SCALE_LIMITS = (0.6, 1.6)  # Bounds on the EAR correction factor
+CALIBRATION_RESET_SEC = 30.0    # Recalibrate after the face has been gone this long (driver change)
 
-# Smoothing Windows (Optional, if still used)
-EAR_WINDOW_SIZE = 5
-MAR_WINDOW_SIZE = 5
-PITCH_WINDOW_SIZE = 5
+# Fleet Runner Settings (fleet.py)
+FLEET_RING_SLOTS = 4         # Shared-memory frame slots per stream
+FLEET_REPORT_INTERVAL = 5.0  # Seconds between per-stream FPS/latency reports
+FLEET_RESTART_DELAY = 1.0    # Seconds between worker restarts / failed source reads
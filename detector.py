@@ -1,242 +1,364 @@
+from collections import namedtuple
+
 import cv2
-import mediapipe as mp
 import numpy as np
 
+import config
+from landmarks import (LEFT_EYE, MEDIAPIPE_SCHEME, MOUTH_INDICES, POSE_INDICES, RIGHT_EYE,
+                       create_backend, landmarks_to_array)
+from pose import HeadPoseEstimator
+from seat import DriverSelector
+
+EYE_INDICES = MEDIAPIPE_SCHEME.eye_indices
+
+
+def _as_points(landmarks):
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return landmarks_to_array(landmarks)
+
+
+def _eye_aspect_ratios(points, eye_indices):
+    # points: (..., N, 3), eye_indices: (eyes, 6) -> (..., eyes)
+    eyes = points[..., eye_indices, :2]
+    v1 = np.linalg.norm(eyes[..., 1, :] - eyes[..., 5, :], axis=-1)
+    v2 = np.linalg.norm(eyes[..., 2, :] - eyes[..., 4, :], axis=-1)
+    h = np.linalg.norm(eyes[..., 0, :] - eyes[..., 3, :], axis=-1)
+    return (v1 + v2) / (2.0 * h)
+
+
+def _mouth_aspect_ratio(points, mouth_indices=MOUTH_INDICES):
+    mouth = points[..., mouth_indices, :2]
+    v = np.linalg.norm(mouth[..., 0, :] - mouth[..., 1, :], axis=-1)
+    h = np.linalg.norm(mouth[..., 2, :] - mouth[..., 3, :], axis=-1)
+    return v / h
+
+
+def compute_features(points, scheme=MEDIAPIPE_SCHEME):
+    """
+    Computes EAR for both eyes and MAR from a (N, 3) or (frames, N, 3)
+    landmark array in one vectorized pass. `scheme` is the backend's
+    landmark layout (landmarks.LandmarkScheme).
+    """
+    ears = _eye_aspect_ratios(points, scheme.eye_indices)
+    left_ear = ears[..., 0]
+    right_ear = ears[..., 1]
+    return {
+        "left_ear": left_ear,
+        "right_ear": right_ear,
+        "ear": (left_ear + right_ear) / 2.0,
+        "mar": _mouth_aspect_ratio(points, scheme.mouth_indices),
+    }
+
+
+def pose_image_points(points, img_w, img_h, scheme=MEDIAPIPE_SCHEME):
+    """
+    Returns the (..., 6, 2) pixel coordinates used by solvePnP.
+    """
+    image_points = points[..., scheme.pose_indices, :2].astype(np.float64, order="C")
+    image_points *= (img_w, img_h)
+    return image_points
+
+# Result of DrowsinessDetector.detect().
+# multi_face_landmarks: MediaPipe landmarks normalized to `roi` (None for
+# backends without them)
+# points: one (N, 3) float32 array per face, normalized to the full frame; points
+# the landmark scheme does not read may be NaN
+# roi: (x0, y0, x1, y1) pixel box the backend ran on, or None for the full frame
+# identities: per-face person identity with driver selection, else None (face index)
+# occupants: everyone the driver selection saw (seat.DriverSelector.occupants), else None
+DetectionResult = namedtuple("DetectionResult", ["multi_face_landmarks", "points", "roi", "identities", "occupants"],
+                             defaults=(None, None))
+
+
 class DrowsinessDetector:
-    def __init__(self, max_num_faces=1, min_detection_confidence=0.5, min_tracking_confidence=0.5):
-        self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
+    def __init__(self, max_num_faces=1, min_detection_confidence=None, min_tracking_confidence=None, backend=None,
+                 driver_selection=None):
+        # Landmark model (config.LANDMARK_BACKEND); every feature below reads
+        # its landmarks through the backend's index scheme
+        if driver_selection is None:
+            driver_selection = config.DRIVER_SELECTION_ENABLED
+        if driver_selection:
+            # Only the driver's crop is passed to the landmark model
+            max_num_faces = 1
+        if min_detection_confidence is None:
+            min_detection_confidence = config.FACEMESH_MIN_DETECTION_CONFIDENCE
+        if min_tracking_confidence is None:
+            min_tracking_confidence = config.FACEMESH_MIN_TRACKING_CONFIDENCE
+        self.backend = create_backend(
+            backend,
             max_num_faces=max_num_faces,
-            refine_landmarks=True,
             min_detection_confidence=min_detection_confidence,
-            min_tracking_confidence=min_tracking_confidence
+            min_tracking_confidence=min_tracking_confidence,
+            # Driver selection runs the model on the driver's crop, with or without ROI_CROP
+            roi=config.ROI_CROP or driver_selection
+        )
+        self.scheme = self.backend.scheme
+        self.use_roi = config.ROI_CROP and self.backend.supports_roi
+
+        # Driver's face picked by seat position with a cheap face detector (config.DRIVER_SELECTION_ENABLED)
+        self.selector = None
+        if driver_selection:
+            if self.backend.supports_roi:
+                self.selector = DriverSelector()
+            else:
+                print(f"The {backend or config.LANDMARK_BACKEND} landmark backend cannot run on crops; driver selection is off.")
+
+        # Head pose solver with cached intrinsics and per-face warm start
+        self.pose_estimator = HeadPoseEstimator(config.CAMERA_CALIBRATION_FILE)
+
+        # Reusable RGB input buffers, keyed by name
+        self._buffers = {}
+
+        # Face bounding box (pixels) from the previous frame, for ROI cropping
+        self._face_box = None
+        self._frames_since_full = 0
+
+    def warm_up(self, img_w=640, img_h=480):
+        """
+        Runs the landmark model once on a blank frame (per FaceMesh
+        instance), so graph and model initialisation happen now rather than
+        on the first real frame.
+        """
+        blank = np.zeros((img_h, img_w, 3), dtype=np.uint8)
+        if self.selector is not None:
+            self.selector.warm_up(blank)
+        else:
+            self._run_backend(blank, "full")
+        if self.use_roi or self.selector is not None:
+            self._run_backend(blank[:config.ROI_MAX_SIZE, :config.ROI_MAX_SIZE], "roi")
+
+    def _buffer(self, name, shape):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=np.uint8)
+            self._buffers[name] = buf
+        return buf
+
+    def _next_roi(self, img_w, img_h):
+        """
+        Padded region around the previous frame's face, or None to run on
+        the full frame (no face tracked, periodic full-frame check, or the
+        region would cover most of the frame anyway).
+        """
+        if not self.use_roi or self._face_box is None:
+            return None
+        if self._frames_since_full >= config.ROI_FULL_FRAME_INTERVAL:
+            return None
+
+        x0, y0, x1, y1 = self._face_box
+        pad = config.ROI_PADDING * max(x1 - x0, y1 - y0)
+        x0 = max(0, int(x0 - pad))
+        y0 = max(0, int(y0 - pad))
+        x1 = min(img_w, int(x1 + pad) + 1)
+        y1 = min(img_h, int(y1 + pad) + 1)
+        if (x1 - x0) * (y1 - y0) > 0.6 * img_w * img_h:
+            return None
+        return x0, y0, x1, y1
+
+    def _run_backend(self, image, name):
+        """
+        Converts `image` (BGR, possibly a crop view) into a reusable buffer
+        in the backend's colour order, downscaled to at most ROI_MAX_SIZE
+        for crops, and runs the landmark model on it.
+        Returns (landmark lists or None, per-face point arrays).
+        """
+        h, w = image.shape[:2]
+        conversion = self.backend.color_conversion
+        scale = config.ROI_MAX_SIZE / max(h, w) if name == "roi" else 1.0
+        if scale < 1.0:
+            size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            buf = self._buffer(name, (size[1], size[0], 3))
+            cv2.resize(image, size, dst=buf, interpolation=cv2.INTER_AREA)
+            if conversion is not None:
+                cv2.cvtColor(buf, conversion, dst=buf)
+        elif conversion is not None:
+            buf = self._buffer(name, (h, w, 3))
+            cv2.cvtColor(image, conversion, dst=buf)
+        else:
+            buf = image
+        return self.backend.process(buf, name)
+
+    @staticmethod
+    def _to_frame(points, roi, img_w, img_h):
+        # Map a crop's normalized points to full-frame coordinates, in place
+        x0, y0, x1, y1 = roi
+        for face_points in points:
+            face_points *= ((x1 - x0) / img_w, (y1 - y0) / img_h, (x1 - x0) / img_w)
+            face_points[:, 0] += x0 / img_w
+            face_points[:, 1] += y0 / img_h
+
+    def _box_of(self, points, img_w, img_h):
+        # Pixel box around all faces' outlines, or None
+        if not points:
+            return None
+        if self.scheme.box_indices is not None:
+            points = [p[self.scheme.box_indices] for p in points]
+        boxes = np.array([(p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max()) for p in points])
+        return (
+            boxes[:, 0].min() * img_w, boxes[:, 1].min() * img_h,
+            boxes[:, 2].max() * img_w, boxes[:, 3].max() * img_h
         )
-        self.mp_drawing = mp.solutions.drawing_utils
-        self.mp_drawing_styles = mp.solutions.drawing_styles
+
+    def _detect_driver(self, image):
+        """
+        Runs the landmark model on the driver's crop only; nobody in the
+        seat means no landmark pass at all.
+        """
+        img_h, img_w = image.shape[:2]
+        roi = self.selector.driver_roi(image, self._face_box)
+        # Identities come and go over a session; keep warm starts for the current ones only
+        self.pose_estimator.keep(self.selector.tracks)
+        landmark_lists, points = None, []
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            landmark_lists, points = self._run_backend(image[y0:y1, x0:x1], "roi")
+            self._to_frame(points, roi, img_w, img_h)
+        if not points:
+            self.selector.lost()
+        self._face_box = self._box_of(points, img_w, img_h)
+        identities = [self.selector.driver] * len(points)
+        return DetectionResult(landmark_lists, points, roi, identities, self.selector.occupants())
 
     def detect(self, image):
         """
         Processes the image and returns the face landmarks.
+        The input image is returned unchanged (no copy) for drawing.
+        """
+        if self.selector is not None:
+            return self._detect_driver(image), image
+
+        img_h, img_w = image.shape[:2]
+        roi = self._next_roi(img_w, img_h)
+
+        landmark_lists, points = None, []
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            landmark_lists, points = self._run_backend(image[y0:y1, x0:x1], "roi")
+            if not points:
+                # Tracking lost in the crop, fall back to the full frame
+                roi = None
+        if roi is None:
+            landmark_lists, points = self._run_backend(image, "full")
+            self._frames_since_full = 0
+        else:
+            self._frames_since_full += 1
+            self._to_frame(points, roi, img_w, img_h)
+
+        self._face_box = self._box_of(points, img_w, img_h)
+        return DetectionResult(landmark_lists, points, roi), image
+
+    def extract_features(self, results, img_w, img_h):
+        """
+        Computes the per-face features (EAR, MAR and head pose angles).
+        Returns a list with one dict per detected face; "identity" tells
+        people apart across frames (the face index without driver
+        selection).
         """
-        # To improve performance, optionally mark the image as not writeable to
-        # pass by reference.
-        image.flags.writeable = False
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        results = self.face_mesh.process(image)
-
-        # Draw the face mesh annotations on the image.
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        
-        return results, image
-
-    def draw_landmarks(self, image, results):
-        if results.multi_face_landmarks:
-            for face_landmarks in results.multi_face_landmarks:
-                self.mp_drawing.draw_landmarks(
-                    image=image,
-                    landmark_list=face_landmarks,
-                    connections=self.mp_face_mesh.FACEMESH_TESSELATION,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=self.mp_drawing_styles
-                    .get_default_face_mesh_tesselation_style())
-                self.mp_drawing.draw_landmarks(
-                    image=image,
-                    landmark_list=face_landmarks,
-                    connections=self.mp_face_mesh.FACEMESH_CONTOURS,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=self.mp_drawing_styles
-                    .get_default_face_mesh_contours_style())
-                self.mp_drawing.draw_landmarks(
-                    image=image,
-                    landmark_list=face_landmarks,
-                    connections=self.mp_face_mesh.FACEMESH_IRISES,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=self.mp_drawing_styles
-                    .get_default_face_mesh_iris_connections_style())
+        faces = []
+        if results.points:
+            for face_index, points in enumerate(results.points):
+                identity = results.identities[face_index] if results.identities else face_index
+                # Every feature comes from the face's landmark array
+                features = compute_features(points, self.scheme)
+
+                rot_vec, trans_vec = self.pose_estimator.solve(
+                    pose_image_points(points, img_w, img_h, self.scheme), img_w, img_h, identity
+                )
+                pitch, yaw, roll = self.get_euler_angles(rot_vec)
+
+                faces.append({
+                    "ear": float(features["ear"]),
+                    "mar": float(features["mar"]),
+                    "pitch": pitch,
+                    "yaw": yaw,
+                    "roll": roll,
+                    "points": points,
+                    "identity": identity
+                })
+        return faces
+
+    def draw_landmarks(self, image, results, level="mesh"):
+        """
+        Draws the face landmarks. level "contours" draws the face contours
+        only; "mesh" adds the full tessellation and the irises.
+        """
+        if results.points:
+            # Landmarks are normalized to the ROI, so draw on that view
+            canvas = image
+            if results.roi is not None:
+                x0, y0, x1, y1 = results.roi
+                canvas = image[y0:y1, x0:x1]
+            self.backend.draw(canvas, results, level)
         return image
 
+    def landmarks_to_array(self, landmarks):
+        """
+        Converts a face's landmark list into a (N, 3) float32 array, reading
+        only the points the backend reads.
+        """
+        return landmarks_to_array(landmarks, getattr(self.backend, "point_indices", None))
+
     def calculate_ear(self, landmarks, indices):
         """
         Calculates the Eye Aspect Ratio (EAR) for a given eye.
         """
-        # Vertical distances
         # indices: [P1, P2, P3, P4, P5, P6]
-        # P2-P6 and P3-P5 are vertical pairs
-        # P1-P4 is horizontal
-        
-        # Mapping based on the loop order:
-        # Right: 33, 159, 158, 133, 153, 145
-        # P1=33, P2=159, P3=158, P4=133, P5=153, P6=145
-        # Vertical: |159-145| and |158-153|
-        # Horizontal: |33-133|
-        
-        # Left: 362, 380, 374, 263, 386, 385
-        # P1=362, P2=380, P3=374, P4=263, P5=386, P6=385
-        # Vertical: |380-386| and |374-385|
-        # Horizontal: |362-263|
-        
-        # Extract coordinates
-        points = [np.array([landmarks[i].x, landmarks[i].y]) for i in indices]
-        
-        # Calculate distances
-        # Vertical
-        v1 = np.linalg.norm(points[1] - points[5])
-        v2 = np.linalg.norm(points[2] - points[4])
-        
-        # Horizontal
-        h = np.linalg.norm(points[0] - points[3])
-        
-        ear = (v1 + v2) / (2.0 * h)
-        return ear
+        # P2-P6 and P3-P5 are vertical pairs, P1-P4 is horizontal
+        points = _as_points(landmarks)
+        ear, = _eye_aspect_ratios(points, np.asarray([indices]))
+        return float(ear)
 
     def get_eye_landmarks(self, landmarks):
         """
         Returns the EAR for both eyes.
         """
-        # Right eye indices (loop order)
-        RIGHT_EYE = [33, 159, 158, 133, 153, 145]
-        # Left eye indices (loop order)
-        LEFT_EYE = [362, 380, 374, 263, 386, 385]
-        
-        left_ear = self.calculate_ear(landmarks, LEFT_EYE)
-        right_ear = self.calculate_ear(landmarks, RIGHT_EYE)
-        
-        return left_ear, right_ear
+        left_ear, right_ear = _eye_aspect_ratios(_as_points(landmarks), self.scheme.eye_indices)
+        return float(left_ear), float(right_ear)
 
     def calculate_mar(self, landmarks):
         """
         Calculates Mouth Aspect Ratio (MAR).
         """
-        # Mouth indices
-        # Top: 13, Bottom: 14
-        # Left: 61, Right: 291
-        
-        top = np.array([landmarks[13].x, landmarks[13].y])
-        bottom = np.array([landmarks[14].x, landmarks[14].y])
-        left = np.array([landmarks[61].x, landmarks[61].y])
-        right = np.array([landmarks[291].x, landmarks[291].y])
-        
-        v = np.linalg.norm(top - bottom)
-        h = np.linalg.norm(left - right)
-        
-        return v / h
+        return float(_mouth_aspect_ratio(_as_points(landmarks), self.scheme.mouth_indices))
 
     def get_head_pose(self, landmarks, img_w, img_h):
         """
         Estimates head pose using SolvePnP.
-        Returns pitch, yaw, roll.
-        """
-        # 3D model points
-        model_points = np.array([
-            (0.0, 0.0, 0.0),             # Nose tip
-            (0.0, -330.0, -65.0),        # Chin
-            (-225.0, 170.0, -135.0),     # Left eye left corner
-            (225.0, 170.0, -135.0),      # Right eye right corner
-            (-150.0, -150.0, -125.0),    # Left Mouth corner
-            (150.0, -150.0, -125.0)      # Right mouth corner
-        ])
-
-        # 2D image points
-        # Nose: 1, Chin: 152, Left Eye: 263, Right Eye: 33 (Inner? No, use 133 for outer)
-        # Wait, let's check standard dlib points vs MediaPipe.
-        # dlib 36 is left eye outer? No, 36 is left eye inner (person's right).
-        # Let's stick to the ones I derived:
-        # Nose: 1
-        # Chin: 152
-        # Left Eye Outer (Person's Left): 263
-        # Right Eye Outer (Person's Right): 33 (Inner) -> 133 (Outer)
-        # Left Mouth: 61
-        # Right Mouth: 291
-        
-        image_points = np.array([
-            (landmarks[1].x * img_w, landmarks[1].y * img_h),     # Nose tip
-            (landmarks[152].x * img_w, landmarks[152].y * img_h), # Chin
-            (landmarks[263].x * img_w, landmarks[263].y * img_h), # Left eye left corner
-            (landmarks[33].x * img_w, landmarks[33].y * img_h),   # Right eye right corner (Wait, 33 is inner. 133 is outer. Let's use 33 for now as it's a stable point, or 133. 33 is inner corner of right eye. 263 is outer corner of left eye. This is asymmetric.
-            # Let's use Outer corners for both.
-            # Right Eye Outer: 133
-            # Left Eye Outer: 263
-            # But the 3D model points assume symmetry.
-            # (-225, 170) and (225, 170).
-            # If I use 263 (Left Outer) and 133 (Right Outer), that matches.
-            # Let's try that.
-            # Wait, 33 is Right Inner. 133 is Right Outer.
-            # 362 is Left Inner. 263 is Left Outer.
-            # So 263 and 133 are the outer corners.
-            
-            # Re-checking 3D points.
-            # If (-225, 170) is Left Eye Left Corner (Outer), then (225, 170) is Right Eye Right Corner (Outer).
-            # So I should use 263 and 133.
-            
-            # However, I'll use 33 and 263 if I want Inner/Outer mix? No.
-            # Let's use 263 (Left Outer) and 33 (Right Inner)? No.
-            # Let's use 263 and 133.
-            
-            # Actually, let's just use the indices I found:
-            # Nose: 1
-            # Chin: 152
-            # Left Eye: 263
-            # Right Eye: 33 (Wait, 33 is inner. 133 is outer. Let's use 33 and 263? 33 is right inner, 263 is left outer. That's weird.)
-            # Let's use 33 (Right Inner) and 263 (Left Outer) -> Distance is large.
-            # Let's use 133 (Right Outer) and 263 (Left Outer).
-            
-            # Let's stick to a known working set for MediaPipe.
-            # Many tutorials use:
-            # Nose: 1
-            # Chin: 199 or 152
-            # Left Eye: 33 (Right Inner) ??
-            # Right Eye: 263 (Left Outer) ??
-            # Left Mouth: 61
-            # Right Mouth: 291
-            
-            # I'll use:
-            # 1 (Nose)
-            # 152 (Chin)
-            # 263 (Left Eye Outer)
-            # 33 (Right Eye Inner) -> This seems wrong for symmetry.
-            # Let's use 133 (Right Eye Outer).
-            
-            # Let's try 33 and 263 and see.
-             
-        ], dtype="double")
-        
-        # Correcting points to match 3D model
-        # If 3D model has Left Eye (-225) and Right Eye (225), they are symmetric.
-        # So I need symmetric 2D points.
-        # Right Eye Outer: 133
-        # Left Eye Outer: 263
-        
-        image_points = np.array([
-            (landmarks[1].x * img_w, landmarks[1].y * img_h),     # Nose tip
-            (landmarks[152].x * img_w, landmarks[152].y * img_h), # Chin
-            (landmarks[263].x * img_w, landmarks[263].y * img_h), # Left eye left corner
-            (landmarks[33].x * img_w, landmarks[33].y * img_h),   # Right eye right corner (Using 33 as it's commonly used, but maybe 133 is better. Let's use 33 for now as it's often cited).
-            (landmarks[61].x * img_w, landmarks[61].y * img_h),   # Left Mouth corner
-            (landmarks[291].x * img_w, landmarks[291].y * img_h)  # Right mouth corner
-        ], dtype="double")
-
-        # Camera internals
-        focal_length = img_w
-        center = (img_w / 2, img_h / 2)
-        camera_matrix = np.array(
-            [[focal_length, 0, center[0]],
-             [0, focal_length, center[1]],
-             [0, 0, 1]], dtype="double"
-        )
-        dist_coeffs = np.zeros((4, 1)) # Assuming no lens distortion
-
-        (success, rotation_vector, translation_vector) = cv2.solvePnP(model_points, image_points, camera_matrix, dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
+        Returns the rotation and translation vectors.
+        """
+        image_points = pose_image_points(_as_points(landmarks), img_w, img_h, self.scheme)
+        return self.pose_estimator.solve(image_points, img_w, img_h)
 
-        return rotation_vector, translation_vector
+    def batch_features(self, points, img_w, img_h, with_pose=True):
+        """
+        Computes the features for a (frames, N, 3) landmark array in one pass.
+        Returns a dict of per-frame arrays: left_ear, right_ear, ear, mar and,
+        when with_pose is set, pitch, yaw and roll.
+        """
+        points = np.asarray(points, dtype=np.float32)
+        features = compute_features(points, self.scheme)
+        if with_pose:
+            # Own estimator, so each frame warm-starts from the previous one
+            # without disturbing the live tracking state
+            estimator = HeadPoseEstimator(config.CAMERA_CALIBRATION_FILE)
+            image_points = pose_image_points(points, img_w, img_h, self.scheme)
+            angles = np.empty((len(points), 3))
+            for i in range(len(points)):
+                rot_vec, _ = estimator.solve(image_points[i], img_w, img_h)
+                angles[i] = self.get_euler_angles(rot_vec)
+            features["pitch"] = angles[:, 0]
+            features["yaw"] = angles[:, 1]
+            features["roll"] = angles[:, 2]
+        return features
 
     def get_euler_angles(self, rotation_vector):
         """
         Converts rotation vector to Euler angles (pitch, yaw, roll).
         """
-        rmat, _ = cv2.Rodrigues(rotation_vector)
-        angles, _, _, _, _, _ = cv2.RQDecomp3x3(rmat)
-        
-        # angles: pitch, yaw, roll
+        # angles: pitch, yaw, roll (same values as cv2.RQDecomp3x3)
+        angles = HeadPoseEstimator.euler_angles(rotation_vector)
+
+        # Scaled by 360 as before; the thresholds in config.py are tuned to it
         x, y, z = angles[0] * 360, angles[1] * 360, angles[2] * 360
         return x, y, z
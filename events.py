@@ -0,0 +1,515 @@
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import platform
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Event types
+EVENT_ALARM = "alarm"     # StateTracker asked for an alert
+EVENT_STATE = "state"     # Overall state changed
+
+# Sink names for config.EVENT_SINKS
+SINK_AUDIO = "audio"
+SINK_PASSENGER_PA = "passenger_pa"
+SINK_GPIO = "gpio"
+SINK_UPLINK = "uplink"
+
+# Put into a sink's queue to make its worker finish
+_STOP = object()
+
+
+def make_event(event_type, frame_id, timestamp, status_info, face=None, face_index=0, previous=None):
+    """
+    A JSON-serialisable event dict from the frame loop. `timestamp` is the
+    frame's capture time on the monotonic clock; wall time is added for
+    the back office.
+    """
+    event = {
+        "type": event_type,
+        "frame_id": int(frame_id),
+        "face_index": face_index,
+        "timestamp": timestamp,
+        "wall_time": time.time(),
+        "overall": status_info["overall"],
+        "eye": status_info["eye"],
+        "yawn": status_info["yawn"],
+        "nod": status_info["nod"],
+        "action": status_info["action"],
+    }
+    if previous is not None:
+        event["previous"] = previous
+    if face is not None:
+        for key in ("ear", "mar", "pitch"):
+            event[key] = float(face[key])
+        event["identity"] = face.get("identity", face_index)
+    return event
+
+
+class AudioSink:
+    """
+    Driver alerts through the SoundManager. Its play_* calls only queue the
+    sound, so this never waits for playback.
+    """
+
+    def __init__(self, sound_manager):
+        self.sound_manager = sound_manager
+
+    async def handle(self, event):
+        if event["action"] == "driver_short":
+            self.sound_manager.play_driver_short_alarm()
+        elif event["action"] == "driver_passenger_long":
+            self.sound_manager.play_driver_long_alarm()
+
+    async def close(self):
+        pass
+
+
+class PassengerPASink:
+    """
+    Critical alerts on the passenger output (e.g. the bus PA speaker).
+    """
+
+    def __init__(self, sound_manager):
+        self.sound_manager = sound_manager
+
+    async def handle(self, event):
+        if event["action"] == "driver_passenger_long":
+            self.sound_manager.play_passenger_long_alarm()
+
+    async def close(self):
+        pass
+
+
+class GpioSink:
+    """
+    Stub for a dashboard lamp and buzzer relay: WARNING lights
+    config.GPIO_WARNING_PIN, CRITICAL config.GPIO_ALARM_PIN. Pin writes
+    are only recorded (and printed when `verbose`); subclass and override
+    write_pin() for the board's GPIO library.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.pins = {config.GPIO_WARNING_PIN: 0, config.GPIO_ALARM_PIN: 0}
+        self.writes = []
+
+    def write_pin(self, pin, value):
+        self.writes.append((time.monotonic(), pin, value))
+        if self.verbose:
+            print(f"GPIO {pin} -> {value}")
+
+    async def handle(self, event):
+        if event["type"] != EVENT_STATE:
+            return
+        wanted = {
+            config.GPIO_WARNING_PIN: int(event["overall"] == "WARNING"),
+            config.GPIO_ALARM_PIN: int(event["overall"] == "CRITICAL"),
+        }
+        for pin, value in wanted.items():
+            if self.pins[pin] != value:
+                self.pins[pin] = value
+                self.write_pin(pin, value)
+
+    async def close(self):
+        for pin in self.pins:
+            if self.pins[pin]:
+                self.pins[pin] = 0
+                self.write_pin(pin, 0)
+
+
+class Spool:
+    """
+    Bounded store-and-forward queue on disk: one file per compressed batch,
+    oldest first. When it grows past `max_bytes` the oldest batches are
+    dropped. Batches left from an earlier run are picked up on start.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or config.UPLINK_SPOOL_DIR
+        self.max_bytes = max_bytes or config.UPLINK_SPOOL_MAX_BYTES
+        os.makedirs(self.directory, exist_ok=True)
+        self.files = sorted(glob.glob(os.path.join(self.directory, "*.jsonl.gz")))
+        self.bytes = sum(os.path.getsize(path) for path in self.files)
+        self.next_index = int(os.path.basename(self.files[-1]).split(".")[0]) + 1 if self.files else 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def push(self, payload):
+        path = os.path.join(self.directory, f"{self.next_index:012d}.jsonl.gz")
+        self.next_index += 1
+        # Written under a temporary name so a crash never leaves half a batch
+        with open(path + ".tmp", "wb") as f:
+            f.write(payload)
+        os.replace(path + ".tmp", path)
+        self.files.append(path)
+        self.bytes += len(payload)
+        while self.bytes > self.max_bytes and len(self.files) > 1:
+            self._remove(self.files[0])
+            self.dropped += 1
+
+    def peek(self):
+        """
+        The oldest batch, or None when the spool is empty.
+        """
+        if not self.files:
+            return None
+        with open(self.files[0], "rb") as f:
+            return f.read()
+
+    def pop(self):
+        if self.files:
+            self._remove(self.files[0])
+
+    def _remove(self, path):
+        self.bytes -= os.path.getsize(path)
+        os.remove(path)
+        self.files.remove(path)
+
+
+class UplinkSink:
+    """
+    Sends events to the back office as gzip-compressed JSON lines, one
+    POST per batch of config.UPLINK_BATCH_SIZE events or every
+    config.UPLINK_BATCH_INTERVAL seconds. Every batch goes into the Spool
+    first and leaves it once the back office accepted it, so batches
+    survive outages and restarts alike; they are sent oldest first, with
+    exponential backoff while the connection is down. The blocking HTTP
+    call runs on a worker thread, never on the event loop.
+    """
+
+    def __init__(self, url=None, spool=None, vehicle_id=None):
+        self.url = url or config.UPLINK_URL
+        if not self.url:
+            raise ValueError("The uplink sink needs config.UPLINK_URL")
+        self.spool = spool or Spool()
+        self.vehicle_id = vehicle_id or config.UPLINK_VEHICLE_ID or platform.node()
+        self.batch = []
+        self.batch_started = None
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+        self.sent_batches = 0
+        self.failures = 0
+        self._wake = None
+        self._task = None
+
+    async def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def handle(self, event):
+        if not self.batch:
+            self.batch_started = time.monotonic()
+        self.batch.append(event)
+        if len(self.batch) >= config.UPLINK_BATCH_SIZE:
+            self._wake.set()
+
+    def _encode(self, events):
+        lines = [json.dumps(dict(event, vehicle=self.vehicle_id), separators=(",", ":")) for event in events]
+        return gzip.compress(("\n".join(lines) + "\n").encode(), compresslevel=6)
+
+    def _post(self, payload):
+        request = urllib.request.Request(self.url, data=payload, method="POST", headers={
+            "Content-Type": "application/x-ndjson",
+            "Content-Encoding": "gzip",
+        })
+        with urllib.request.urlopen(request, timeout=config.UPLINK_TIMEOUT) as response:
+            return 200 <= response.status < 300
+
+    async def _send(self, payload):
+        try:
+            ok = await asyncio.to_thread(self._post, payload)
+        except (urllib.error.URLError, OSError) as e:
+            ok = False
+            if self.retry_delay == 0.0:
+                print(f"Uplink unreachable, spooling events: {e}")
+        if ok:
+            self.retry_delay = 0.0
+            self.sent_batches += 1
+        else:
+            self.failures += 1
+            self.retry_delay = min(max(2 * self.retry_delay, 1.0), config.UPLINK_RETRY_MAX_DELAY)
+            self.retry_at = time.monotonic() + self.retry_delay
+        return ok
+
+    async def _flush(self):
+        """
+        Spools the current batch, then sends what the spool holds.
+        """
+        events, self.batch = self.batch, []
+        # A burst can queue more than one batch before this runs
+        for start in range(0, len(events), config.UPLINK_BATCH_SIZE):
+            self.spool.push(self._encode(events[start:start + config.UPLINK_BATCH_SIZE]))
+        while len(self.spool) and time.monotonic() >= self.retry_at:
+            if not await self._send(self.spool.peek()):
+                break
+            self.spool.pop()
+
+    async def _run(self):
+        while True:
+            timeout = config.UPLINK_BATCH_INTERVAL
+            if self.batch:
+                timeout = max(0.0, self.batch_started + config.UPLINK_BATCH_INTERVAL - time.monotonic())
+            if len(self.spool) and self.retry_at:
+                timeout = min(timeout, max(0.0, self.retry_at - time.monotonic()))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # One more attempt; anything unsent is sent on the next run
+        self.retry_at = 0.0
+        await self._flush()
+
+    def stats(self):
+        return {
+            "sent_batches": self.sent_batches,
+            "failures": self.failures,
+            "spooled_batches": len(self.spool),
+            "spooled_bytes": self.spool.bytes,
+            "spool_dropped": self.spool.dropped,
+        }
+
+
+def create_sinks(sound_manager, names=None):
+    """
+    Builds the sinks named in config.EVENT_SINKS.
+    """
+    sinks = {}
+    for name in names or config.EVENT_SINKS:
+        if name == SINK_AUDIO:
+            sinks[name] = AudioSink(sound_manager)
+        elif name == SINK_PASSENGER_PA:
+            sinks[name] = PassengerPASink(sound_manager)
+        elif name == SINK_GPIO:
+            sinks[name] = GpioSink()
+        elif name == SINK_UPLINK:
+            sinks[name] = UplinkSink()
+        else:
+            raise ValueError(f"Unknown event sink: {name}")
+    return sinks
+
+
+class EventBus:
+    """
+    Fans events out to sinks on an asyncio loop running on its own thread.
+    publish() is safe to call from the frame loop and never blocks: each
+    sink has a bounded queue of config.EVENT_QUEUE_SIZE events and its own
+    worker, so a slow sink (the uplink) never delays another (audio), and
+    a full queue drops that sink's event rather than waiting.
+    """
+
+    def __init__(self, sinks, queue_size=None):
+        self.sinks = dict(sinks)
+        self.queue_size = queue_size or config.EVENT_QUEUE_SIZE
+        self.loop = None
+        self.queues = {}
+        self.handled = {name: 0 for name in self.sinks}
+        self.errors = {name: 0 for name in self.sinks}
+        self.published = 0
+        self.dropped = 0
+        self._ready = threading.Event()
+        self._start_error = None
+        self.thread = threading.Thread(target=self._thread_main, name="events", daemon=True)
+
+    def start(self):
+        """
+        Starts the loop thread and every sink. A sink that fails to start
+        raises here, rather than leaving the caller waiting.
+        """
+        self.thread.start()
+        self._ready.wait()
+        if self._start_error is not None:
+            self.thread.join()
+            raise self._start_error
+
+    def _thread_main(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            # Also when _main failed before its sinks were up
+            self._ready.set()
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        workers = []
+        try:
+            for name, sink in self.sinks.items():
+                self.queues[name] = asyncio.Queue()
+                if hasattr(sink, "start"):
+                    await sink.start()
+                workers.append(asyncio.create_task(self._worker(name, sink, self.queues[name])))
+        except Exception as e:
+            self._start_error = e
+            for worker in workers:
+                worker.cancel()
+            return
+        finally:
+            self._ready.set()
+        await asyncio.gather(*workers)
+
+    async def _worker(self, name, sink, queue):
+        while True:
+            event = await queue.get()
+            if event is _STOP:
+                break
+            try:
+                await sink.handle(event)
+                self.handled[name] += 1
+            except Exception as e:
+                self.errors[name] += 1
+                print(f"Event sink {name} failed: {e}")
+        try:
+            await sink.close()
+        except Exception as e:
+            print(f"Event sink {name} failed to close: {e}")
+
+    def _dispatch(self, event):
+        for queue in self.queues.values():
+            if queue.qsize() >= self.queue_size:
+                self.dropped += 1
+            else:
+                queue.put_nowait(event)
+
+    def publish(self, event):
+        """
+        Queues `event` for every sink. Once the bus is closed, or its
+        thread died, events are counted as dropped instead.
+        """
+        if self.loop is None or self.loop.is_closed() or not self.thread.is_alive():
+            self.dropped += 1
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._dispatch, event)
+        except RuntimeError:
+            # The loop closed after the check above
+            self.dropped += 1
+            return
+        self.published += 1
+
+    def close(self, timeout=None):
+        """
+        Lets every sink finish its queued events (the uplink sends or
+        spools its last batch), then stops the loop.
+        """
+        if self.loop is not None and self.thread.is_alive():
+            def stop():
+                for queue in self.queues.values():
+                    # Past the bound, so the stop marker is never dropped
+                    queue.put_nowait(_STOP)
+            self.loop.call_soon_threadsafe(stop)
+        self.thread.join(timeout=timeout if timeout is not None else config.UPLINK_TIMEOUT + 1.0)
+
+    def stats(self):
+        stats = {
+            "published": self.published,
+            "dropped": self.dropped,
+            "handled": dict(self.handled),
+            "errors": dict(self.errors),
+        }
+        for name, sink in self.sinks.items():
+            if hasattr(sink, "stats"):
+                stats[name] = sink.stats()
+        return stats
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server_version = "UplinkStandIn"
+
+    def do_POST(self):
+        server = self.server
+        if server.down:
+            self.send_error(503)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        events = [json.loads(line) for line in body.decode().splitlines() if line]
+        with server.lock:
+            server.batches += 1
+            server.events.extend(events)
+        if server.verbose:
+            print(f"Received {len(events)} events ({self.headers.get('Content-Length')} bytes compressed)")
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UplinkStandIn:
+    """
+    Local stand-in for the back office, for trying the uplink without one:
+    accepts the uplink's POSTs and keeps the decoded events. Setting
+    `down` makes it answer 503, as during an outage.
+    """
+
+    def __init__(self, port=0, verbose=False):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _StandInHandler)
+        self.httpd.down = False
+        self.httpd.verbose = verbose
+        self.httpd.batches = 0
+        self.httpd.events = []
+        self.httpd.lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/events"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="uplink-stand-in", daemon=True)
+
+    @property
+    def events(self):
+        return self.httpd.events
+
+    @property
+    def batches(self):
+        return self.httpd.batches
+
+    @property
+    def down(self):
+        return self.httpd.down
+
+    @down.setter
+    def down(self, value):
+        self.httpd.down = value
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the event uplink's back office.")
+    parser.add_argument("--port", type=int, default=8086)
+    args = parser.parse_args()
+
+    stand_in = UplinkStandIn(args.port, verbose=True)
+    stand_in.start()
+    print(f"Accepting events at {stand_in.url} (set config.UPLINK_URL to it)")
+    try:
+        stand_in.thread.join()
+    except KeyboardInterrupt:
+        stand_in.stop()
+
+
+if __name__ == "__main__":
+    main()
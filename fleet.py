@@ -0,0 +1,342 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import config
+from sources import open_source
+
+
+class SharedFrameRing:
+    """
+    Fixed-size ring of frame slots in shared memory with a single writer.
+    Frames are copied into a slot and published with a sequence number,
+    so readers never receive pickled frames.
+
+    Layout: [head seq (int64)] [slot seqs (int64 * slots)]
+            [slot timestamps (float64 * slots)] [frames (uint8 * slots * shape)]
+    """
+
+    def __init__(self, shape, slots=4, name=None, create=True):
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_bytes = int(np.prod(self.shape))
+        header_bytes = 8 * (1 + 2 * slots)
+        if create:
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True, size=header_bytes + frame_bytes * slots
+            )
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.owner = create
+
+        buf = self.shm.buf
+        self.head = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=0)
+        self.seqs = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=8)
+        self.stamps = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=8 * (1 + slots))
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=buf, offset=header_bytes)
+        if create:
+            self.head[0] = 0
+            self.seqs[:] = 0
+
+    def write(self, frame, timestamp):
+        seq = int(self.head[0]) + 1
+        slot = seq % self.slots
+        # Mark the slot as being written so a concurrent reader can tell
+        self.seqs[slot] = -1
+        if frame.shape == self.shape:
+            np.copyto(self.frames[slot], frame)
+        else:
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=self.frames[slot])
+        self.stamps[slot] = timestamp
+        self.seqs[slot] = seq
+        self.head[0] = seq
+        return seq
+
+    def read_latest(self, out, last_seq=0):
+        """
+        Copies the newest frame into `out` if it is newer than `last_seq`.
+        Returns (seq, timestamp, skipped) or None if there is no new frame or
+        the slot was overwritten while reading.
+        """
+        seq = int(self.head[0])
+        if seq <= last_seq:
+            return None
+        slot = seq % self.slots
+        np.copyto(out, self.frames[slot])
+        timestamp = float(self.stamps[slot])
+        if int(self.seqs[slot]) != seq:
+            return None
+        skipped = max(0, seq - last_seq - 1) if last_seq else 0
+        return seq, timestamp, skipped
+
+    def close(self):
+        # Drop the numpy views before closing the mapping
+        self.head = self.seqs = self.stamps = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _stream_worker(stream_id, ring_name, shape, slots, result_queue, stop_event, core):
+    """
+    Worker process for one stream: own FaceMesh instance and tracker,
+    reads the newest frame from the shared ring.
+    """
+    from detector import DrowsinessDetector
+    from seat import IdentityMap
+    from state_tracker import StateTracker
+
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {core})
+        except OSError as e:
+            print(f"[{stream_id}] Could not pin to core {core}: {e}")
+
+    ring = SharedFrameRing(shape, slots, name=ring_name, create=False)
+    detector = DrowsinessDetector()
+    # One tracker per person (see seat.DriverSelector), so people never share state
+    trackers = IdentityMap(StateTracker)
+    frame = np.empty(shape, dtype=np.uint8)
+    last_seq = 0
+
+    try:
+        while not stop_event.is_set():
+            read = ring.read_latest(frame, last_seq)
+            if read is None:
+                time.sleep(0.002)
+                continue
+            seq, timestamp, skipped = read
+            last_seq = seq
+
+            results, image = detector.detect(frame)
+            img_h, img_w, _ = image.shape
+            faces = detector.extract_features(results, img_w, img_h)
+
+            status_info = None
+            for face_index, face in enumerate(faces):
+                tracker = trackers.get(face["identity"], timestamp)
+                face_status = tracker.update(face["ear"], face["mar"], face["pitch"], timestamp)
+                # The stream reports the driver, face 0, as main.py does
+                if face_index == 0:
+                    status_info = face_status
+
+            result_queue.put((
+                stream_id, seq, timestamp, time.monotonic(), skipped,
+                status_info["overall"] if status_info else None,
+                status_info["action"] if status_info else None
+            ))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+class StreamStats:
+    """Rolling FPS and latency figures for one stream."""
+
+    def __init__(self, window=300):
+        self.latencies = deque(maxlen=window)
+        self.frames = 0
+        self.dropped = 0
+        self.restarts = 0
+        self.last_state = None
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+
+    def add(self, latency, skipped, state):
+        self.latencies.append(latency)
+        self.frames += 1
+        self._window_frames += 1
+        self.dropped += skipped
+        self.last_state = state
+
+    def snapshot(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        fps = self._window_frames / elapsed if elapsed > 0 else 0.0
+        self._window_start = now
+        self._window_frames = 0
+        if self.latencies:
+            lat = np.fromiter(self.latencies, dtype=np.float64) * 1000.0
+            p50, p95 = (float(v) for v in np.percentile(lat, [50, 95]))
+        else:
+            p50 = p95 = float("nan")
+        return {
+            "fps": fps,
+            "latency_p50_ms": p50,
+            "latency_p95_ms": p95,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+            "state": self.last_state,
+        }
+
+
+class FleetRunner:
+    """
+    Runs one detection worker process per video source.
+    Capture threads in this process copy frames into per-stream shared
+    memory rings; workers are pinned round-robin across the available
+    cores and restarted if they crash.
+    """
+
+    def __init__(self, sources, slots=None, on_result=None):
+        self.sources = list(sources)
+        self.slots = slots or config.FLEET_RING_SLOTS
+        self.on_result = on_result
+        self.ctx = multiprocessing.get_context("spawn")
+        self.stop_event = self.ctx.Event()
+        self.result_queue = self.ctx.Queue()
+        self.rings = {}
+        self.caps = {}
+        self.capture_threads = {}
+        self.workers = {}
+        self.spawn_times = {}
+        self.cores = {}
+        self.stats = {}
+
+        if hasattr(os, "sched_getaffinity"):
+            self.available_cores = sorted(os.sched_getaffinity(0))
+        else:
+            self.available_cores = [None]
+
+    def start(self):
+        for i, source in enumerate(self.sources):
+            stream_id = f"stream{i}"
+            cap = open_source(source)
+            success, frame = cap.read()
+            if not success:
+                print(f"[{stream_id}] Could not read from source {source!r}, skipping.")
+                cap.release()
+                continue
+
+            ring = SharedFrameRing(frame.shape, self.slots)
+            ring.write(frame, time.monotonic())
+            cap.recycle(frame)
+            self.rings[stream_id] = ring
+            self.caps[stream_id] = cap
+            self.stats[stream_id] = StreamStats()
+            self.cores[stream_id] = self.available_cores[i % len(self.available_cores)]
+
+            thread = threading.Thread(
+                target=self._capture_loop, args=(stream_id,), name=f"capture-{stream_id}", daemon=True
+            )
+            self.capture_threads[stream_id] = thread
+            thread.start()
+            self._spawn_worker(stream_id)
+
+    def _spawn_worker(self, stream_id):
+        ring = self.rings[stream_id]
+        proc = self.ctx.Process(
+            target=_stream_worker,
+            args=(stream_id, ring.name, ring.shape, ring.slots,
+                  self.result_queue, self.stop_event, self.cores[stream_id]),
+            name=f"worker-{stream_id}",
+            daemon=True
+        )
+        proc.start()
+        self.workers[stream_id] = proc
+        self.spawn_times[stream_id] = time.monotonic()
+
+    def _capture_loop(self, stream_id):
+        cap = self.caps[stream_id]
+        ring = self.rings[stream_id]
+        while not self.stop_event.is_set() and cap.isOpened():
+            success, frame = cap.read()
+            if not success:
+                # Cameras back off and reconnect inside read(); files are done
+                if not cap.live:
+                    break
+                continue
+            ring.write(frame, time.monotonic())
+            # Copied into the ring, so the buffer can be read into again
+            cap.recycle(frame)
+
+    def poll(self, timeout=0.1):
+        """
+        Drains worker results and restarts crashed workers.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.result_queue.get(timeout=max(0.0, remaining))
+            except queue.Empty:
+                break
+            stream_id, seq, timestamp, done, skipped, state, action = item
+            self.stats[stream_id].add(done - timestamp, skipped, state)
+            if self.on_result is not None:
+                self.on_result(stream_id, seq, state, action)
+            if remaining <= 0:
+                break
+
+        now = time.monotonic()
+        for stream_id, proc in list(self.workers.items()):
+            if proc.is_alive() or self.stop_event.is_set():
+                continue
+            # Back off so a worker that dies on startup does not spin
+            if now - self.spawn_times[stream_id] < config.FLEET_RESTART_DELAY:
+                continue
+            print(f"[{stream_id}] Worker exited with code {proc.exitcode}, restarting.")
+            self.stats[stream_id].restarts += 1
+            self._spawn_worker(stream_id)
+
+    def report(self):
+        return {stream_id: stats.snapshot() for stream_id, stats in self.stats.items()}
+
+    def run(self, duration=None):
+        self.start()
+        start = time.monotonic()
+        next_report = start + config.FLEET_REPORT_INTERVAL
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                self.poll()
+                if time.monotonic() >= next_report:
+                    for stream_id, snap in self.report().items():
+                        print(f"[{stream_id}] {snap['fps']:.1f} FPS, "
+                              f"latency p50 {snap['latency_p50_ms']:.1f} ms "
+                              f"p95 {snap['latency_p95_ms']:.1f} ms, "
+                              f"dropped {snap['dropped']}, restarts {snap['restarts']}, "
+                              f"state {snap['state']}")
+                    next_report += config.FLEET_REPORT_INTERVAL
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        for proc in self.workers.values():
+            proc.join(timeout=2.0)
+            if proc.is_alive():
+                proc.terminate()
+        for thread in self.capture_threads.values():
+            thread.join(timeout=1.0)
+        for cap in self.caps.values():
+            cap.release()
+        for ring in self.rings.values():
+            ring.close()
+        self.workers.clear()
+        self.rings.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run drowsiness detection on several video sources at once.")
+    parser.add_argument("sources", nargs="+", help="Camera indices, stream URLs, video files, image directories or \"synthetic\"")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    args = parser.parse_args()
+
+    FleetRunner(args.sources).run(duration=args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,17 @@
-import wave
-import math
-import struct
+import os
+
+import config
+from tones import TONES, synthesize, write_wav
 
 def generate_beep(filename, duration_sec, freq_hz):
     sample_rate = 44100
-    n_samples = int(sample_rate * duration_sec)
-    amplitude = 16000
-    
-    with wave.open(filename, 'w') as wav_file:
-        wav_file.setnchannels(1)
-        wav_file.setsampwidth(2)
-        wav_file.setframerate(sample_rate)
-        
-        for i in range(n_samples):
-            value = int(amplitude * math.sin(2 * math.pi * freq_hz * i / sample_rate))
-            data = struct.pack('<h', value)
-            wav_file.writeframesraw(data)
+    write_wav(filename, synthesize(duration_sec, freq_hz, sample_rate), sample_rate)
 
 if __name__ == "__main__":
-    print("Generating alert_short.wav...")
-    generate_beep("assets/alert_short.wav", 0.5, 1000) # 0.5 sec, 1000Hz
-    print("Generating alert_long.wav...")
-    generate_beep("assets/alert_long.wav", 2.0, 1500)  # 2.0 sec, 1500Hz
+    # SoundManager synthesises missing tones itself; this pre-builds them
+    os.makedirs(config.SOUND_DIR, exist_ok=True)
+    for level, (duration, freq) in TONES.items():
+        path = os.path.join(config.SOUND_DIR, f"alert_{level}.wav")
+        print(f"Generating {path}...")
+        generate_beep(path, duration, freq)
     print("Done.")
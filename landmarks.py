@@ -0,0 +1,266 @@
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import config
+
+# Which landmark indices the features read, per landmark layout.
+# eye_indices: (2, 6) [P1..P6] per eye (left, right), P2-P6 and P3-P5 vertical
+# mouth_indices: top, bottom, left, right
+# pose_indices: the 2D points matched against pose.MODEL_POINTS
+# box_indices: points whose extent is the face box, or None for all of them
+LandmarkScheme = namedtuple("LandmarkScheme", ["name", "eye_indices", "mouth_indices", "pose_indices", "box_indices"],
+                            defaults=(None,))
+
+# MediaPipe FaceMesh (468 points, 478 with iris refinement)
+# Eye indices in loop order [P1, P2, P3, P4, P5, P6]
+RIGHT_EYE = [33, 159, 158, 133, 153, 145]
+LEFT_EYE = [362, 380, 374, 263, 386, 385]
+
+# Mouth indices: Top, Bottom, Left, Right
+MOUTH_INDICES = np.array([13, 14, 61, 291])
+
+# 2D points matched against pose.MODEL_POINTS:
+# Nose tip, Chin, Left eye outer corner, Right eye corner (33 is the commonly
+# cited point, although 133 would be the symmetric outer corner),
+# Left mouth corner, Right mouth corner
+POSE_INDICES = np.array([1, 152, 263, 33, 61, 291])
+
+# Face outline (mediapipe FACEMESH_FACE_OVAL); every other point lies inside it
+FACE_OVAL_INDICES = np.array([
+    10, 21, 54, 58, 67, 93, 103, 109, 127, 132, 136, 148, 149, 150, 152, 162, 172, 176,
+    234, 251, 284, 288, 297, 323, 332, 338, 356, 361, 365, 377, 378, 379, 389, 397, 400, 454
+])
+
+MEDIAPIPE_SCHEME = LandmarkScheme("mediapipe", np.array([LEFT_EYE, RIGHT_EYE]), MOUTH_INDICES, POSE_INDICES,
+                                  FACE_OVAL_INDICES)
+
+# iBUG 300-W 68-point layout (OpenCV Facemark, dlib), same roles as above
+IBUG68_SCHEME = LandmarkScheme(
+    "ibug68",
+    np.array([[42, 47, 46, 45, 44, 43], [36, 37, 38, 39, 40, 41]]),
+    np.array([62, 66, 48, 54]),
+    np.array([30, 8, 45, 36, 48, 54]),
+)
+
+# Backend names for config.LANDMARK_BACKEND
+BACKEND_MESH_REFINED = "mesh_refined"   # FaceMesh with iris refinement (reference)
+BACKEND_MESH = "mesh"                   # FaceMesh without the iris model
+BACKEND_OPENCV = "opencv"               # OpenCV face detector + Facemark LBF, detect-then-track
+BACKENDS = [BACKEND_MESH_REFINED, BACKEND_MESH, BACKEND_OPENCV]
+
+
+class MediaPipeMeshBackend:
+    """
+    MediaPipe FaceMesh. Without refinement the iris sub-model is skipped,
+    which none of the features need.
+    FaceMesh tracks landmarks in the coordinates of its previous input,
+    so face crops get their own instance rather than breaking the
+    full-frame instance's tracking every time the input switches; it is
+    built when `roi` is set (default config.ROI_CROP).
+    """
+
+    scheme = MEDIAPIPE_SCHEME
+    color_conversion = cv2.COLOR_BGR2RGB
+    supports_roi = True
+
+    def __init__(self, refine, max_num_faces=1, min_detection_confidence=0.5, min_tracking_confidence=0.5, roi=None):
+        # Imported here: mediapipe alone takes over a second to import
+        import mediapipe as mp
+
+        self.refine = refine
+        self.point_indices = scheme_indices(self.scheme)
+        self.mp_face_mesh = mp.solutions.face_mesh
+        self.mp_drawing = mp.solutions.drawing_utils
+        self.mp_drawing_styles = mp.solutions.drawing_styles
+        self.meshes = {}
+        roi = config.ROI_CROP if roi is None else roi
+        for name in ("full", "roi"):
+            if name == "roi" and not roi:
+                continue
+            self.meshes[name] = self.mp_face_mesh.FaceMesh(
+                max_num_faces=max_num_faces,
+                refine_landmarks=refine,
+                min_detection_confidence=min_detection_confidence,
+                min_tracking_confidence=min_tracking_confidence
+            )
+
+    def process(self, image, name="full"):
+        """
+        Runs on an RGB image. Returns (landmark lists or None, one (N, 3)
+        float32 array per face normalized to `image`). Only the points
+        the scheme reads are filled in; drawing uses the landmark lists.
+        """
+        results = self.meshes[name].process(image)
+        if not results.multi_face_landmarks:
+            return None, []
+        return results.multi_face_landmarks, [landmarks_to_array(face.landmark, self.point_indices)
+                                              for face in results.multi_face_landmarks]
+
+    def draw(self, canvas, results, level):
+        for face_landmarks in results.multi_face_landmarks:
+            if level == "mesh":
+                self.mp_drawing.draw_landmarks(
+                    image=canvas,
+                    landmark_list=face_landmarks,
+                    connections=self.mp_face_mesh.FACEMESH_TESSELATION,
+                    landmark_drawing_spec=None,
+                    connection_drawing_spec=self.mp_drawing_styles
+                    .get_default_face_mesh_tesselation_style())
+            self.mp_drawing.draw_landmarks(
+                image=canvas,
+                landmark_list=face_landmarks,
+                connections=self.mp_face_mesh.FACEMESH_CONTOURS,
+                landmark_drawing_spec=None,
+                connection_drawing_spec=self.mp_drawing_styles
+                .get_default_face_mesh_contours_style())
+            if level == "mesh" and self.refine:
+                self.mp_drawing.draw_landmarks(
+                    image=canvas,
+                    landmark_list=face_landmarks,
+                    connections=self.mp_face_mesh.FACEMESH_IRISES,
+                    landmark_drawing_spec=None,
+                    connection_drawing_spec=self.mp_drawing_styles
+                    .get_default_face_mesh_iris_connections_style())
+
+
+class OpenCVFacemarkBackend:
+    """
+    OpenCV-only detect-then-track: a face detector (YuNet .onnx via
+    FaceDetectorYN, or a Haar cascade .xml) runs every
+    config.OPENCV_REDETECT_INTERVAL frames or when tracking is lost; in
+    between, Facemark LBF is fitted to the box around the previous
+    frame's landmarks. Needs opencv-contrib-python for cv2.face and the
+    model files named in config.py.
+    """
+
+    scheme = IBUG68_SCHEME
+    color_conversion = None
+    supports_roi = False
+
+    def __init__(self, max_num_faces=1, min_detection_confidence=0.5, **_):
+        if not hasattr(cv2, "face"):
+            raise RuntimeError("The opencv landmark backend needs opencv-contrib-python (cv2.face)")
+        for path in (config.OPENCV_FACE_DETECTOR_MODEL, config.OPENCV_FACEMARK_MODEL):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"OpenCV landmark model not found: {path}")
+
+        self.max_num_faces = max_num_faces
+        if config.OPENCV_FACE_DETECTOR_MODEL.endswith(".xml"):
+            self.cascade = cv2.CascadeClassifier(config.OPENCV_FACE_DETECTOR_MODEL)
+            self.yunet = None
+        else:
+            self.cascade = None
+            self.yunet = cv2.FaceDetectorYN.create(
+                config.OPENCV_FACE_DETECTOR_MODEL, "", (320, 320), min_detection_confidence
+            )
+        self.facemark = cv2.face.createFacemarkLBF()
+        self.facemark.loadModel(config.OPENCV_FACEMARK_MODEL)
+
+        self._boxes = None
+        self._frames_since_detect = 0
+        self._gray = None
+
+    def _detect(self, image, gray):
+        if self.yunet is not None:
+            h, w = image.shape[:2]
+            self.yunet.setInputSize((w, h))
+            _, faces = self.yunet.detect(image)
+            if faces is None:
+                return np.empty((0, 4), dtype=np.int32)
+            faces = faces[np.argsort(-faces[:, -1])]
+            return faces[:self.max_num_faces, :4].astype(np.int32)
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60))
+        if len(faces) == 0:
+            return np.empty((0, 4), dtype=np.int32)
+        faces = faces[np.argsort(-(faces[:, 2] * faces[:, 3]))]
+        return faces[:self.max_num_faces].astype(np.int32)
+
+    def process(self, image, name="full"):
+        """
+        Runs on a BGR image. Returns (None, one (68, 3) float32 array per
+        face normalized to `image`, z = 0).
+        """
+        h, w = image.shape[:2]
+        if self._gray is None or self._gray.shape != (h, w):
+            self._gray = np.empty((h, w), dtype=np.uint8)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+
+        boxes = self._boxes
+        if boxes is None or self._frames_since_detect >= config.OPENCV_REDETECT_INTERVAL:
+            boxes = self._detect(image, gray)
+            self._frames_since_detect = 0
+        else:
+            self._frames_since_detect += 1
+        if len(boxes) == 0:
+            self._boxes = None
+            return None, []
+
+        ok, fitted = self.facemark.fit(gray, boxes)
+        if not ok or not fitted:
+            self._boxes = None
+            return None, []
+
+        points = []
+        next_boxes = []
+        for face in fitted:
+            xy = face.reshape(-1, 2)
+            x0, y0 = xy.min(axis=0)
+            x1, y1 = xy.max(axis=0)
+            if x1 - x0 < 10 or y1 - y0 < 10:
+                continue
+            # Landmarks span brows to chin; pad to the box the detector gives
+            pad_x, pad_y = 0.1 * (x1 - x0), 0.15 * (y1 - y0)
+            next_boxes.append((x0 - pad_x, y0 - 2 * pad_y, x1 - x0 + 2 * pad_x, y1 - y0 + 3 * pad_y))
+            face_points = np.zeros((len(xy), 3), dtype=np.float32)
+            face_points[:, 0] = xy[:, 0] / w
+            face_points[:, 1] = xy[:, 1] / h
+            points.append(face_points)
+
+        self._boxes = np.array(next_boxes, dtype=np.int32).reshape(-1, 4) if next_boxes else None
+        return None, points
+
+    def draw(self, canvas, results, level):
+        h, w = canvas.shape[:2]
+        for face_points in results.points:
+            for x, y in (face_points[:, :2] * (w, h)).astype(np.int32).tolist():
+                cv2.circle(canvas, (x, y), 1, (0, 255, 0), -1)
+
+
+def scheme_indices(scheme):
+    """
+    The sorted landmark indices a scheme's features and face box read.
+    """
+    indices = [scheme.eye_indices.ravel(), scheme.mouth_indices, scheme.pose_indices]
+    if scheme.box_indices is not None:
+        indices.append(scheme.box_indices)
+    return np.unique(np.concatenate(indices))
+
+
+def landmarks_to_array(landmarks, indices=None):
+    """
+    Converts a MediaPipe landmark list into a contiguous (N, 3) float32 array.
+    With `indices` only those landmarks are read and the rest are NaN;
+    reading all 478 from protobuf costs more than the features themselves.
+    """
+    if indices is None:
+        return np.array([(lm.x, lm.y, lm.z) for lm in landmarks], dtype=np.float32)
+    points = np.full((len(landmarks), 3), np.nan, dtype=np.float32)
+    points[indices] = [(lm.x, lm.y, lm.z) for lm in map(landmarks.__getitem__, indices.tolist())]
+    return points
+
+
+def create_backend(name=None, **options):
+    """
+    Builds the landmark backend named in config.LANDMARK_BACKEND.
+    """
+    name = name or config.LANDMARK_BACKEND
+    if name == BACKEND_MESH_REFINED:
+        return MediaPipeMeshBackend(refine=True, **options)
+    if name == BACKEND_MESH:
+        return MediaPipeMeshBackend(refine=False, **options)
+    if name == BACKEND_OPENCV:
+        return OpenCVFacemarkBackend(**options)
+    raise ValueError(f"Unknown landmark backend: {name}")
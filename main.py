@@ -1,97 +1,265 @@
-import cv2
-from detector import DrowsinessDetector
+import time
+
+# Process start, for the time-to-first-protected-frame report
+STARTED = time.monotonic()
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
 from alert import SoundManager
 from state_tracker import StateTracker
+from pipeline import FramePipeline
+from scheduler import AdaptiveScheduler
+from renderer import OverlayRenderer
+from metrics import Metrics, MetricsServer
+from telemetry import TelemetryWriter
+from smoothing import SignalStage
+from sources import open_source
+from publisher import StatePublisher
+from clips import ClipRecorder
+from seat import IdentityMap
+from autotune import DriftMonitor, apply_profile, invalidate_profile, load_or_tune, step_down
+from events import EVENT_ALARM, EVENT_STATE, EventBus, create_sinks, make_event
 import config
 
-def main():
-    cap = cv2.VideoCapture(config.CAMERA_INDEX)
+def load_detector():
+    """
+    Imports mediapipe, builds the detector and warms FaceMesh up, so the
+    first camera frame does not pay for model initialisation.
+    """
+    from detector import DrowsinessDetector
+
     detector = DrowsinessDetector()
+    detector.warm_up()
+    return detector
+
+def run(cap, duration=None, detector=None, started=None, profile=None):
+    """
+    Runs the detection loop on an opened capture until it ends, ESC is
+    pressed in the window, or `duration` seconds have passed.
+    `detector` may be a Future still loading on another thread; audio and
+    the other stages are set up while it finishes.
+    With an auto-tuning `profile`, frame times are watched for drift from
+    what it measured.
+    Returns the pipeline stats, startup timings and the capture-to-alert
+    latency of every processed frame.
+    """
+    if started is None:
+        started = time.monotonic()
+    startup = {}
+
     sound_manager = SoundManager()
-    tracker = StateTracker()
-
-    while cap.isOpened():
-        success, image = cap.read()
-        if not success:
-            print("Ignoring empty camera frame.")
-            continue
-
-        results, image = detector.detect(image)
-        image = detector.draw_landmarks(image, results)
-
-        # Default info
-        status_info = {
-            "overall": "NORMAL",
-            "eye": "NONE",
-            "yawn": "NONE",
-            "nod": "NONE",
-            "action": None
+    startup["audio_ready"] = time.monotonic() - started
+    # One tracker and smoothing stage per person, so faces never share state;
+    # alerts follow the driver (the selected face, or the first one)
+    trackers = IdentityMap(StateTracker)
+    last_state = StateTracker.STATE_NORMAL
+
+    # Audio, passenger PA, GPIO and uplink sinks, fed from an asyncio loop
+    event_bus = EventBus(create_sinks(sound_manager))
+    event_bus.start()
+    latencies = deque(maxlen=100000)
+
+    # Smoothing and baseline calibration per face, between detector and tracker
+    signal_stages = IdentityMap(SignalStage)
+
+    # Per-frame features and states, kept in a bounded ring file for replay
+    telemetry = TelemetryWriter() if config.TELEMETRY_ENABLED else None
+
+    # Per-stage timings; every stage skips its timing calls when this is None
+    metrics = Metrics() if config.METRICS_ENABLED else None
+
+    if detector is None:
+        detector = load_detector()
+    elif isinstance(detector, Future):
+        detector = detector.result()
+    startup["detector_ready"] = time.monotonic() - started
+
+    # Capture and inference run on their own threads; this loop is the
+    # alert stage and always works on the newest inferred frame.
+    scheduler = AdaptiveScheduler(detector, metrics=metrics) if config.ADAPTIVE_INFERENCE else None
+    pipeline = FramePipeline(cap, detector, scheduler, metrics)
+
+    # Drawing and display run on their own thread at a capped rate
+    renderer = None
+    if not config.HEADLESS:
+        renderer = OverlayRenderer(detector, metrics=metrics, release=pipeline.release_frame)
+        renderer.start()
+
+    # Frames and state for other local processes, through shared memory
+    publisher = None
+    if config.SHM_PUBLISH_ENABLED:
+        publisher = StatePublisher(detector)
+        publisher.start()
+
+    # Recent frames as JPEGs in memory, saved as a clip around critical alerts
+    clip_recorder = None
+    if config.CLIP_ENABLED:
+        clip_recorder = ClipRecorder()
+        clip_recorder.start()
+
+    # Sustained drift from the tuned frame times steps settings down now and re-tunes at the next start
+    drift_monitor = DriftMonitor(profile) if profile is not None else None
+    step_downs = []
+
+    metrics_server = None
+    if metrics is not None:
+        pipeline.watch(metrics)
+        metrics_server = MetricsServer(metrics)
+        metrics_server.start()
+
+    pipeline.start()
+    start = time.monotonic()
+
+    try:
+        while pipeline.is_running():
+            if renderer is not None and renderer.quit_requested:
+                break
+            if duration is not None and time.monotonic() - start > duration:
+                break
+
+            packet = pipeline.get_result(timeout=0.5)
+            if packet is None:
+                continue
+            stage_start = time.monotonic()
+
+            # Default info
+            status_info = {
+                "overall": "NORMAL",
+                "eye": "NONE",
+                "yawn": "NONE",
+                "nod": "NONE",
+                "action": None
+            }
+
+            if telemetry is not None and not packet.faces:
+                telemetry.write(packet.frame_id, packet.timestamp, 0, None, status_info, packet.estimated)
+
+            tracked = None
+
+            for face_index, face in enumerate(packet.faces):
+                identity = face["identity"]
+                ear, mar, pitch = face["ear"], face["mar"], face["pitch"]
+                if config.SMOOTHING_ENABLED:
+                    stage = signal_stages.get(identity, packet.timestamp)
+                    ear, mar, pitch = stage.process(ear, mar, pitch, packet.timestamp)
+
+                # Update this person's tracker
+                face_status = trackers.get(identity, packet.timestamp).update(ear, mar, pitch, packet.timestamp)
+                face_tracked = dict(face, ear=ear, mar=mar, pitch=pitch)
+                if telemetry is not None:
+                    telemetry.write(packet.frame_id, packet.timestamp, face_index, face_tracked, face_status,
+                                    packet.estimated)
+                if face_index > 0:
+                    continue
+
+                status_info = face_status
+                if scheduler is not None:
+                    scheduler.notify_state(status_info["overall"])
+                # What the tracker saw, so a replay reproduces its states
+                tracked = face_tracked
+
+                # Alerts and state changes go to the sinks without waiting on them
+                if status_info["overall"] != last_state:
+                    event_bus.publish(make_event(EVENT_STATE, packet.frame_id, packet.timestamp, status_info,
+                                                 tracked, face_index, previous=last_state))
+                    last_state = status_info["overall"]
+                if status_info["action"] is not None:
+                    event_bus.publish(make_event(EVENT_ALARM, packet.frame_id, packet.timestamp, status_info,
+                                                 tracked, face_index))
+                if clip_recorder is not None and status_info["action"] == "driver_passenger_long":
+                    clip_recorder.trigger(packet.timestamp)
+
+            if drift_monitor is not None:
+                drift = drift_monitor.observe(packet.inference_time, bool(packet.faces) and not packet.estimated)
+                if drift is not None:
+                    change = step_down(scheduler, renderer) if drift == "slow" else None
+                    if change is not None:
+                        step_downs.append(change)
+                        # Judge the new settings against themselves, not the old baseline
+                        drift_monitor.rebase()
+                    if drift_monitor.drift_events == 1:
+                        invalidate_profile()
+                    print(f"Frame times drifted {drift} of the tuned profile; "
+                          f"{'now using ' + change if change else 'settings unchanged'}, re-tuning at next start")
+
+            now = time.monotonic()
+            latencies.append(now - packet.timestamp)
+            if "first_protected_frame" not in startup:
+                startup["first_protected_frame"] = now - started
+                print(f"Detection running {startup['first_protected_frame']:.2f} s after start")
+            if metrics is not None:
+                metrics.observe("tracker_alert", now - stage_start)
+                metrics.observe("end_to_end", now - packet.timestamp)
+
+            # Before the renderer, which draws onto the frame in place
+            if clip_recorder is not None:
+                clip_recorder.submit(packet.image, packet.timestamp)
+            if publisher is not None:
+                publisher.submit(packet.frame_id, packet.timestamp, packet.image, packet.results,
+                                 packet.faces, tracked, status_info, packet.estimated)
+            # The renderer releases the frame once shown, else it is done with here
+            if renderer is not None:
+                renderer.submit(packet.image, packet.results, packet.faces, status_info)
+            else:
+                pipeline.release_frame(packet.image)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        if renderer is not None:
+            renderer.stop()
+        if publisher is not None:
+            publisher.stop()
+        if clip_recorder is not None:
+            clip_recorder.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if telemetry is not None:
+            telemetry.close()
+        event_bus.close()
+
+    stats = pipeline.stats()
+    stats["elapsed"] = time.monotonic() - start
+    stats["startup"] = startup
+    stats["latencies"] = list(latencies)
+    stats["alert_latency"] = sound_manager.latency_stats()
+    stats["events"] = event_bus.stats()
+    if clip_recorder is not None:
+        stats["clips"] = clip_recorder.stats()
+    if detector.selector is not None:
+        stats["driver_selection"] = detector.selector.stats()
+    if profile is not None:
+        stats["autotune"] = {
+            "settings": profile["settings"],
+            "drift_events": drift_monitor.drift_events,
+            "step_downs": step_downs,
         }
-        
-        if results.multi_face_landmarks:
-            for face_landmarks in results.multi_face_landmarks:
-                left_ear, right_ear = detector.get_eye_landmarks(face_landmarks.landmark)
-                avg_ear = (left_ear + right_ear) / 2.0
-                
-                mar = detector.calculate_mar(face_landmarks.landmark)
-                
-                img_h, img_w, _ = image.shape
-                rot_vec, trans_vec = detector.get_head_pose(face_landmarks.landmark, img_w, img_h)
-                pitch, yaw, roll = detector.get_euler_angles(rot_vec)
-                
-                # Update tracker
-                status_info = tracker.update(avg_ear, mar, pitch)
-                
-                # Trigger alerts
-                if status_info["action"] == "driver_short":
-                    sound_manager.play_driver_short_alarm()
-                elif status_info["action"] == "driver_passenger_long":
-                    sound_manager.play_driver_long_alarm()
-                    sound_manager.play_passenger_long_alarm()
-                
-                # Display Raw Values
-                cv2.putText(image, f'EAR: {avg_ear:.2f}', (30, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                cv2.putText(image, f'MAR: {mar:.2f}', (30, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                cv2.putText(image, f'Pitch: {pitch:.2f}', (30, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-
-        # Display Warnings/Critical Messages
-        y_offset = 130
-        
-        # Eye State
-        if status_info["eye"] == StateTracker.STATE_WARNING:
-            cv2.putText(image, "Eyes closing - WARNING", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 165, 255), 2)
-            y_offset += 30
-        elif status_info["eye"] == StateTracker.STATE_CRITICAL:
-            cv2.putText(image, "Eyes closed - CRITICAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            y_offset += 30
-            
-        # Yawn State
-        if status_info["yawn"] == StateTracker.STATE_WARNING:
-            cv2.putText(image, "Yawning - WARNING", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 165, 255), 2)
-            y_offset += 30
-        elif status_info["yawn"] == StateTracker.STATE_CRITICAL:
-            cv2.putText(image, "Yawning - CRITICAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            y_offset += 30
-            
-        # Nod State
-        if status_info["nod"] == StateTracker.STATE_WARNING:
-            cv2.putText(image, "Head nodding - WARNING", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 165, 255), 2)
-            y_offset += 30
-        elif status_info["nod"] == StateTracker.STATE_CRITICAL:
-            cv2.putText(image, "Head nodding - CRITICAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-            y_offset += 30
-
-        # Overall State (Optional, but good for summary)
-        if status_info["overall"] == StateTracker.STATE_NORMAL:
-             cv2.putText(image, "Status: NORMAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-
-        cv2.imshow('Driver Drowsiness Detection', image)
-        if cv2.waitKey(5) & 0xFF == 27:
-            break
-
-    sound_manager.stop()
+    if metrics is not None:
+        stats["metrics"] = metrics.summary()
+    sound_manager.close()
+    return stats
+
+def main():
+    # Settings for this machine, measured once and cached
+    profile = None
+    if config.AUTOTUNE_ENABLED:
+        profile = load_or_tune()
+        apply_profile(profile)
+
+    # Importing and warming up the model takes longest, so it runs in the
+    # background while the camera and the audio device open
+    executor = ThreadPoolExecutor(max_workers=1)
+    detector = executor.submit(load_detector)
+    executor.shutdown(wait=False)
+
+    cap = open_source()
+    camera_ready = time.monotonic() - STARTED
+    stats = run(cap, detector=detector, started=STARTED, profile=profile)
+    stats["startup"]["camera_ready"] = camera_ready
     cap.release()
-    cv2.destroyAllWindows()
+    stats.pop("latencies")
+    print(f"Pipeline stats: {stats}")
 
 if __name__ == "__main__":
     main()
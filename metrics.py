@@ -0,0 +1,188 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import config
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+
+class RollingHistogram:
+    """
+    Latency histogram in fixed memory: cumulative bucket counts for
+    Prometheus plus a ring of the most recent samples for rolling
+    percentiles. observe() is a couple of list operations, no allocation.
+    """
+
+    def __init__(self, window):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.samples = np.zeros(window, dtype=np.float64)
+        self.window = window
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.samples[self.count % self.window] = seconds
+        self.count += 1
+        self.total += seconds
+
+    def percentiles(self, q=(50, 95, 99)):
+        n = min(self.count, self.window)
+        if n == 0:
+            return [float("nan")] * len(q)
+        return [float(v) for v in np.percentile(self.samples[:n], q)]
+
+
+class Metrics:
+    """
+    Per-stage latency histograms and event counters for the frame loop.
+    Stages call observe(stage, seconds) with monotonic clock deltas;
+    counters are bumped with inc() or read from a callable registered with
+    watch() at export time. Pass None instead of a Metrics object to turn
+    the instrumentation off entirely.
+    """
+
+    def __init__(self, window=None):
+        self.window = window or config.METRICS_WINDOW
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.watched = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, RollingHistogram(self.window))
+        histogram.observe(seconds)
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def watch(self, name, read):
+        """
+        Registers a counter whose value is read from `read()` on export.
+        """
+        self.watched[name] = read
+
+    def _counters(self):
+        counters = dict(self.counters)
+        for name, read in list(self.watched.items()):
+            counters[name] = read()
+        return counters
+
+    def summary(self):
+        """
+        Rolling p50/p95/p99 per stage in milliseconds, plus the counters.
+        """
+        stages = {}
+        for stage, histogram in list(self.histograms.items()):
+            p50, p95, p99 = histogram.percentiles()
+            stages[stage] = {
+                "count": histogram.count,
+                "p50_ms": p50 * 1000.0,
+                "p95_ms": p95 * 1000.0,
+                "p99_ms": p99 * 1000.0,
+            }
+        return {"stages": stages, "counters": self._counters(), "gauges": dict(self.gauges)}
+
+    def log_line(self):
+        summary = self.summary()
+        parts = [f"{stage} {s['p50_ms']:.1f}/{s['p95_ms']:.1f}ms"
+                 for stage, s in summary["stages"].items()]
+        parts += [f"{name}={value}" for name, value in summary["counters"].items()]
+        return "[metrics] p50/p95: " + ", ".join(parts)
+
+    def prometheus(self):
+        """
+        Renders everything in the Prometheus text exposition format.
+        """
+        lines = ["# TYPE drowsiness_stage_seconds histogram"]
+        for stage, histogram in list(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), histogram.bucket_counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'drowsiness_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'drowsiness_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'drowsiness_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        lines.append("# TYPE drowsiness_stage_rolling_seconds gauge")
+        for stage, histogram in list(self.histograms.items()):
+            for q, value in zip((0.5, 0.95, 0.99), histogram.percentiles()):
+                lines.append(f'drowsiness_stage_rolling_seconds{{stage="{stage}",quantile="{q}"}} {value}')
+
+        for name, value in self._counters().items():
+            lines.append(f"# TYPE drowsiness_{name}_total counter")
+            lines.append(f"drowsiness_{name}_total {value}")
+        for name, value in list(self.gauges.items()):
+            lines.append(f"# TYPE drowsiness_{name} gauge")
+            lines.append(f"drowsiness_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """
+    Serves /metrics on a local port from a background thread, and
+    optionally prints a summary line every `log_interval` seconds.
+    """
+
+    def __init__(self, metrics, port=None, log_interval=None, host="127.0.0.1"):
+        self.metrics = metrics
+        self.port = config.METRICS_PORT if port is None else port
+        self.log_interval = config.METRICS_LOG_INTERVAL if log_interval is None else log_interval
+        self.host = host
+        self.httpd = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        if self.port:
+            handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": self.metrics})
+            try:
+                self.httpd = ThreadingHTTPServer((self.host, self.port), handler)
+            except OSError as e:
+                print(f"Could not start metrics endpoint on port {self.port}: {e}")
+            else:
+                self.threads.append(threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True))
+                print(f"Metrics at http://{self.host}:{self.httpd.server_address[1]}/metrics")
+        if self.log_interval:
+            self.threads.append(threading.Thread(target=self._log_loop, name="metrics-log", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def _log_loop(self):
+        while not self.stop_event.wait(self.log_interval):
+            print(self.metrics.log_line())
+
+    def stop(self):
+        self.stop_event.set()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
@@ -0,0 +1,303 @@
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import config
+from sources import FrameSource
+
+# A captured frame on its way to inference
+FramePacket = namedtuple("FramePacket", ["frame_id", "timestamp", "image"])
+
+# An inferred frame on its way to the render/alert stage
+ResultPacket = namedtuple(
+    "ResultPacket",
+    ["frame_id", "timestamp", "image", "results", "faces", "inference_time", "estimated"]
+)
+
+
+class LatestFrameQueue:
+    """
+    Bounded single-slot queue between two pipeline stages.
+    put() never blocks: a newer item replaces the one still waiting,
+    and the replaced item is counted as dropped and passed to `on_drop`
+    (e.g. to recycle its frame). get() always returns the newest item.
+    """
+
+    def __init__(self, on_drop=None):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.on_drop = on_drop
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            replaced = self._item
+            if replaced is not None:
+                self.dropped += 1
+            self._item = item
+            self.put_count += 1
+            self._cond.notify()
+        if replaced is not None and self.on_drop is not None:
+            self.on_drop(replaced)
+
+    def get(self, timeout=None):
+        """
+        Returns the newest item, or None on timeout or once the queue is closed.
+        """
+        with self._cond:
+            if self._item is None and not self._closed:
+                self._cond.wait(timeout)
+            item = self._item
+            self._item = None
+            return item
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class FrameHandoff:
+    """
+    Passes a private copy of the newest frame to a worker thread without
+    allocating per frame. put() copies (or downscales) into one of three
+    reused buffers: one pending, one taken by the worker, one free. As in
+    LatestFrameQueue, a newer frame replaces one still pending. Taking a
+    frame and marking its buffer busy happen under one lock, so put()
+    never writes into a buffer the worker is about to use.
+    """
+
+    def __init__(self):
+        self.buffers = [None] * 3
+        self._cond = threading.Condition()
+        self._pending = None
+        self._busy = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, image, item=None, size=None):
+        """
+        Copies `image`, resized to `size` (width, height) when given, and
+        queues it with `item`.
+        """
+        with self._cond:
+            pending = self._pending[0] if self._pending is not None else None
+            index = next(i for i in range(3) if i != self._busy and i != pending)
+        shape = image.shape if size is None else (size[1], size[0]) + image.shape[2:]
+        buffer = self.buffers[index]
+        if buffer is None or buffer.shape != shape:
+            buffer = self.buffers[index] = np.empty(shape, dtype=image.dtype)
+        if size is None:
+            np.copyto(buffer, image)
+        else:
+            # INTER_AREA looks marginally better but costs ~10x on the caller's thread
+            cv2.resize(image, size, dst=buffer, interpolation=cv2.INTER_LINEAR)
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (index, item)
+            self._cond.notify()
+
+    def take(self, timeout=None):
+        """
+        Returns (buffer, item) for the newest frame, or None on timeout or
+        once closed. The buffer stays the worker's until the next take().
+        """
+        with self._cond:
+            if self._pending is None and not self._closed:
+                self._cond.wait(timeout)
+            pending, self._pending = self._pending, None
+            if pending is None:
+                self._busy = None
+                return None
+            self._busy = pending[0]
+            return self.buffers[pending[0]], pending[1]
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class CaptureThread(threading.Thread):
+    """
+    Reads frames from the camera as fast as it delivers them and hands the
+    newest one to the inference stage, so stale frames never pile up in
+    the camera buffer.
+    `cap` is a sources.FrameSource or a plain cv2.VideoCapture.
+    """
+
+    def __init__(self, cap, out_queue, stop_event, metrics=None):
+        super().__init__(name="capture", daemon=True)
+        self.cap = cap
+        if isinstance(cap, FrameSource):
+            self.live = cap.live
+        else:
+            # Video files have a frame count; a failed read there is the end
+            self.live = cap.get(cv2.CAP_PROP_FRAME_COUNT) <= 0
+        self.out_queue = out_queue
+        self.stop_event = stop_event
+        self.metrics = metrics
+        self.frame_count = 0
+        self.empty_frames = 0
+
+    def run(self):
+        metrics = self.metrics
+        try:
+            while not self.stop_event.is_set() and self.cap.isOpened():
+                read_start = time.monotonic()
+                success, image = self.cap.read()
+                if metrics is not None:
+                    metrics.observe("capture", time.monotonic() - read_start)
+                if not success:
+                    if not self.live:
+                        break
+                    self.empty_frames += 1
+                    if metrics is not None:
+                        metrics.inc("empty_frames")
+                    if not isinstance(self.cap, FrameSource):
+                        # Sources back off themselves; a bare capture would spin
+                        self.stop_event.wait(config.CAMERA_RETRY_DELAY)
+                    continue
+
+                # Capture timestamp on a monotonic clock
+                timestamp = time.monotonic()
+                self.out_queue.put(FramePacket(self.frame_count, timestamp, image))
+                self.frame_count += 1
+        finally:
+            self.out_queue.close()
+
+
+class InferenceWorker(threading.Thread):
+    """
+    Runs FaceMesh and the feature maths on the newest captured frame.
+    FaceMesh and OpenCV release the GIL, so this overlaps with capture
+    and rendering on another core.
+    """
+
+    def __init__(self, detector, in_queue, out_queue, stop_event, scheduler=None, metrics=None):
+        super().__init__(name="inference", daemon=True)
+        self.detector = detector
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stop_event = stop_event
+        self.frame_count = 0
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                packet = self.in_queue.get(timeout=0.1)
+                if packet is None:
+                    if self.in_queue.closed:
+                        break
+                    continue
+
+                start = time.monotonic()
+                if self.scheduler is not None:
+                    results, image, faces, estimated = self.scheduler.process(packet.image, packet.timestamp)
+                else:
+                    results, image = self.detector.detect(packet.image)
+                    detected = time.monotonic()
+                    img_h, img_w, _ = image.shape
+                    faces = self.detector.extract_features(results, img_w, img_h)
+                    estimated = False
+                    if self.metrics is not None:
+                        self.metrics.observe("facemesh", detected - start)
+                        self.metrics.observe("features", time.monotonic() - detected)
+                inference_time = time.monotonic() - start
+                if self.metrics is not None:
+                    self.metrics.observe("queue_wait", start - packet.timestamp)
+
+                self.out_queue.put(ResultPacket(
+                    packet.frame_id, packet.timestamp, image, results, faces, inference_time, estimated
+                ))
+                self.frame_count += 1
+        finally:
+            self.out_queue.close()
+
+
+class FramePipeline:
+    """
+    Capture -> inference -> render/alert pipeline.
+    The capture and inference stages run on their own threads; the caller
+    is the render/alert stage and pulls results with get_result().
+    Frames dropped between stages go back to the source; the caller hands
+    back the ones it got with release_frame() once the last stage is
+    done with them (see sources.FrameSource).
+    """
+
+    def __init__(self, cap, detector, scheduler=None, metrics=None):
+        self.stop_event = threading.Event()
+        self.cap = cap
+        self.frame_queue = LatestFrameQueue(on_drop=lambda packet: self.release_frame(packet.image))
+        self.result_queue = LatestFrameQueue(on_drop=lambda packet: self.release_frame(packet.image))
+        self.scheduler = scheduler
+        self.capture = CaptureThread(cap, self.frame_queue, self.stop_event, metrics)
+        self.inference = InferenceWorker(
+            detector, self.frame_queue, self.result_queue, self.stop_event, scheduler, metrics
+        )
+
+    def start(self):
+        self.capture.start()
+        self.inference.start()
+
+    def is_running(self):
+        return not self.stop_event.is_set() and (
+            self.inference.is_alive() or not self.result_queue.closed
+        )
+
+    def get_result(self, timeout=None):
+        return self.result_queue.get(timeout)
+
+    def release_frame(self, image):
+        """
+        Lets the source read into `image` again.
+        """
+        if isinstance(self.cap, FrameSource):
+            self.cap.recycle(image)
+
+    def stop(self):
+        self.stop_event.set()
+        self.frame_queue.close()
+        self.result_queue.close()
+        self.capture.join(timeout=1.0)
+        self.inference.join(timeout=1.0)
+
+    def stats(self):
+        stats = {
+            "captured": self.capture.frame_count,
+            "empty_frames": self.capture.empty_frames,
+            "inferred": self.inference.frame_count,
+            "dropped_before_inference": self.frame_queue.dropped,
+            "dropped_before_render": self.result_queue.dropped,
+        }
+        if isinstance(self.capture.cap, FrameSource):
+            stats["source"] = self.capture.cap.stats()
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        return stats
+
+    def watch(self, metrics):
+        """
+        Exposes the frame and drop counters through `metrics`; they are
+        read when metrics are exported, not on every frame.
+        """
+        metrics.watch("captured_frames", lambda: self.capture.frame_count)
+        metrics.watch("inferred_frames", lambda: self.inference.frame_count)
+        metrics.watch("dropped_before_inference", lambda: self.frame_queue.dropped)
+        metrics.watch("dropped_before_render", lambda: self.result_queue.dropped)
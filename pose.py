@@ -0,0 +1,181 @@
+import math
+import os
+
+import cv2
+import numpy as np
+
+# 3D model points
+MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),             # Nose tip
+    (0.0, -330.0, -65.0),        # Chin
+    (-225.0, 170.0, -135.0),     # Left eye left corner
+    (225.0, 170.0, -135.0),      # Right eye right corner
+    (-150.0, -150.0, -125.0),    # Left Mouth corner
+    (150.0, -150.0, -125.0)      # Right mouth corner
+])
+
+
+def load_calibration(path):
+    """
+    Loads camera intrinsics from an .npz file (camera_matrix, dist_coeffs and
+    optionally image_size as (w, h)) or an OpenCV YAML/XML file as written by
+    the calibration samples (camera_matrix, distortion_coefficients,
+    image_width, image_height).
+    Returns (camera_matrix, dist_coeffs, image_size or None).
+    """
+    if path.endswith(".npz"):
+        data = np.load(path)
+        camera_matrix = data["camera_matrix"]
+        dist_coeffs = data["dist_coeffs"] if "dist_coeffs" in data else np.zeros((4, 1))
+        image_size = tuple(int(v) for v in data["image_size"]) if "image_size" in data else None
+    else:
+        fs = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+        if not fs.isOpened():
+            raise IOError(f"Could not open calibration file: {path}")
+        camera_matrix = fs.getNode("camera_matrix").mat()
+        dist_coeffs = fs.getNode("distortion_coefficients").mat()
+        if dist_coeffs is None:
+            dist_coeffs = fs.getNode("dist_coeffs").mat()
+        width = fs.getNode("image_width")
+        height = fs.getNode("image_height")
+        image_size = None
+        if not width.empty() and not height.empty():
+            image_size = (int(width.real()), int(height.real()))
+        fs.release()
+        if camera_matrix is None:
+            raise ValueError(f"No camera_matrix in calibration file: {path}")
+
+    if dist_coeffs is None:
+        dist_coeffs = np.zeros((4, 1))
+    return (np.asarray(camera_matrix, dtype=np.float64),
+            np.asarray(dist_coeffs, dtype=np.float64).reshape(-1, 1),
+            image_size)
+
+
+def rotation_to_euler(rmat):
+    """
+    Euler angles (x, y, z) in degrees from a 3x3 rotation matrix.
+    For a proper rotation these are the same angles cv2.RQDecomp3x3 returns,
+    without the full decomposition.
+    """
+    x = math.atan2(rmat[2][1], rmat[2][2])
+    y = math.atan2(-rmat[2][0], math.hypot(rmat[2][1], rmat[2][2]))
+    z = math.atan2(rmat[1][0], rmat[0][0])
+    return math.degrees(x), math.degrees(y), math.degrees(z)
+
+
+def rvec_to_euler(rotation_vector):
+    """
+    Euler angles (x, y, z) in degrees from a Rodrigues rotation vector.
+    Only the five rotation matrix entries the angles need are computed.
+    """
+    rx, ry, rz = (float(v) for v in np.ravel(rotation_vector))
+    theta = math.sqrt(rx * rx + ry * ry + rz * rz)
+    if theta < 1e-12:
+        return 0.0, 0.0, 0.0
+    kx, ky, kz = rx / theta, ry / theta, rz / theta
+    c, s = math.cos(theta), math.sin(theta)
+    t = 1.0 - c
+
+    m00 = c + t * kx * kx
+    m10 = s * kz + t * kx * ky
+    m20 = -s * ky + t * kx * kz
+    m21 = s * kx + t * ky * kz
+    m22 = c + t * kz * kz
+
+    x = math.atan2(m21, m22)
+    y = math.atan2(-m20, math.hypot(m21, m22))
+    z = math.atan2(m10, m00)
+    return math.degrees(x), math.degrees(y), math.degrees(z)
+
+
+class HeadPoseEstimator:
+    """
+    solvePnP head pose with cached camera intrinsics.
+    Intrinsics are built once per resolution, from a calibration file when
+    one is given (scaled to the frame size) or from the usual
+    focal length = image width approximation. Each face's previous
+    rotation/translation is used as the initial guess for the next frame.
+    """
+
+    def __init__(self, calibration_file=None):
+        self.calibration = None
+        if calibration_file:
+            if os.path.exists(calibration_file):
+                self.calibration = load_calibration(calibration_file)
+            else:
+                print(f"Calibration file not found: {calibration_file}")
+        self._intrinsics = {}
+        self._previous = {}
+
+    def intrinsics(self, img_w, img_h):
+        key = (img_w, img_h)
+        cached = self._intrinsics.get(key)
+        if cached is not None:
+            return cached
+
+        if self.calibration is not None:
+            camera_matrix, dist_coeffs, image_size = self.calibration
+            camera_matrix = camera_matrix.copy()
+            if image_size is not None and image_size != key:
+                camera_matrix[0] *= img_w / image_size[0]
+                camera_matrix[1] *= img_h / image_size[1]
+        else:
+            # Camera internals
+            focal_length = img_w
+            center = (img_w / 2, img_h / 2)
+            camera_matrix = np.array(
+                [[focal_length, 0, center[0]],
+                 [0, focal_length, center[1]],
+                 [0, 0, 1]], dtype="double"
+            )
+            dist_coeffs = np.zeros((4, 1)) # Assuming no lens distortion
+
+        cached = (camera_matrix, dist_coeffs)
+        self._intrinsics[key] = cached
+        return cached
+
+    def solve(self, image_points, img_w, img_h, face_index=0):
+        """
+        Returns (rotation_vector, translation_vector) for the given 2D points.
+        """
+        camera_matrix, dist_coeffs = self.intrinsics(img_w, img_h)
+        previous = self._previous.get(face_index)
+
+        success = False
+        if previous is not None:
+            rvec, tvec = previous[0].copy(), previous[1].copy()
+            success, rvec, tvec = cv2.solvePnP(
+                MODEL_POINTS, image_points, camera_matrix, dist_coeffs,
+                rvec=rvec, tvec=tvec, useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE
+            )
+            # A guess from a different head position can converge behind the camera
+            success = success and tvec[2, 0] > 0
+        if not success:
+            success, rvec, tvec = cv2.solvePnP(
+                MODEL_POINTS, image_points, camera_matrix, dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE
+            )
+
+        if success:
+            self._previous[face_index] = (rvec, tvec)
+        else:
+            self._previous.pop(face_index, None)
+        return rvec, tvec
+
+    def keep(self, face_indices):
+        """
+        Drops the warm start of every face not in `face_indices`, e.g. the
+        identities the driver selection has forgotten.
+        """
+        for face_index in [i for i in self._previous if i not in face_indices]:
+            del self._previous[face_index]
+
+    def reset(self):
+        self._previous.clear()
+
+    @staticmethod
+    def euler_angles(rotation_vector):
+        """
+        Euler angles in degrees, straight from the rotation matrix.
+        """
+        return rvec_to_euler(rotation_vector)
@@ -0,0 +1,286 @@
+import argparse
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+import config
+from pipeline import FrameHandoff
+from renderer import render
+from state_tracker import StateTracker
+
+MAGIC = b"DDSM"
+VERSION = 1
+SLOTS = 2
+
+# Segment header: magic, version, slots, frame height, width, channels,
+# slot size (padded to 64 bytes). The head sequence number follows it.
+HEADER = struct.Struct("<4sHHIIII40x")
+HEAD_OFFSET = HEADER.size
+SLOTS_OFFSET = HEADER.size + 64
+
+# Fixed-layout state record, one per slot in front of its frame
+STATE_DTYPE = np.dtype([
+    ("frame_id", "<u8"), ("timestamp", "<f8"), ("wall_time", "<f8"),
+    ("ear", "<f4"), ("mar", "<f4"), ("pitch", "<f4"), ("yaw", "<f4"), ("roll", "<f4"),
+    ("faces", "u1"), ("overall", "u1"), ("eye", "u1"), ("yawn", "u1"), ("nod", "u1"),
+    ("action", "u1"), ("estimated", "u1"), ("_pad", "V1"),
+])
+STATE_SIZE = 64   # STATE_DTYPE padded, so frames start 64-byte aligned
+
+STATE_NAMES = {code: state for state, code in StateTracker.STATE_CODES.items()}
+ACTION_NAMES = {code: action for action, code in StateTracker.ACTION_CODES.items()}
+
+
+def _slot_size(shape):
+    frame_bytes = int(np.prod(shape))
+    return 64 * ((8 + STATE_SIZE + frame_bytes + 63) // 64)
+
+
+class _Segment:
+    """
+    Numpy views over the shared segment. Each slot is
+    [slot seq (int64)] [state record] [frame], like fleet.SharedFrameRing:
+    the writer sets the slot's seq to -1 while filling it and to the new
+    sequence number once done, then advances the head.
+    """
+
+    def __init__(self, shm, shape):
+        self.shm = shm
+        self.shape = tuple(shape)
+        buf = shm.buf
+        slot_size = _slot_size(self.shape)
+        self.head = np.ndarray((1,), dtype=np.int64, buffer=buf, offset=HEAD_OFFSET)
+        self.seqs = []
+        self.states = []
+        self.frames = []
+        for slot in range(SLOTS):
+            offset = SLOTS_OFFSET + slot * slot_size
+            self.seqs.append(np.ndarray((1,), dtype=np.int64, buffer=buf, offset=offset))
+            self.states.append(np.ndarray((), dtype=STATE_DTYPE, buffer=buf, offset=offset + 8))
+            self.frames.append(np.ndarray(self.shape, dtype=np.uint8, buffer=buf, offset=offset + 8 + STATE_SIZE))
+
+    def close(self):
+        # Drop the numpy views before closing the mapping
+        self.head = self.seqs = self.states = self.frames = None
+        self.shm.close()
+
+
+class StatePublisher(threading.Thread):
+    """
+    Publishes the newest frame, with the overlay drawn on it when
+    config.SHM_ANNOTATE is set, and its state record into a shared-memory
+    double buffer named config.SHM_NAME for local readers (see
+    StateReader).
+    submit() only copies the frame into a spare staging buffer (see
+    pipeline.FrameHandoff); drawing and the copy into shared memory happen
+    on this thread, and frames
+    arriving while it is busy are dropped. Readers never take a lock, so
+    however slow they are they cannot hold up the producer.
+    """
+
+    def __init__(self, detector, name=None, annotate=None, level=None):
+        super().__init__(name="publisher", daemon=True)
+        self.detector = detector
+        self.shm_name = name or config.SHM_NAME
+        self.annotate = config.SHM_ANNOTATE if annotate is None else annotate
+        self.level = level or config.RENDER_LEVEL
+        self.stop_event = threading.Event()
+        self.segment = None
+        self.seq = 0
+        self.published = 0
+        self.handoff = FrameHandoff()
+
+    def submit(self, frame_id, timestamp, image, results, faces, face, status_info, estimated=False):
+        """
+        `face` is the feature dict the tracker state came from (None
+        without a face); `faces` and `results` are only used for drawing.
+        """
+        self.handoff.put(image, (frame_id, timestamp, results, faces, face, status_info, estimated))
+
+    def _create(self, shape):
+        size = SLOTS_OFFSET + SLOTS * _slot_size(shape)
+        try:
+            shm = shared_memory.SharedMemory(name=self.shm_name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a crashed run; readers re-attach by name
+            stale = shared_memory.SharedMemory(name=self.shm_name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=self.shm_name, create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, SLOTS, shape[0], shape[1], shape[2], _slot_size(shape))
+        self.segment = _Segment(shm, shape)
+        self.segment.head[0] = 0
+        for seq in self.segment.seqs:
+            seq[0] = 0
+
+    def _publish(self, image, frame_id, timestamp, face, status_info, estimated):
+        if self.segment is None:
+            self._create(image.shape)
+        segment = self.segment
+        seq = self.seq + 1
+        slot = seq % SLOTS
+        segment.seqs[slot][0] = -1
+
+        if image.shape == segment.shape:
+            np.copyto(segment.frames[slot], image)
+        else:
+            cv2.resize(image, (segment.shape[1], segment.shape[0]), dst=segment.frames[slot])
+
+        state = segment.states[slot]
+        codes = StateTracker.STATE_CODES
+        state["frame_id"] = frame_id
+        state["timestamp"] = timestamp
+        state["wall_time"] = time.time()
+        for key in ("ear", "mar", "pitch", "yaw", "roll"):
+            state[key] = face[key] if face is not None else np.nan
+        state["faces"] = 0 if face is None else 1
+        for key in ("overall", "eye", "yawn", "nod"):
+            state[key] = codes[status_info[key]]
+        state["action"] = StateTracker.ACTION_CODES[status_info["action"]]
+        state["estimated"] = estimated
+
+        segment.seqs[slot][0] = seq
+        segment.head[0] = seq
+        self.seq = seq
+        self.published += 1
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                taken = self.handoff.take(timeout=0.1)
+                if taken is None:
+                    if self.handoff.closed:
+                        break
+                    continue
+                image, (frame_id, timestamp, results, faces, face, status_info, estimated) = taken
+                if self.annotate:
+                    image = render(self.detector, image, results, faces, status_info, self.level)
+                self._publish(image, frame_id, timestamp, face, status_info, estimated)
+        finally:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment.shm.unlink()
+                self.segment = None
+
+    def stop(self):
+        self.stop_event.set()
+        self.handoff.close()
+        self.join(timeout=1.0)
+
+
+class StateReader:
+    """
+    Attaches to a StatePublisher's segment by name. Any number of readers
+    can attach; none of them is visible to the publisher.
+    With two slots, the frame published as `seq` is only overwritten by
+    seq + 2, so a reader has a whole frame interval to use it in place.
+    """
+
+    def __init__(self, name=None):
+        name = name or config.SHM_NAME
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 registers attached segments with the resource
+            # tracker, which would unlink the publisher's segment on exit
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        magic, version, slots, height, width, channels, _ = HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION or slots != SLOTS:
+            shm.close()
+            raise ValueError(f"Shared memory segment {name} is not a state publisher segment")
+        self.segment = _Segment(shm, (height, width, channels))
+        self.shape = self.segment.shape
+
+    def latest_seq(self):
+        return int(self.segment.head[0])
+
+    def frame_view(self, seq):
+        """
+        The published frame `seq` in shared memory, without a copy. Check
+        is_valid(seq) after using it: False means it was overwritten while
+        being read.
+        """
+        return self.segment.frames[seq % SLOTS]
+
+    def is_valid(self, seq):
+        return seq > 0 and int(self.segment.seqs[seq % SLOTS][0]) == seq
+
+    def read_state(self, last_seq=0):
+        """
+        The newest state record as a dict if it is newer than `last_seq`,
+        else None. Also None if it was overwritten while being read.
+        """
+        seq = self.latest_seq()
+        if seq <= last_seq:
+            return None
+        record = self.segment.states[seq % SLOTS].copy()
+        if not self.is_valid(seq):
+            return None
+        state = {name: record[name].item() for name in STATE_DTYPE.names if not name.startswith("_")}
+        for key in ("overall", "eye", "yawn", "nod"):
+            state[key] = STATE_NAMES.get(state[key], "NONE")
+        state["action"] = ACTION_NAMES.get(state["action"])
+        state["estimated"] = bool(state["estimated"])
+        state["seq"] = seq
+        return state
+
+    def read_frame(self, out, last_seq=0):
+        """
+        Copies the newest frame into `out` if it is newer than `last_seq`.
+        Returns its state dict, or None as read_state() does.
+        """
+        state = self.read_state(last_seq)
+        if state is None:
+            return None
+        np.copyto(out, self.frame_view(state["seq"]))
+        if not self.is_valid(state["seq"]):
+            return None
+        return state
+
+    def close(self):
+        self.segment.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow the state (and frames) published by main.py.")
+    parser.add_argument("--name", default=None, help="Shared memory segment name (default: config.SHM_NAME)")
+    parser.add_argument("--show", action="store_true", help="Display the published frames")
+    args = parser.parse_args()
+
+    reader = None
+    while reader is None:
+        try:
+            reader = StateReader(args.name)
+        except FileNotFoundError:
+            # The publisher creates the segment with its first frame
+            print("Waiting for the publisher...")
+            time.sleep(1.0)
+    frame = np.empty(reader.shape, dtype=np.uint8)
+    last_seq = 0
+    try:
+        while True:
+            state = reader.read_frame(frame, last_seq) if args.show else reader.read_state(last_seq)
+            if state is None:
+                time.sleep(0.005)
+                continue
+            last_seq = state["seq"]
+            print(f"{state['seq']:8d} frame {state['frame_id']:8d}  EAR {state['ear']:.3f}  "
+                  f"MAR {state['mar']:.3f}  pitch {state['pitch']:8.1f}  {state['overall']}")
+            if args.show:
+                cv2.imshow("Published frames", frame)
+                if cv2.waitKey(1) & 0xFF == 27:
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+        cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
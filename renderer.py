@@ -0,0 +1,167 @@
+import threading
+import time
+
+import cv2
+
+import config
+from pipeline import LatestFrameQueue
+from state_tracker import StateTracker
+
+# Render detail levels, cheapest first
+LEVEL_NONE = "none"           # Camera image only
+LEVEL_HUD = "hud"             # + raw values and state text
+LEVEL_CONTOURS = "contours"   # + face contours
+LEVEL_MESH = "mesh"           # + full tessellation and irises
+LEVELS = [LEVEL_NONE, LEVEL_HUD, LEVEL_CONTOURS, LEVEL_MESH]
+
+
+def draw_values(image, face):
+    """
+    Draws the raw EAR/MAR/pitch values of a face.
+    """
+    cv2.putText(image, f'EAR: {face["ear"]:.2f}', (30, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    cv2.putText(image, f'MAR: {face["mar"]:.2f}', (30, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    cv2.putText(image, f'Pitch: {face["pitch"]:.2f}', (30, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return image
+
+
+def draw_status(image, status_info):
+    """
+    Draws the warning/critical messages for the current tracker state.
+    """
+    y_offset = 130
+
+    # Eye State
+    if status_info["eye"] == StateTracker.STATE_WARNING:
+        cv2.putText(image, "Eyes closing - WARNING", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 165, 255), 2)
+        y_offset += 30
+    elif status_info["eye"] == StateTracker.STATE_CRITICAL:
+        cv2.putText(image, "Eyes closed - CRITICAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+        y_offset += 30
+
+    # Yawn State
+    if status_info["yawn"] == StateTracker.STATE_WARNING:
+        cv2.putText(image, "Yawning - WARNING", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 165, 255), 2)
+        y_offset += 30
+    elif status_info["yawn"] == StateTracker.STATE_CRITICAL:
+        cv2.putText(image, "Yawning - CRITICAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+        y_offset += 30
+
+    # Nod State
+    if status_info["nod"] == StateTracker.STATE_WARNING:
+        cv2.putText(image, "Head nodding - WARNING", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 165, 255), 2)
+        y_offset += 30
+    elif status_info["nod"] == StateTracker.STATE_CRITICAL:
+        cv2.putText(image, "Head nodding - CRITICAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+        y_offset += 30
+
+    # Overall State (Optional, but good for summary)
+    if status_info["overall"] == StateTracker.STATE_NORMAL:
+         cv2.putText(image, "Status: NORMAL", (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+
+    return image
+
+
+def draw_occupants(image, occupants):
+    """
+    Draws the driver seat region and the boxes of the faces the driver
+    selection saw: the driver in green, everyone else in grey.
+    """
+    h, w = image.shape[:2]
+    x0, y0, x1, y1 = config.DRIVER_SEAT_REGION
+    cv2.rectangle(image, (int(x0 * w), int(y0 * h)), (int(x1 * w) - 1, int(y1 * h) - 1), (255, 255, 0), 1)
+    for occupant in occupants:
+        bx0, by0, bx1, by1 = (int(v) for v in occupant["box"])
+        color = (0, 255, 0) if occupant["driver"] else (160, 160, 160)
+        cv2.rectangle(image, (bx0, by0), (bx1, by1), color, 2)
+        cv2.putText(image, str(occupant["identity"]), (bx0, max(12, by0 - 4)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return image
+
+
+def render(detector, image, results, faces, status_info, level):
+    """
+    Draws the overlay for the given detail level onto `image`.
+    """
+    if level in (LEVEL_CONTOURS, LEVEL_MESH) and results is not None:
+        image = detector.draw_landmarks(image, results, level)
+    if level != LEVEL_NONE:
+        if results is not None and results.occupants is not None:
+            draw_occupants(image, results.occupants)
+        for face in faces:
+            draw_values(image, face)
+        draw_status(image, status_info)
+    return image
+
+
+class OverlayRenderer(threading.Thread):
+    """
+    Draws and displays frames on its own thread at a capped rate, so
+    drawing and the blocking imshow/waitKey never delay detection or alerts.
+    submit() only hands over the newest frame; frames arriving faster than
+    the display rate are dropped.
+    Note: HighGUI windows from a worker thread work with the GTK and Qt
+    backends (Linux, Windows) but not on macOS.
+    """
+
+    def __init__(self, detector, level=None, max_fps=None, window_name='Driver Drowsiness Detection', metrics=None,
+                 release=None):
+        super().__init__(name="renderer", daemon=True)
+        self.detector = detector
+        self.metrics = metrics
+        # Called with each frame once drawn and shown, or dropped (FramePipeline.release_frame)
+        self.release = release
+        self.level = level or config.RENDER_LEVEL
+        if self.level not in LEVELS:
+            raise ValueError(f"Unknown render level: {self.level}")
+        self.min_interval = 1.0 / (max_fps or config.RENDER_MAX_FPS)
+        self.window_name = window_name
+        self.queue = LatestFrameQueue(on_drop=lambda item: self._release(item[0]))
+        self.stop_event = threading.Event()
+        self.quit_requested = False
+        self.rendered = 0
+
+    def submit(self, image, results, faces, status_info):
+        """
+        Hands over the frame, which is drawn on in place and released
+        afterwards.
+        """
+        self.queue.put((image, results, faces, status_info))
+
+    def _release(self, image):
+        if self.release is not None:
+            self.release(image)
+
+    def run(self):
+        next_frame = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                item = self.queue.get(timeout=0.1)
+                if item is None:
+                    if self.queue.closed:
+                        break
+                    continue
+                next_frame = time.monotonic() + self.min_interval
+
+                image, results, faces, status_info = item
+                start = time.monotonic()
+                image = render(self.detector, image, results, faces, status_info, self.level)
+                drawn = time.monotonic()
+                cv2.imshow(self.window_name, image)
+                if cv2.waitKey(1) & 0xFF == 27:
+                    self.quit_requested = True
+                self._release(image)
+                self.rendered += 1
+                if self.metrics is not None:
+                    self.metrics.observe("render", drawn - start)
+                    self.metrics.observe("display", time.monotonic() - drawn)
+        finally:
+            cv2.destroyAllWindows()
+
+    def stop(self):
+        self.stop_event.set()
+        self.queue.close()
+        self.join(timeout=1.0)
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+
+import config
+from detector import compute_features, pose_image_points
+from state_tracker import StateTracker
+
+
+class AdaptiveScheduler:
+    """
+    Runs FaceMesh only as often as the risk requires.
+    While every signal sits well inside its normal bounds and the tracker
+    is NORMAL, the inference interval grows one frame at a time up to
+    config.SCHED_MAX_INTERVAL. Skipped frames get features estimated from
+    the recent landmark trajectory. As soon as a measured or estimated
+    signal nears its threshold, no face is found, or the tracker leaves
+    NORMAL, inference returns to every frame.
+    process() runs on the inference thread and notify_state() on the
+    alert stage's, so the interval and tracker state they share are only
+    touched under `lock`.
+    """
+
+    def __init__(self, detector, max_interval=None, metrics=None):
+        self.detector = detector
+        self.metrics = metrics
+        self.max_interval = max_interval or config.SCHED_MAX_INTERVAL
+        self.lock = threading.Lock()
+        self.interval = 1
+        self.frames_since_inference = 0
+        self.tracker_state = StateTracker.STATE_NORMAL
+
+        # (timestamp, faces) of the last two inferred frames
+        self.history = deque(maxlen=2)
+        self.last_results = None
+
+        self.inferred_frames = 0
+        self.estimated_frames = 0
+
+    def notify_state(self, overall_state):
+        """
+        Feeds back the tracker's overall state. Called from the alert stage.
+        """
+        with self.lock:
+            self.tracker_state = overall_state
+            if overall_state != StateTracker.STATE_NORMAL:
+                self.interval = 1
+
+    def process(self, image, timestamp=None):
+        """
+        Returns (results, image, faces, estimated). On estimated frames,
+        results are the last inferred results.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        img_h, img_w, _ = image.shape
+
+        with self.lock:
+            interval = self.interval
+        if self.frames_since_inference + 1 < interval and self._can_estimate():
+            start = time.monotonic()
+            faces = self._estimate(timestamp, img_w, img_h)
+            self.frames_since_inference += 1
+            self.estimated_frames += 1
+            if self.metrics is not None:
+                self.metrics.observe("estimate", time.monotonic() - start)
+            with self.lock:
+                if not self._is_safe(faces):
+                    self.interval = 1
+            return self.last_results, image, faces, True
+
+        start = time.monotonic()
+        results, image = self.detector.detect(image)
+        detected = time.monotonic()
+        faces = self.detector.extract_features(results, img_w, img_h)
+        if self.metrics is not None:
+            self.metrics.observe("facemesh", detected - start)
+            self.metrics.observe("features", time.monotonic() - detected)
+        self.history.append((timestamp, faces))
+        self.last_results = results
+        self.frames_since_inference = 0
+        self.inferred_frames += 1
+
+        # Under the lock, so a state change during inference is not overwritten
+        with self.lock:
+            if self._is_safe(faces):
+                self.interval = min(self.interval + 1, self.max_interval)
+            else:
+                self.interval = 1
+        return results, image, faces, False
+
+    def _can_estimate(self):
+        if len(self.history) < 2:
+            return False
+        (_, prev_faces), (_, last_faces) = self.history
+        # Only the same people can be extrapolated
+        return len(last_faces) > 0 and [f["identity"] for f in prev_faces] == [f["identity"] for f in last_faces]
+
+    def _estimate(self, timestamp, img_w, img_h):
+        """
+        Linearly extrapolates each face's landmarks from the last two
+        inferred frames and recomputes the features from them.
+        """
+        (t0, prev_faces), (t1, last_faces) = self.history
+        alpha = (timestamp - t1) / (t1 - t0) if t1 > t0 else 0.0
+
+        faces = []
+        for prev, last in zip(prev_faces, last_faces):
+            points = last["points"] + (last["points"] - prev["points"]) * alpha
+            features = compute_features(points, self.detector.scheme)
+            rot_vec, _ = self.detector.pose_estimator.solve(
+                pose_image_points(points, img_w, img_h, self.detector.scheme), img_w, img_h, last["identity"]
+            )
+            pitch, yaw, roll = self.detector.get_euler_angles(rot_vec)
+            faces.append({
+                "ear": float(features["ear"]),
+                "mar": float(features["mar"]),
+                "pitch": pitch,
+                "yaw": yaw,
+                "roll": roll,
+                "points": points,
+                "identity": last["identity"]
+            })
+        return faces
+
+    def _is_safe(self, faces):
+        # Called with the lock held
+        if not faces or self.tracker_state != StateTracker.STATE_NORMAL:
+            return False
+        for face in faces:
+            if face["ear"] - config.EAR_THRESHOLD < config.SCHED_EAR_MARGIN:
+                return False
+            if config.MAR_THRESHOLD - face["mar"] < config.SCHED_MAR_MARGIN:
+                return False
+            if face["pitch"] - config.PITCH_THRESHOLD < config.SCHED_PITCH_MARGIN:
+                return False
+        return True
+
+    def stats(self):
+        total = self.inferred_frames + self.estimated_frames
+        return {
+            "inferred": self.inferred_frames,
+            "estimated": self.estimated_frames,
+            "inference_ratio": self.inferred_frames / total if total else 1.0,
+        }
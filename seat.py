@@ -0,0 +1,234 @@
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+import config
+
+# Face detector models for config.DRIVER_DETECTOR_RANGE (MediaPipe BlazeFace)
+RANGE_SHORT = "short"   # Faces within about 2 m of the camera; cheapest
+RANGE_FULL = "full"     # Up to about 5 m, so passengers further back are seen too
+DETECTOR_MODELS = {RANGE_SHORT: 0, RANGE_FULL: 1}
+
+
+class FaceBoxDetector:
+    """
+    MediaPipe's BlazeFace face detector: boxes only, at a fraction of
+    FaceMesh's cost, in one pass however many faces are in the frame.
+    """
+
+    def __init__(self, detector_range=None, min_confidence=None):
+        import mediapipe as mp
+
+        detector_range = detector_range or config.DRIVER_DETECTOR_RANGE
+        if detector_range not in DETECTOR_MODELS:
+            raise ValueError(f"Unknown face detector range: {detector_range}")
+        self.detector = mp.solutions.face_detection.FaceDetection(
+            model_selection=DETECTOR_MODELS[detector_range],
+            min_detection_confidence=min_confidence or config.DRIVER_DETECTION_CONFIDENCE
+        )
+        self._rgb = None
+
+    def detect(self, image):
+        """
+        Returns a (faces, 5) float32 array of x0, y0, x1, y1 (pixels) and
+        score for a BGR image.
+        """
+        h, w = image.shape[:2]
+        if self._rgb is None or self._rgb.shape != image.shape:
+            self._rgb = np.empty_like(image)
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        results = self.detector.process(self._rgb)
+
+        boxes = np.empty((len(results.detections or []), 5), dtype=np.float32)
+        for row, detection in zip(boxes, results.detections or []):
+            box = detection.location_data.relative_bounding_box
+            row[:] = (box.xmin * w, box.ymin * h, (box.xmin + box.width) * w, (box.ymin + box.height) * h,
+                      detection.score[0])
+        return boxes
+
+
+def _area(box):
+    return max(0.0, box[2] - box[0]) * max(0.0, box[3] - box[1])
+
+
+def _iou(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    union = _area(a) + _area(b) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class DriverSelector:
+    """
+    Picks the driver's face among everyone the camera sees, so the
+    landmark model and the feature work run on the driver's crop only and
+    their cost does not grow with the number of passengers.
+
+    Faces are found with the cheap box detector every
+    config.DRIVER_DETECT_INTERVAL frames, or as soon as the driver is
+    lost, and matched to the previous boxes by overlap, so each person
+    keeps an identity while in view. The driver is the largest face whose
+    centre lies in config.DRIVER_SEAT_REGION; the current driver is kept
+    unless another face there is config.DRIVER_SWITCH_RATIO times larger,
+    so someone leaning in does not take over.
+    """
+
+    def __init__(self, seat_region=None, detect_interval=None, box_detector=None):
+        self.seat_region = tuple(seat_region or config.DRIVER_SEAT_REGION)
+        self.detect_interval = detect_interval or config.DRIVER_DETECT_INTERVAL
+        self.box_detector = box_detector or FaceBoxDetector()
+
+        # identity -> {"box": (x0, y0, x1, y1) in pixels, "last_seen": monotonic time}
+        self.tracks = {}
+        self.visible = []
+        self.next_identity = 0
+        self.driver = None
+        self.last_driver = None
+        self.frames_since_detect = 0
+
+        self.detections = 0
+        self.driver_changes = 0
+        self.max_occupants = 0
+        self.detect_times = deque(maxlen=256)
+
+    def warm_up(self, image):
+        self.box_detector.detect(image)
+
+    def _match(self, boxes, now):
+        """
+        Assigns each detected box to the unmatched track it overlaps most,
+        or to a new identity.
+        """
+        unmatched = set(self.tracks)
+        self.visible = []
+        for box in boxes[np.argsort(-boxes[:, 4])]:
+            box = tuple(float(v) for v in box[:4])
+            best, best_iou = None, config.OCCUPANT_MATCH_IOU
+            for identity in unmatched:
+                overlap = _iou(box, self.tracks[identity]["box"])
+                if overlap >= best_iou:
+                    best, best_iou = identity, overlap
+            if best is None:
+                best = self.next_identity
+                self.next_identity += 1
+            else:
+                unmatched.discard(best)
+            self.tracks[best] = {"box": box, "last_seen": now}
+            self.visible.append(best)
+
+        for identity in unmatched:
+            if now - self.tracks[identity]["last_seen"] > config.OCCUPANT_FORGET_SEC:
+                del self.tracks[identity]
+        self.max_occupants = max(self.max_occupants, len(self.visible))
+
+    def _in_seat(self, box, img_w, img_h):
+        x0, y0, x1, y1 = self.seat_region
+        cx = (box[0] + box[2]) / 2.0 / img_w
+        cy = (box[1] + box[3]) / 2.0 / img_h
+        return x0 <= cx <= x1 and y0 <= cy <= y1
+
+    def _choose_driver(self, img_w, img_h):
+        candidates = [i for i in self.visible if self._in_seat(self.tracks[i]["box"], img_w, img_h)]
+        if not candidates:
+            self.driver = None
+            return
+        largest = max(candidates, key=lambda i: _area(self.tracks[i]["box"]))
+        if self.driver in candidates and (
+                _area(self.tracks[largest]["box"]) < config.DRIVER_SWITCH_RATIO * _area(self.tracks[self.driver]["box"])):
+            return
+        if self.last_driver is not None and largest != self.last_driver:
+            self.driver_changes += 1
+        self.driver = self.last_driver = largest
+
+    def _detect(self, image):
+        start = time.monotonic()
+        boxes = self.box_detector.detect(image)
+        self.detect_times.append(time.monotonic() - start)
+        self.detections += 1
+        self.frames_since_detect = 0
+        self._match(boxes, start)
+        self._choose_driver(image.shape[1], image.shape[0])
+
+    def driver_roi(self, image, face_box=None):
+        """
+        The padded pixel region (x0, y0, x1, y1) to run the landmark model
+        on for this frame, or None while nobody is in the seat.
+        `face_box` is the driver's box from the previous frame's
+        landmarks, which the crop and the driver's track follow between
+        detection passes, so a nod or lean does not lose the identity.
+        """
+        img_h, img_w = image.shape[:2]
+        self.frames_since_detect += 1
+        box = face_box
+        if box is None or self.driver is None or self.frames_since_detect >= self.detect_interval:
+            self._detect(image)
+            if self.driver is None:
+                return None
+            # The detection is fresher, and may be another person than the landmarks
+            box = self.tracks[self.driver]["box"]
+        else:
+            box = tuple(float(v) for v in box)
+            self.tracks[self.driver] = {"box": box, "last_seen": time.monotonic()}
+
+        x0, y0, x1, y1 = box
+        pad = config.ROI_PADDING * max(x1 - x0, y1 - y0)
+        return (max(0, int(x0 - pad)), max(0, int(y0 - pad)),
+                min(img_w, int(x1 + pad) + 1), min(img_h, int(y1 + pad) + 1))
+
+    def lost(self):
+        """
+        The landmark model found no face in the driver's crop: look again
+        on the next frame.
+        """
+        self.frames_since_detect = self.detect_interval
+
+    def occupants(self):
+        """
+        The faces seen in the last detection pass, as dicts with their
+        identity, pixel box and whether they are the driver.
+        """
+        return [
+            {"identity": identity, "box": self.tracks[identity]["box"], "driver": identity == self.driver}
+            for identity in self.visible
+        ]
+
+    def stats(self):
+        stats = {
+            "detections": self.detections,
+            "driver_changes": self.driver_changes,
+            "occupants": len(self.visible),
+            "max_occupants": self.max_occupants,
+        }
+        if self.detect_times:
+            stats["detect_ms"] = 1000.0 * sum(self.detect_times) / len(self.detect_times)
+        return stats
+
+
+class IdentityMap:
+    """
+    One state object per person (a StateTracker, a smoothing stage, ...),
+    keyed by face identity and made by `factory` on first sight. Entries
+    unseen for config.OCCUPANT_FORGET_SEC are dropped, as
+    DriverSelector drops the identities themselves.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        # identity -> [state, last seen timestamp]
+        self.entries = {}
+
+    def get(self, identity, timestamp):
+        entry = self.entries.get(identity)
+        if entry is None:
+            entry = self.entries[identity] = [self.factory(), timestamp]
+            stale = [i for i, (_, seen) in self.entries.items() if timestamp - seen > config.OCCUPANT_FORGET_SEC]
+            for i in stale:
+                del self.entries[i]
+        entry[1] = timestamp
+        return entry[0]
+
+    def __len__(self):
+        return len(self.entries)
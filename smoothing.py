@@ -0,0 +1,272 @@
+import math
+from bisect import bisect_left, insort
+from collections import deque
+
+import config
+
+FILTER_NONE = "none"
+FILTER_MEAN = "mean"
+FILTER_MEDIAN = "median"
+FILTERS = [FILTER_NONE, FILTER_MEAN, FILTER_MEDIAN]
+
+# One full turn in the tracker's pitch scale: DrowsinessDetector.get_euler_angles
+# scales degrees by 360, so the angle wraps from +64800 to -64800
+PITCH_PERIOD = 360.0 * 360.0
+
+
+def wrap_pitch(pitch):
+    """
+    Brings a pitch back into the tracker's [-PITCH_PERIOD/2, PITCH_PERIOD/2) range.
+    """
+    return (pitch + PITCH_PERIOD / 2.0) % PITCH_PERIOD - PITCH_PERIOD / 2.0
+
+
+def unwrap_pitch(pitch, near):
+    """
+    The value equivalent to `pitch` (same orientation) closest to `near`,
+    so a head facing the camera, where the angle wraps, gives a continuous
+    signal instead of jumps between +64800 and -64800.
+    """
+    return near + wrap_pitch(pitch - near)
+
+
+class RollingWindow:
+    """
+    The values of the last `seconds` seconds (at least the newest one), so
+    the lag is the same at any frame rate. The mean is kept as a running
+    sum; for the median a sorted copy is kept with bisect, which costs a
+    binary search plus a short shift of the few values in the window per
+    push, instead of a sort per frame.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.items = deque()
+        self.ordered = []
+        self.total = 0.0
+        self.pushes = 0
+
+    def push(self, value, timestamp):
+        self.items.append((timestamp, value))
+        insort(self.ordered, value)
+        self.total += value
+        while timestamp - self.items[0][0] > self.seconds:
+            _, old = self.items.popleft()
+            del self.ordered[bisect_left(self.ordered, old)]
+            self.total -= old
+        self.pushes += 1
+        if self.pushes % 1024 == 0:
+            # Re-sum now and then so rounding errors never build up
+            self.total = math.fsum(self.ordered)
+
+    def mean(self):
+        return self.total / len(self.items)
+
+    def median(self):
+        count = len(self.ordered)
+        middle = count // 2
+        if count % 2:
+            return self.ordered[middle]
+        return 0.5 * (self.ordered[middle - 1] + self.ordered[middle])
+
+    def reset(self):
+        self.items.clear()
+        self.ordered.clear()
+        self.total = 0.0
+
+
+class Ema:
+    """
+    Exponential moving average with a time constant in seconds, so the
+    smoothing is the same at any frame rate.
+    """
+
+    def __init__(self, tau):
+        self.tau = tau
+        self.value = None
+        self.last_timestamp = None
+
+    def update(self, value, timestamp):
+        if self.value is None or self.tau <= 0:
+            self.value = value
+        else:
+            dt = max(timestamp - self.last_timestamp, 0.0)
+            self.value += (1.0 - math.exp(-dt / self.tau)) * (value - self.value)
+        self.last_timestamp = timestamp
+        return self.value
+
+    def reset(self):
+        self.value = None
+        self.last_timestamp = None
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate in constant memory (the P-square algorithm,
+    Jain & Chlamtac 1985): five markers track the minimum, p/2, p,
+    (1+p)/2 quantiles and the maximum, adjusted with a parabolic fit as
+    values arrive.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0.0, 2.0 * p, 4.0 * p, 2.0 + 2.0 * p, 4.0]
+        self.increments = [0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0]
+        self.count = 0
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            if self.count == 5:
+                q.sort()
+            return
+
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self):
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            ordered = sorted(self.heights)
+            return ordered[min(int(self.p * len(ordered)), len(ordered) - 1)]
+        return self.heights[2]
+
+
+class BaselineCalibrator:
+    """
+    Learns one driver's open-eye EAR and neutral head pitch over the first
+    config.CALIBRATION_SEC seconds with a face, then maps their EAR and
+    pitch onto the reference levels the config.py thresholds were tuned
+    for. Until then values pass through unchanged.
+    Pitch must be unwrapped (see unwrap_pitch), so the median is of one
+    orientation; the offset is the shortest turn onto the reference, which
+    sits clear of the wrap so a steady head never reads as nodding.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ear_quantile = P2Quantile(config.CALIBRATION_EAR_QUANTILE)
+        self.pitch_quantile = P2Quantile(0.5)
+        self.start = None
+        self.calibrated = False
+        self.ear_scale = 1.0
+        self.pitch_offset = 0.0
+
+    def update(self, ear, pitch, timestamp):
+        if self.calibrated:
+            return
+        if self.start is None:
+            self.start = timestamp
+        self.ear_quantile.add(ear)
+        self.pitch_quantile.add(pitch)
+        if timestamp - self.start >= config.CALIBRATION_SEC:
+            low, high = config.CALIBRATION_SCALE_LIMITS
+            open_ear = self.ear_quantile.value()
+            if open_ear > 0:
+                self.ear_scale = min(max(config.CALIBRATION_REFERENCE_EAR / open_ear, low), high)
+            self.pitch_offset = wrap_pitch(config.CALIBRATION_REFERENCE_PITCH - self.pitch_quantile.value())
+            self.calibrated = True
+
+    def apply(self, ear, pitch):
+        return ear * self.ear_scale, pitch + self.pitch_offset
+
+
+class SignalStage:
+    """
+    Per-face signal conditioning between the detector and StateTracker:
+    a rolling mean or median over config.*_WINDOW_SEC seconds so a single
+    noisy frame cannot reset a counter, an optional time-constant EMA, and
+    the baseline calibration. Calibration restarts after the face has been
+    gone for config.CALIBRATION_RESET_SEC, e.g. after a driver change.
+    Pitch is unwrapped against the previous frame for all of this and
+    wrapped back into the tracker's range on the way out.
+    Used by main.py, analyze.py and tune.py alike, so thresholds are tuned
+    on the values the live tracker sees.
+    """
+
+    def __init__(self, method=None, ema_tau=None, calibrate=None):
+        self.method = method or config.SMOOTHING_FILTER
+        if self.method not in FILTERS:
+            raise ValueError(f"Unknown smoothing filter: {self.method}")
+        tau = config.SMOOTHING_EMA_TAU if ema_tau is None else ema_tau
+        calibrate = config.CALIBRATION_ENABLED if calibrate is None else calibrate
+
+        self.windows = (RollingWindow(config.EAR_WINDOW_SEC),
+                        RollingWindow(config.MAR_WINDOW_SEC),
+                        RollingWindow(config.PITCH_WINDOW_SEC))
+        self.emas = (Ema(tau), Ema(tau), Ema(tau)) if tau > 0 else None
+        self.calibrator = BaselineCalibrator() if calibrate else None
+        self.last_timestamp = None
+        self.last_pitch = None
+
+    def process(self, ear, mar, pitch, timestamp):
+        """
+        Returns the (ear, mar, pitch) to feed to the tracker.
+        """
+        if self.last_timestamp is not None and timestamp - self.last_timestamp > config.CALIBRATION_RESET_SEC:
+            self.reset()
+        self.last_timestamp = timestamp
+
+        if self.last_pitch is not None:
+            pitch = unwrap_pitch(pitch, self.last_pitch)
+        self.last_pitch = pitch
+
+        if self.calibrator is not None:
+            self.calibrator.update(ear, pitch, timestamp)
+            ear, pitch = self.calibrator.apply(ear, pitch)
+
+        values = (ear, mar, pitch)
+        if self.method != FILTER_NONE:
+            for window, value in zip(self.windows, values):
+                window.push(value, timestamp)
+            if self.method == FILTER_MEDIAN:
+                values = tuple(window.median() for window in self.windows)
+            else:
+                values = tuple(window.mean() for window in self.windows)
+        if self.emas is not None:
+            values = tuple(ema.update(value, timestamp) for ema, value in zip(self.emas, values))
+        ear, mar, pitch = values
+        return ear, mar, wrap_pitch(pitch)
+
+    def reset(self):
+        self.last_pitch = None
+        for window in self.windows:
+            window.reset()
+        if self.emas is not None:
+            for ema in self.emas:
+                ema.reset()
+        if self.calibrator is not None:
+            self.calibrator.reset()
@@ -0,0 +1,334 @@
+import glob
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+
+# Image file types ImageDirectorySource reads
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class FrameSource:
+    """
+    Common interface of all frame sources, a subset of cv2.VideoCapture so
+    the pipeline takes either: read() -> (success, image), isOpened(),
+    release().
+    `live` sources (cameras) can recover from failed reads; for the
+    others a failed read is the end of the input.
+
+    Frames are read into buffers handed back with recycle(), so capture
+    does not allocate a new frame every read. A returned image belongs to
+    the caller until it is recycled, however long the pipeline stages
+    hold it; only then is it read into again. Images that are never
+    recycled are simply garbage collected, and the source allocates new
+    ones. Up to config.CAPTURE_BUFFER_POOL free buffers are kept.
+    """
+
+    live = False
+
+    def __init__(self, pool_size=None, fps=None):
+        self.pool_size = max(1, pool_size or config.CAPTURE_BUFFER_POOL)
+        self.free = []
+        self.pool_lock = threading.Lock()
+        self.allocated = 0
+        # Paces non-live sources to `fps` frames per second; 0 or None reads as fast as consumed
+        self.interval = 1.0 / fps if fps else 0.0
+        self.next_frame_time = None
+        self.frame_count = 0
+
+    def _take_buffer(self, shape=None):
+        """
+        A free buffer (of `shape`, when given) to read the next frame into,
+        or None to let the reader allocate one.
+        """
+        with self.pool_lock:
+            for i in range(len(self.free) - 1, -1, -1):
+                if shape is None or self.free[i].shape == shape:
+                    return self.free.pop(i)
+        return None
+
+    def _buffer_for(self, shape):
+        buffer = self._take_buffer(shape)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=np.uint8)
+            self.allocated += 1
+        return buffer
+
+    def recycle(self, image):
+        """
+        Hands a frame from read() back once nothing uses it any more.
+        """
+        if image is None:
+            return
+        with self.pool_lock:
+            if len(self.free) < self.pool_size and all(image is not buffer for buffer in self.free):
+                self.free.append(image)
+
+    def _pace(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_frame_time is None or now - self.next_frame_time > self.interval:
+            self.next_frame_time = now
+        elif self.next_frame_time > now:
+            time.sleep(self.next_frame_time - now)
+        self.next_frame_time += self.interval
+
+    def read(self):
+        raise NotImplementedError
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def stats(self):
+        return {"frames": self.frame_count, "buffers_allocated": self.allocated}
+
+
+class CameraSource(FrameSource):
+    """
+    A camera (or network stream URL) opened with the config.CAMERA_*
+    capture settings. Failed
+    reads back off exponentially instead of spinning, and after
+    config.CAMERA_RECONNECT_AFTER failures in a row the device is closed
+    and reopened, e.g. after a USB camera was unplugged.
+    """
+
+    live = True
+
+    def __init__(self, index=None, width=None, height=None, fps=None, fourcc=None, buffer_size=None,
+                 pool_size=None):
+        super().__init__(pool_size)
+        self.index = config.CAMERA_INDEX if index is None else index
+        self.width = width or config.CAMERA_WIDTH
+        self.height = height or config.CAMERA_HEIGHT
+        self.camera_fps = fps or config.CAMERA_FPS
+        self.fourcc = fourcc or config.CAMERA_FOURCC
+        self.buffer_size = buffer_size or config.CAMERA_BUFFER_SIZE
+
+        self.failed_reads = 0
+        self.consecutive_failures = 0
+        self.reconnects = 0
+        self._released = threading.Event()
+        self.cap = None
+        self._open()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.index)
+        if cap.isOpened():
+            # FOURCC first: some drivers only offer high resolutions with MJPEG
+            if self.fourcc:
+                cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+            if self.width and self.height:
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            if self.camera_fps:
+                cap.set(cv2.CAP_PROP_FPS, self.camera_fps)
+            if self.buffer_size:
+                # A short driver queue keeps the newest frame close to "now"
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+        self.cap = cap
+        return cap.isOpened()
+
+    def read(self):
+        if self._released.is_set():
+            return False, None
+        buffer = self._take_buffer()
+        success, image = self.cap.read(buffer) if self.cap.isOpened() else (False, None)
+        if success:
+            if image is not buffer:
+                self.allocated += 1
+            self.consecutive_failures = 0
+            self.frame_count += 1
+            return True, image
+
+        self.recycle(buffer)
+        self.failed_reads += 1
+        self.consecutive_failures += 1
+        delay = min(config.CAMERA_RETRY_DELAY * 2 ** (self.consecutive_failures - 1),
+                    config.CAMERA_RETRY_MAX_DELAY)
+        reconnect = self.consecutive_failures % config.CAMERA_RECONNECT_AFTER == 0
+        if reconnect:
+            print(f"Camera {self.index} not delivering frames; reconnecting in {delay:.1f} s.")
+        # Waits on the release event so release() cuts a long backoff short
+        if not self._released.wait(delay) and reconnect:
+            self.cap.release()
+            self.reconnects += 1
+            if self._open():
+                print(f"Camera {self.index} reopened.")
+        return False, None
+
+    def isOpened(self):
+        # Stays "open" through reconnects; only release() ends a camera source
+        return not self._released.is_set()
+
+    def release(self):
+        self._released.set()
+        if self.cap is not None:
+            self.cap.release()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def stats(self):
+        return {
+            "frames": self.frame_count,
+            "buffers_allocated": self.allocated,
+            "failed_reads": self.failed_reads,
+            "reconnects": self.reconnects,
+        }
+
+
+class VideoFileSource(FrameSource):
+    """
+    A video file, read as fast as it is consumed unless `fps` is given.
+    `loop` rewinds at the end instead of finishing.
+    """
+
+    def __init__(self, path, loop=False, fps=None, pool_size=None):
+        super().__init__(pool_size, fps)
+        self.path = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+
+    def read(self):
+        self._pace()
+        buffer = self._take_buffer()
+        success, image = self.cap.read(buffer)
+        if not success and self.loop and self.frame_count > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, image = self.cap.read(buffer)
+        if not success:
+            self.recycle(buffer)
+            return False, None
+        if image is not buffer:
+            self.allocated += 1
+        self.frame_count += 1
+        return True, image
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+
+class ImageDirectorySource(FrameSource):
+    """
+    The images in a directory in file name order, one per frame.
+    Images of another size than the first are resized to it.
+    """
+
+    def __init__(self, path, loop=False, fps=None, pool_size=None):
+        super().__init__(pool_size, fps)
+        self.path = path
+        self.loop = loop
+        self.files = sorted(
+            f for f in glob.glob(os.path.join(path, "*")) if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            print(f"No images found in {path}")
+        self.position = 0
+        self.shape = None
+
+    def read(self):
+        while self.position < len(self.files) or (self.loop and self.frame_count > 0):
+            if self.position == len(self.files):
+                self.position = 0
+            path = self.files[self.position]
+            self.position += 1
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                print(f"Skipping unreadable image {path}")
+                continue
+            self._pace()
+            if self.shape is None:
+                self.shape = image.shape
+            frame = self._buffer_for(self.shape)
+            if image.shape == self.shape:
+                np.copyto(frame, image)
+            else:
+                cv2.resize(image, (self.shape[1], self.shape[0]), dst=frame)
+            self.frame_count += 1
+            return True, frame
+        return False, None
+
+    def isOpened(self):
+        return bool(self.files)
+
+
+class SyntheticSource(FrameSource):
+    """
+    Reproducible frames without a camera: seeded noise with `face_image`
+    pasted into the middle and shifted a few pixels per frame.
+    `count` frames in total, or endless when None.
+    """
+
+    def __init__(self, width=640, height=480, count=None, face_image=None, seed=0, fps=None, pool_size=None):
+        super().__init__(pool_size, fps)
+        self.count = count
+        self.shape = (height, width, 3)
+        rng = np.random.default_rng(seed)
+        self.background = rng.integers(0, 255, size=self.shape, dtype=np.uint8)
+        self.face = None
+        if face_image is not None:
+            size = int(height * 0.9)
+            self.face = cv2.resize(face_image, (size, size))
+
+    def render(self, index, out):
+        """
+        Draws frame number `index` into `out`.
+        """
+        # Roll the noise so consecutive frames differ, as a camera's do
+        shift = (index * 7) % self.shape[1]
+        if shift:
+            out[:, :-shift] = self.background[:, shift:]
+            out[:, -shift:] = self.background[:, :shift]
+        else:
+            np.copyto(out, self.background)
+        if self.face is not None:
+            y0 = (self.shape[0] - self.face.shape[0]) // 2
+            x0 = (self.shape[1] - self.face.shape[1]) // 2 + (index % 5) - 2
+            out[y0:y0 + self.face.shape[0], x0:x0 + self.face.shape[1]] = self.face
+        return out
+
+    def read(self):
+        if self.count is not None and self.frame_count >= self.count:
+            return False, None
+        self._pace()
+        frame = self.render(self.frame_count, self._buffer_for(self.shape))
+        self.frame_count += 1
+        return True, frame
+
+
+def open_source(spec=None, loop=False, fps=None):
+    """
+    Opens a frame source from a spec: a camera index, stream URL,
+    "synthetic", an image directory or a video file. Defaults to config.FRAME_SOURCE, then the
+    camera at config.CAMERA_INDEX.
+    """
+    if spec is None:
+        spec = config.FRAME_SOURCE
+    if spec is None:
+        return CameraSource()
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return CameraSource(int(spec))
+    if "://" in spec:
+        # Network streams drop out like cameras do, so they reconnect too
+        return CameraSource(spec)
+    if spec == "synthetic":
+        # Stands in for the camera, so it runs at the camera's rate by default
+        return SyntheticSource(config.CAMERA_WIDTH or 640, config.CAMERA_HEIGHT or 480,
+                               fps=fps or config.CAMERA_FPS)
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, loop=loop, fps=fps)
+    return VideoFileSource(spec, loop=loop, fps=fps)
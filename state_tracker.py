@@ -1,4 +1,7 @@
 import time
+
+import numpy as np
+
 import config
 
 class StateTracker:
@@ -8,11 +11,33 @@ class StateTracker:
     STATE_CRITICAL = "CRITICAL"
     STATE_NONE = "NONE"
 
-    def __init__(self):
+    # Compact integer codes for columnar output
+    STATE_CODES = {STATE_NONE: 0, STATE_NORMAL: 1, STATE_WARNING: 2, STATE_CRITICAL: 3}
+    ACTIONS = [None, "driver_short", "driver_passenger_long"]
+    ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+    # Tracker Modes
+    MODE_FRAMES = "frames"
+    MODE_TIME = "time"
+
+    def __init__(self, mode=None):
+        # "frames": thresholds are frame counts (config.*_FRAMES)
+        # "time": thresholds are durations (config.*_SEC) measured on the
+        # capture timestamps passed to update()
+        self.mode = mode or config.TRACKER_MODE
+        if self.mode not in (self.MODE_FRAMES, self.MODE_TIME):
+            raise ValueError(f"Unknown tracker mode: {self.mode}")
+
         # Frame counters
         self.closed_frames = 0
         self.yawn_frames = 0
         self.nod_frames = 0
+
+        # Elapsed time counters (seconds)
+        self.closed_time = 0.0
+        self.yawn_time = 0.0
+        self.nod_time = 0.0
+        self.last_timestamp = None
         
         # Individual States
         self.eye_state = self.STATE_NONE
@@ -24,55 +49,90 @@ class StateTracker:
         self.last_overall_state = self.STATE_NORMAL
         
         # Alarm Cooldown
-        self.last_alarm_time = 0
+        self.last_alarm_time = float("-inf")
 
-    def update(self, ear, mar, pitch):
+    def update(self, ear, mar, pitch, timestamp=None):
         """
         Updates the tracker with new raw values.
+        timestamp: capture time in seconds on a monotonic clock (or the video
+        clock for recorded footage). Required for accurate timing in "time"
+        mode; defaults to the current time.
         Returns the current states and any alarm action needed.
         """
-        current_time = time.time()
-        
+        if self.mode == self.MODE_TIME:
+            if timestamp is None:
+                timestamp = time.monotonic()
+            if self.last_timestamp is None:
+                dt = 0.0
+            else:
+                dt = min(max(timestamp - self.last_timestamp, 0.0), config.MAX_FRAME_GAP_SEC)
+            self.last_timestamp = timestamp
+        else:
+            dt = 0.0
+
+        current_time = time.time() if timestamp is None else timestamp
+
         # --- 1. Eye Closure Logic ---
         if ear < config.EAR_THRESHOLD:
             self.closed_frames += 1
+            self.closed_time += dt
         else:
             self.closed_frames = 0
+            self.closed_time = 0.0
             self.eye_state = self.STATE_NONE
-            
-        if self.closed_frames > 0:
-            if self.closed_frames <= config.BLINK_MAX_FRAMES:
-                self.eye_state = self.STATE_NONE
-            elif self.closed_frames < config.EYE_CRIT_FRAMES:
-                self.eye_state = self.STATE_WARNING
-            else:
-                self.eye_state = self.STATE_CRITICAL
 
         # --- 2. Yawning Logic ---
         if mar > config.MAR_THRESHOLD:
             self.yawn_frames += 1
-            if self.yawn_frames < config.YAWN_WARN_FRAMES:
-                self.yawn_state = self.STATE_NONE
-            elif self.yawn_frames < config.YAWN_CRIT_FRAMES:
-                self.yawn_state = self.STATE_WARNING
-            else:
-                self.yawn_state = self.STATE_CRITICAL
+            self.yawn_time += dt
         else:
             self.yawn_frames = 0
+            self.yawn_time = 0.0
             self.yawn_state = self.STATE_NONE
 
         # --- 3. Nodding Logic ---
         if pitch < config.PITCH_THRESHOLD:
             self.nod_frames += 1
-            if self.nod_frames < config.NOD_WARN_FRAMES:
+            self.nod_time += dt
+        else:
+            self.nod_frames = 0
+            self.nod_time = 0.0
+            self.nod_state = self.STATE_NONE
+
+        if self.mode == self.MODE_TIME:
+            closed, yawn, nod = self.closed_time, self.yawn_time, self.nod_time
+            blink_max, eye_crit = config.BLINK_MAX_SEC, config.EYE_CRIT_SEC
+            yawn_warn, yawn_crit = config.YAWN_WARN_SEC, config.YAWN_CRIT_SEC
+            nod_warn, nod_crit = config.NOD_WARN_SEC, config.NOD_CRIT_SEC
+        else:
+            closed, yawn, nod = self.closed_frames, self.yawn_frames, self.nod_frames
+            blink_max, eye_crit = config.BLINK_MAX_FRAMES, config.EYE_CRIT_FRAMES
+            yawn_warn, yawn_crit = config.YAWN_WARN_FRAMES, config.YAWN_CRIT_FRAMES
+            nod_warn, nod_crit = config.NOD_WARN_FRAMES, config.NOD_CRIT_FRAMES
+
+        if self.closed_frames > 0:
+            if closed <= blink_max:
+                self.eye_state = self.STATE_NONE
+            elif closed < eye_crit:
+                self.eye_state = self.STATE_WARNING
+            else:
+                self.eye_state = self.STATE_CRITICAL
+
+        if self.yawn_frames > 0:
+            if yawn < yawn_warn:
+                self.yawn_state = self.STATE_NONE
+            elif yawn < yawn_crit:
+                self.yawn_state = self.STATE_WARNING
+            else:
+                self.yawn_state = self.STATE_CRITICAL
+
+        if self.nod_frames > 0:
+            if nod < nod_warn:
                 self.nod_state = self.STATE_NONE
-            elif self.nod_frames < config.NOD_CRIT_FRAMES:
+            elif nod < nod_crit:
                 self.nod_state = self.STATE_WARNING
             else:
                 self.nod_state = self.STATE_CRITICAL
-        else:
-            self.nod_frames = 0
-            self.nod_state = self.STATE_NONE
 
         # --- 4. Overall State Logic ---
         previous_state = self.overall_state
@@ -116,3 +176,148 @@ class StateTracker:
             "nod": self.nod_state,
             "action": alarm_action
         }
+
+
+class BatchStateTracker:
+    """
+    StateTracker for many drivers at once. Counters and states live in
+    NumPy arrays indexed by driver, states are the integer codes from
+    StateTracker.STATE_CODES, and one update() call advances every driver
+    in a single vectorized step. Results are identical to running one
+    StateTracker per driver.
+    """
+
+    # State and action codes (StateTracker.STATE_CODES / ACTION_CODES)
+    CODE_NONE = StateTracker.STATE_CODES[StateTracker.STATE_NONE]
+    CODE_NORMAL = StateTracker.STATE_CODES[StateTracker.STATE_NORMAL]
+    CODE_WARNING = StateTracker.STATE_CODES[StateTracker.STATE_WARNING]
+    CODE_CRITICAL = StateTracker.STATE_CODES[StateTracker.STATE_CRITICAL]
+    ACTION_NONE = StateTracker.ACTION_CODES[None]
+    ACTION_SHORT = StateTracker.ACTION_CODES["driver_short"]
+    ACTION_LONG = StateTracker.ACTION_CODES["driver_passenger_long"]
+
+    def __init__(self, drivers, mode=None):
+        self.mode = mode or config.TRACKER_MODE
+        if self.mode not in (StateTracker.MODE_FRAMES, StateTracker.MODE_TIME):
+            raise ValueError(f"Unknown tracker mode: {self.mode}")
+        self.drivers = drivers
+
+        # Frame counters
+        self.closed_frames = np.zeros(drivers, dtype=np.int64)
+        self.yawn_frames = np.zeros(drivers, dtype=np.int64)
+        self.nod_frames = np.zeros(drivers, dtype=np.int64)
+
+        # Elapsed time counters (seconds)
+        self.closed_time = np.zeros(drivers)
+        self.yawn_time = np.zeros(drivers)
+        self.nod_time = np.zeros(drivers)
+        self.last_timestamp = np.full(drivers, np.nan)
+
+        # States
+        self.eye_state = np.full(drivers, self.CODE_NONE, dtype=np.int8)
+        self.yawn_state = np.full(drivers, self.CODE_NONE, dtype=np.int8)
+        self.nod_state = np.full(drivers, self.CODE_NONE, dtype=np.int8)
+        self.overall_state = np.full(drivers, self.CODE_NORMAL, dtype=np.int8)
+
+        # Alarm Cooldown
+        self.last_alarm_time = np.full(drivers, -np.inf)
+
+    def update(self, ear, mar, pitch, timestamp=None, active=None):
+        """
+        Advances every driver by one frame.
+        ear, mar, pitch: arrays with one value per driver.
+        timestamp: capture time per driver (or one for all); defaults to
+        the current monotonic time.
+        active: optional boolean mask of drivers that had a face this
+        frame; the others are left untouched, as if update() had not been
+        called for them.
+        Returns the alarm action code per driver (ACTION_*).
+        """
+        ear = np.asarray(ear, dtype=np.float64)
+        mar = np.asarray(mar, dtype=np.float64)
+        pitch = np.asarray(pitch, dtype=np.float64)
+        if timestamp is None:
+            timestamp = time.monotonic()
+        timestamp = np.broadcast_to(np.asarray(timestamp, dtype=np.float64), (self.drivers,))
+
+        if self.mode == StateTracker.MODE_TIME:
+            gap = np.minimum(np.maximum(timestamp - self.last_timestamp, 0.0), config.MAX_FRAME_GAP_SEC)
+            dt = np.where(np.isnan(self.last_timestamp), 0.0, gap)
+        else:
+            dt = 0.0
+
+        # --- 1-3. Eye closure, yawning and nodding counters ---
+        closed = ear < config.EAR_THRESHOLD
+        yawning = mar > config.MAR_THRESHOLD
+        nodding = pitch < config.PITCH_THRESHOLD
+        closed_frames = np.where(closed, self.closed_frames + 1, 0)
+        yawn_frames = np.where(yawning, self.yawn_frames + 1, 0)
+        nod_frames = np.where(nodding, self.nod_frames + 1, 0)
+        closed_time = np.where(closed, self.closed_time + dt, 0.0)
+        yawn_time = np.where(yawning, self.yawn_time + dt, 0.0)
+        nod_time = np.where(nodding, self.nod_time + dt, 0.0)
+
+        if self.mode == StateTracker.MODE_TIME:
+            closed_run, yawn_run, nod_run = closed_time, yawn_time, nod_time
+            blink_max, eye_crit = config.BLINK_MAX_SEC, config.EYE_CRIT_SEC
+            yawn_warn, yawn_crit = config.YAWN_WARN_SEC, config.YAWN_CRIT_SEC
+            nod_warn, nod_crit = config.NOD_WARN_SEC, config.NOD_CRIT_SEC
+        else:
+            closed_run, yawn_run, nod_run = closed_frames, yawn_frames, nod_frames
+            blink_max, eye_crit = config.BLINK_MAX_FRAMES, config.EYE_CRIT_FRAMES
+            yawn_warn, yawn_crit = config.YAWN_WARN_FRAMES, config.YAWN_CRIT_FRAMES
+            nod_warn, nod_crit = config.NOD_WARN_FRAMES, config.NOD_CRIT_FRAMES
+
+        warning, critical, none = self.CODE_WARNING, self.CODE_CRITICAL, self.CODE_NONE
+        eye_state = np.where(closed & (closed_run > blink_max),
+                             np.where(closed_run < eye_crit, warning, critical), none)
+        yawn_state = np.where(yawning & (yawn_run >= yawn_warn),
+                              np.where(yawn_run < yawn_crit, warning, critical), none)
+        nod_state = np.where(nodding & (nod_run >= nod_warn),
+                             np.where(nod_run < nod_crit, warning, critical), none)
+
+        # --- 4. Overall State Logic ---
+        previous_state = self.overall_state
+        overall_state = np.maximum(np.maximum(eye_state, yawn_state), np.maximum(nod_state, self.CODE_NORMAL))
+
+        # --- 5. Alarm Logic ---
+        cooled = timestamp - self.last_alarm_time > config.ALARM_COOLDOWN
+        short = (previous_state == self.CODE_NORMAL) & (overall_state == warning) & cooled
+        is_critical = overall_state == critical
+        long = is_critical & ((previous_state != critical) | cooled)
+        actions = np.where(long, self.ACTION_LONG, np.where(short, self.ACTION_SHORT, self.ACTION_NONE))
+        last_alarm_time = np.where(short | long, timestamp, self.last_alarm_time)
+
+        if active is None:
+            keep = lambda new, old: new
+        else:
+            active = np.asarray(active, dtype=bool)
+            keep = lambda new, old: np.where(active, new, old)
+            actions = np.where(active, actions, self.ACTION_NONE)
+
+        self.closed_frames = keep(closed_frames, self.closed_frames)
+        self.yawn_frames = keep(yawn_frames, self.yawn_frames)
+        self.nod_frames = keep(nod_frames, self.nod_frames)
+        self.closed_time = keep(closed_time, self.closed_time)
+        self.yawn_time = keep(yawn_time, self.yawn_time)
+        self.nod_time = keep(nod_time, self.nod_time)
+        self.last_timestamp = keep(timestamp, self.last_timestamp)
+        self.eye_state = keep(eye_state, self.eye_state).astype(np.int8)
+        self.yawn_state = keep(yawn_state, self.yawn_state).astype(np.int8)
+        self.nod_state = keep(nod_state, self.nod_state).astype(np.int8)
+        self.overall_state = keep(overall_state, self.overall_state).astype(np.int8)
+        self.last_alarm_time = keep(last_alarm_time, self.last_alarm_time)
+        return actions.astype(np.int8)
+
+    def status(self, driver):
+        """
+        One driver's current states, in StateTracker.update()'s format
+        (without the action).
+        """
+        names = {code: state for state, code in StateTracker.STATE_CODES.items()}
+        return {
+            "overall": names[int(self.overall_state[driver])],
+            "eye": names[int(self.eye_state[driver])],
+            "yawn": names[int(self.yawn_state[driver])],
+            "nod": names[int(self.nod_state[driver])],
+        }
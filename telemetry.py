@@ -0,0 +1,258 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import config
+from seat import IdentityMap
+from state_tracker import StateTracker
+
+MAGIC = b"DDTL"
+VERSION = 1
+
+# File header: magic, version, record size, capacity (padded to 64 bytes)
+HEADER = struct.Struct("<4sHHI52x")
+
+# One fixed-size record per face per frame. The CRC covers everything
+# before it, so records torn by a crash or power cut are skipped on read.
+RECORD = struct.Struct("<QddIfffffBBBBBBB5xI")
+RECORD_DTYPE = np.dtype([
+    ("seq", "<u8"), ("timestamp", "<f8"), ("wall_time", "<f8"), ("frame_id", "<u4"),
+    ("ear", "<f4"), ("mar", "<f4"), ("pitch", "<f4"), ("yaw", "<f4"), ("roll", "<f4"),
+    ("face_index", "u1"), ("overall", "u1"), ("eye", "u1"), ("yawn", "u1"), ("nod", "u1"),
+    ("action", "u1"), ("flags", "u1"), ("_pad", "V5"), ("crc", "<u4"),
+])
+CRC_SPAN = RECORD.size - 4
+
+# Record flags
+FLAG_ESTIMATED = 1    # Features came from the scheduler's extrapolation, not FaceMesh
+FLAG_NO_FACE = 2      # No face in this frame; feature fields are NaN
+
+NO_FACE_INDEX = 255
+STATE_NAMES = {code: state for state, code in StateTracker.STATE_CODES.items()}
+
+
+class TelemetryWriter:
+    """
+    Fixed-size ring of binary per-frame records in a memory-mapped file.
+    write() packs one record into a reused scratch buffer and copies it
+    into the mapping in one go: no allocation, no syscall. The kernel
+    writes dirty pages back on its own, so records survive a crash of
+    this process; a background thread msyncs every
+    `flush_interval` seconds to bound what a power cut can lose.
+    Reopening an existing file continues after its newest record; an
+    existing file that is not telemetry is never overwritten.
+    """
+
+    def __init__(self, path=None, capacity=None, flush_interval=None):
+        self.path = path or config.TELEMETRY_FILE
+        self.capacity = capacity or config.TELEMETRY_CAPACITY
+        self.flush_interval = config.TELEMETRY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        size = HEADER.size + self.capacity * RECORD.size
+
+        existing = _read_header(self.path)
+        if existing is None and os.path.exists(self.path):
+            raise ValueError(f"Not a telemetry file, refusing to overwrite it: {self.path}")
+        if existing is None or existing != (RECORD.size, self.capacity) or os.path.getsize(self.path) != size:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.capacity))
+                f.truncate(size)
+            self.seq = 0
+        else:
+            records = read_records(self.path)
+            self.seq = int(records["seq"][-1]) + 1 if len(records) else 0
+
+        self.file = open(self.path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        self.lock = threading.Lock()
+        self._record = bytearray(RECORD.size)
+        self._crc_view = memoryview(self._record)[:CRC_SPAN]
+
+        self.stop_event = threading.Event()
+        self.flusher = None
+        if self.flush_interval:
+            self.flusher = threading.Thread(target=self._flush_loop, name="telemetry-flush", daemon=True)
+            self.flusher.start()
+
+    def write(self, frame_id, timestamp, face_index, face, status_info, estimated=False):
+        """
+        Appends one record. `face` is a feature dict from extract_features(),
+        or None when no face was found.
+        """
+        flags = FLAG_ESTIMATED if estimated else 0
+        if face is None:
+            flags |= FLAG_NO_FACE
+            face_index = NO_FACE_INDEX
+            ear = mar = pitch = yaw = roll = float("nan")
+        else:
+            ear, mar, pitch, yaw, roll = face["ear"], face["mar"], face["pitch"], face["yaw"], face["roll"]
+
+        codes = StateTracker.STATE_CODES
+        with self.lock:
+            RECORD.pack_into(
+                self._record, 0, self.seq, timestamp, time.time(), frame_id & 0xFFFFFFFF,
+                ear, mar, pitch, yaw, roll, face_index,
+                codes[status_info["overall"]], codes[status_info["eye"]],
+                codes[status_info["yawn"]], codes[status_info["nod"]],
+                StateTracker.ACTION_CODES[status_info["action"]], flags, 0
+            )
+            struct.pack_into("<I", self._record, CRC_SPAN, zlib.crc32(self._crc_view))
+            offset = HEADER.size + (self.seq % self.capacity) * RECORD.size
+            self.mm[offset:offset + RECORD.size] = self._record
+            self.seq += 1
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        try:
+            self.mm.flush()
+        except (ValueError, OSError):
+            pass
+
+    def close(self):
+        self.stop_event.set()
+        if self.flusher is not None:
+            self.flusher.join(timeout=1.0)
+        self.flush()
+        self._crc_view.release()
+        self.mm.close()
+        self.file.close()
+
+
+def _read_header(path):
+    # (record size, capacity), or None for a missing or foreign file
+    if not os.path.exists(path) or os.path.getsize(path) < HEADER.size:
+        return None
+    with open(path, "rb") as f:
+        magic, version, record_size, capacity = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        return None
+    return record_size, capacity
+
+
+def read_records(path):
+    """
+    Returns the valid records of a telemetry file as a structured NumPy
+    array, oldest first.
+    """
+    header = _read_header(path)
+    if header is None:
+        raise ValueError(f"Not a telemetry file: {path}")
+    record_size, capacity = header
+    if record_size != RECORD.size:
+        raise ValueError(f"Unsupported record size {record_size} in {path}")
+
+    with open(path, "rb") as f:
+        f.seek(HEADER.size)
+        raw = f.read(capacity * RECORD.size)
+    count = len(raw) // RECORD.size
+    records = np.frombuffer(raw, dtype=RECORD_DTYPE, count=count)
+
+    # Unwritten slots are all zero and fail the CRC like torn ones do
+    valid = np.fromiter(
+        (zlib.crc32(raw[i:i + CRC_SPAN]) == crc
+         for i, crc in zip(range(0, count * RECORD.size, RECORD.size), records["crc"].tolist())),
+        dtype=bool, count=count
+    )
+    records = records[valid]
+    return records[np.argsort(records["seq"], kind="stable")]
+
+
+def replay(records, mode=None):
+    """
+    Streams records back through fresh StateTrackers, one per face index
+    as the main loop keeps one per person. Yields (record, status) for
+    every record with a face; status is the replayed tracker output.
+    Records carry the face index, not the identity, so a driver change
+    within the forget timeout replays on the previous driver's tracker.
+    """
+    trackers = IdentityMap(lambda: StateTracker(mode=mode))
+    for record in records:
+        if record["flags"] & FLAG_NO_FACE:
+            continue
+        timestamp = float(record["timestamp"])
+        tracker = trackers.get(int(record["face_index"]), timestamp)
+        status = tracker.update(float(record["ear"]), float(record["mar"]), float(record["pitch"]), timestamp)
+        yield record, status
+
+
+def before_alarms(records, seconds):
+    """
+    Splits the records into one window per alarm, covering `seconds`
+    before each record whose action was set. Uses wall-clock time, since
+    the monotonic capture clock restarts with the machine.
+    """
+    alarms = np.flatnonzero(records["action"] != 0)
+    windows = []
+    for index in alarms:
+        end = records["wall_time"][index]
+        start = np.searchsorted(records["wall_time"][:index + 1], end - seconds)
+        windows.append(records[start:index + 1])
+    return windows
+
+
+def format_record(record):
+    wall = time.strftime("%H:%M:%S", time.localtime(record["wall_time"]))
+    state = STATE_NAMES[int(record["overall"])]
+    action = StateTracker.ACTIONS[int(record["action"])] or ""
+    if record["flags"] & FLAG_NO_FACE:
+        return f"{int(record['seq']):8d} {wall} frame {int(record['frame_id']):7d}  no face"
+    marker = "*" if record["flags"] & FLAG_ESTIMATED else " "
+    return (f"{int(record['seq']):8d} {wall} frame {int(record['frame_id']):7d}{marker} "
+            f"EAR {record['ear']:.3f} MAR {record['mar']:.3f} pitch {record['pitch']:7.2f}  "
+            f"{state:8s} eye {STATE_NAMES[int(record['eye'])]:8s} yawn {STATE_NAMES[int(record['yawn'])]:8s} "
+            f"nod {STATE_NAMES[int(record['nod'])]:8s} {action}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print or replay a telemetry ring file.")
+    parser.add_argument("path", nargs="?", default=config.TELEMETRY_FILE, help="Telemetry file")
+    parser.add_argument("--last", type=int, help="Only the newest N records")
+    parser.add_argument("--before-alarm", type=float, metavar="SECONDS",
+                        help="Only the SECONDS before each recorded alarm")
+    parser.add_argument("--replay", action="store_true",
+                        help="Re-run the records through StateTracker and report state mismatches")
+    parser.add_argument("--mode", choices=[StateTracker.MODE_FRAMES, StateTracker.MODE_TIME],
+                        help="Tracker mode for --replay (default: config.TRACKER_MODE)")
+    args = parser.parse_args()
+
+    records = read_records(args.path)
+    print(f"{len(records)} records in {args.path}")
+
+    if args.replay:
+        mismatches = 0
+        for record, status in replay(records, args.mode):
+            if StateTracker.STATE_CODES[status["overall"]] != record["overall"] or \
+                    StateTracker.ACTION_CODES[status["action"]] != record["action"]:
+                mismatches += 1
+                print(f"{format_record(record)}  -> replayed {status['overall']} {status['action'] or ''}")
+        print(f"{mismatches} records differ from the replay")
+        return
+
+    if args.before_alarm is not None:
+        windows = before_alarms(records, args.before_alarm)
+        for window in windows:
+            print(f"--- alarm at seq {int(window['seq'][-1])}")
+            for record in window:
+                print(format_record(record))
+        print(f"{len(windows)} alarms")
+        return
+
+    if args.last:
+        records = records[-args.last:]
+    for record in records:
+        print(format_record(record))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+import config
+from detector import DrowsinessDetector
+
+
+class DriverSelectionTest(unittest.TestCase):
+    """
+    Driver selection runs the landmark model on crops whatever ROI_CROP says.
+    """
+
+    def setUp(self):
+        self.saved = config.ROI_CROP
+        config.ROI_CROP = False
+
+    def tearDown(self):
+        config.ROI_CROP = self.saved
+
+    def test_without_roi_crop(self):
+        detector = DrowsinessDetector(driver_selection=True)
+        self.assertIn("roi", detector.backend.meshes)
+        detector.warm_up()
+        frame = np.full((480, 640, 3), 90, dtype=np.uint8)
+        results, _ = detector.detect(frame)
+        self.assertEqual(detector.extract_features(results, 640, 480), [])
+
+    def test_without_either(self):
+        detector = DrowsinessDetector(driver_selection=False)
+        self.assertNotIn("roi", detector.backend.meshes)
+        detector.warm_up()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import tempfile
+import threading
+import time
+import unittest
+
+import config
+import events
+
+STATUS = {"overall": "NORMAL", "eye": "NONE", "yawn": "NONE", "nod": "NONE", "action": None}
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+class UplinkTest(unittest.TestCase):
+    """
+    The uplink sink against the local back-office stand-in.
+    """
+
+    def setUp(self):
+        self.saved = {name: getattr(config, name) for name in (
+            "UPLINK_BATCH_SIZE", "UPLINK_BATCH_INTERVAL", "UPLINK_RETRY_MAX_DELAY")}
+        config.UPLINK_BATCH_SIZE = 5
+        config.UPLINK_BATCH_INTERVAL = 0.3
+        config.UPLINK_RETRY_MAX_DELAY = 1.0
+
+        self.stand_in = events.UplinkStandIn()
+        self.stand_in.start()
+        self.spool_dir = tempfile.TemporaryDirectory()
+        self.sink = events.UplinkSink(url=self.stand_in.url, spool=events.Spool(self.spool_dir.name),
+                                      vehicle_id="test")
+        self.bus = events.EventBus({events.SINK_UPLINK: self.sink})
+        self.bus.start()
+
+    def tearDown(self):
+        self.bus.close()
+        self.stand_in.stop()
+        self.spool_dir.cleanup()
+        for name, value in self.saved.items():
+            setattr(config, name, value)
+
+    def publish(self, frame_ids):
+        for frame_id in frame_ids:
+            self.bus.publish(events.make_event(events.EVENT_STATE, frame_id, time.monotonic(), STATUS))
+
+    def received(self):
+        return [event["frame_id"] for event in self.stand_in.events]
+
+    def test_batches_survive_an_outage(self):
+        # Two full batches, then the partial one after the batch interval
+        self.publish(range(12))
+        self.assertTrue(wait_for(lambda: len(self.stand_in.events) == 12))
+        self.assertEqual(self.stand_in.batches, 3)
+        self.assertEqual(self.stand_in.events[0]["vehicle"], "test")
+
+        self.stand_in.down = True
+        self.publish(range(12, 30))
+        self.assertTrue(wait_for(lambda: self.sink.failures > 0 and len(self.sink.spool) >= 4))
+        self.assertEqual(len(self.stand_in.events), 12)
+
+        self.stand_in.down = False
+        self.assertTrue(wait_for(lambda: len(self.sink.spool) == 0))
+        self.assertEqual(self.received(), list(range(30)))
+        self.assertEqual(self.sink.spool.dropped, 0)
+
+    def test_close_sends_the_partial_batch(self):
+        self.publish(range(3))
+        self.bus.close()
+        self.assertEqual(self.received(), [0, 1, 2])
+
+    def test_publish_after_close(self):
+        self.bus.close()
+        self.publish([0])
+        self.assertEqual(self.bus.stats()["dropped"], 1)
+
+
+class BrokenSink:
+    async def start(self):
+        raise OSError("no such device")
+
+    async def handle(self, event):
+        pass
+
+    async def close(self):
+        pass
+
+
+class EventBusTest(unittest.TestCase):
+    def test_failing_sink_start_raises(self):
+        bus = events.EventBus({"gpio": events.GpioSink(), "broken": BrokenSink()})
+        errors = []
+
+        def start():
+            try:
+                bus.start()
+            except OSError as e:
+                errors.append(e)
+
+        # On its own thread, so a hang fails the test instead of the run
+        starter = threading.Thread(target=start, daemon=True)
+        starter.start()
+        starter.join(timeout=5.0)
+        self.assertFalse(starter.is_alive(), "EventBus.start() hung")
+        self.assertEqual([str(e) for e in errors], ["no such device"])
+
+        bus.publish(events.make_event(events.EVENT_STATE, 0, time.monotonic(), STATUS))
+        self.assertEqual(bus.stats()["dropped"], 1)
+        bus.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+
+import config
+from smoothing import SignalStage
+from state_tracker import StateTracker
+
+FPS = 30.0
+
+
+def run(pitches, start=0.0):
+    """
+    Feeds open-eyed frames with the given pitches through a calibrating
+    SignalStage and a StateTracker; returns the nod states.
+    """
+    stage = SignalStage(calibrate=True)
+    tracker = StateTracker()
+    states = []
+    for i, pitch in enumerate(pitches):
+        timestamp = start + i / FPS
+        ear, mar, pitch = stage.process(0.3, 0.1, float(pitch), timestamp)
+        states.append(tracker.update(ear, mar, pitch, timestamp)["nod"])
+    return states
+
+
+class CalibrationTest(unittest.TestCase):
+    """
+    Calibrated pitch against the tracker's nod threshold.
+    """
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.calibrated_from = int((config.CALIBRATION_SEC + 1.0) * FPS)
+
+    def steady(self, neutral, seconds=30.0):
+        pitches = neutral + self.rng.uniform(-200, 200, int(seconds * FPS))
+        # Keep to the tracker's wrapped range
+        return (pitches + 64800) % 129600 - 64800
+
+    def test_steady_head_does_not_nod(self):
+        for neutral in (60000, 63000, 64700, -63000, -64700):
+            states = run(self.steady(neutral))
+            self.assertEqual(set(states[self.calibrated_from:]), {StateTracker.STATE_NONE}, neutral)
+
+    def test_nod_after_calibration(self):
+        for neutral in (60000, -63000):
+            pitches = self.steady(neutral)
+            # Tilt 20 degrees down (towards the wrap) for two seconds
+            nod = slice(self.calibrated_from, self.calibrated_from + int(2 * FPS))
+            pitches[nod] = (pitches[nod] + 20 * 360 + 64800) % 129600 - 64800
+            states = run(pitches)
+            self.assertIn(StateTracker.STATE_CRITICAL, states[nod], neutral)
+            self.assertEqual(set(states[nod.stop + int(FPS):]), {StateTracker.STATE_NONE}, neutral)
+
+
+if __name__ == "__main__":
+    unittest.main()
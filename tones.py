@@ -0,0 +1,63 @@
+import os
+import wave
+
+import numpy as np
+
+import config
+
+# Alert tones: level -> (duration in seconds, frequency in Hz)
+TONES = {
+    "short": (0.5, 1000),
+    "long": (2.0, 1500),
+}
+AMPLITUDE = 16000
+
+
+def synthesize(duration_sec, freq_hz, sample_rate=44100, channels=1):
+    """
+    Sine tone as int16 samples, shape (n,) or (n, channels), in one
+    vectorized pass.
+    """
+    t = np.arange(int(sample_rate * duration_sec)) * (2.0 * np.pi * freq_hz / sample_rate)
+    samples = (AMPLITUDE * np.sin(t)).astype(np.int16)
+    if channels > 1:
+        samples = np.repeat(samples[:, None], channels, axis=1)
+    return samples
+
+
+def write_wav(path, samples, sample_rate):
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.ascontiguousarray(samples, dtype="<i2").tobytes())
+
+
+def tone_path(level, sound_dir=None):
+    return os.path.join(sound_dir or config.SOUND_DIR, f"alert_{level}.wav")
+
+
+def load_tone(level, sample_rate, channels, sound_dir=None):
+    """
+    Samples for an alert level in the mixer's format. Synthesised in
+    memory when the sound directory has no file for it yet; the result is
+    cached there so later starts just read it back.
+    """
+    path = tone_path(level, sound_dir)
+    if os.path.exists(path):
+        with wave.open(path, "rb") as wav_file:
+            if (wav_file.getframerate() == sample_rate and wav_file.getnchannels() == channels
+                    and wav_file.getsampwidth() == 2):
+                samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype="<i2")
+                return samples.reshape(-1, channels) if channels > 1 else samples
+        return None  # A custom sound in another format; let the backend decode it
+
+    duration, freq = TONES[level]
+    samples = synthesize(duration, freq, sample_rate, channels)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        write_wav(path, samples, sample_rate)
+    except OSError as e:
+        print(f"Could not cache alert tone {path}: {e}")
+    return samples
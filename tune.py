@@ -0,0 +1,416 @@
+import argparse
+import csv
+import itertools
+import time
+
+import numpy as np
+
+import config
+from state_tracker import StateTracker
+
+NONE = StateTracker.STATE_CODES[StateTracker.STATE_NONE]
+NORMAL = StateTracker.STATE_CODES[StateTracker.STATE_NORMAL]
+WARNING = StateTracker.STATE_CODES[StateTracker.STATE_WARNING]
+CRITICAL = StateTracker.STATE_CODES[StateTracker.STATE_CRITICAL]
+SHORT = StateTracker.ACTION_CODES["driver_short"]
+LONG = StateTracker.ACTION_CODES["driver_passenger_long"]
+
+# Tunable settings per tracker mode: (signal, threshold, lower duration, upper duration)
+SIGNALS = {
+    StateTracker.MODE_FRAMES: [
+        ("eye", "EAR_THRESHOLD", "BLINK_MAX_FRAMES", "EYE_CRIT_FRAMES"),
+        ("yawn", "MAR_THRESHOLD", "YAWN_WARN_FRAMES", "YAWN_CRIT_FRAMES"),
+        ("nod", "PITCH_THRESHOLD", "NOD_WARN_FRAMES", "NOD_CRIT_FRAMES"),
+    ],
+    StateTracker.MODE_TIME: [
+        ("eye", "EAR_THRESHOLD", "BLINK_MAX_SEC", "EYE_CRIT_SEC"),
+        ("yawn", "MAR_THRESHOLD", "YAWN_WARN_SEC", "YAWN_CRIT_SEC"),
+        ("nod", "PITCH_THRESHOLD", "NOD_WARN_SEC", "NOD_CRIT_SEC"),
+    ],
+}
+
+# Feature each signal is thresholded on, and whether "active" is below it
+FEATURES = {"eye": ("ear", True), "yawn": ("mar", False), "nod": ("pitch", True)}
+
+# Parameter combinations evaluated together; bounds the (combos, frames) working set
+CHUNK_CELLS = 20_000_000
+
+
+def parameter_names(mode):
+    names = []
+    for _, threshold, low, high in SIGNALS[mode]:
+        names += [threshold, low, high]
+    return names + ["ALARM_COOLDOWN"]
+
+
+def load_stream(path):
+    """
+    Loads the tracker inputs (timestamp, ear, mar, pitch) of every frame
+    that had a face, from analyze.py output (.npz/.parquet) or a
+    telemetry ring file. Frames without a face never reach the tracker,
+    so they are dropped here too.
+    Raw features (analysis files written without the SignalStage) go
+    through it here when config.SMOOTHING_ENABLED is set, so thresholds
+    are tuned on what the live tracker would see. Telemetry already holds
+    the tracker's inputs.
+    """
+    conditioned = True
+    if path.endswith(".npz"):
+        data = np.load(path)
+        columns = {name: data[name] for name in ("timestamp", "faces", "ear", "mar", "pitch")}
+        keep = columns["faces"] > 0
+        conditioned = "conditioned" in data.files and bool(data["conditioned"].any())
+    elif path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+        table = pq.read_table(path, columns=[name for name in ("timestamp", "faces", "ear", "mar", "pitch",
+                                                               "conditioned") if name in names])
+        columns = {name: table[name].to_numpy() for name in table.column_names}
+        keep = columns["faces"] > 0
+        conditioned = "conditioned" in columns and bool(columns["conditioned"].any())
+    else:
+        from telemetry import FLAG_NO_FACE, read_records
+        columns = read_records(path)
+        keep = (columns["flags"] & FLAG_NO_FACE) == 0
+
+    # The live tracker compares Python floats, so compare in float64 here too
+    stream = {name: np.asarray(columns[name][keep], dtype=np.float64)
+              for name in ("timestamp", "ear", "mar", "pitch")}
+    if config.SMOOTHING_ENABLED and not conditioned:
+        stream = condition_stream(stream)
+    return stream
+
+
+def condition_stream(stream):
+    """
+    Runs a raw (timestamp, ear, mar, pitch) stream through the same
+    SignalStage the live loop uses.
+    """
+    from smoothing import SignalStage
+
+    stage = SignalStage()
+    values = np.array([stage.process(ear, mar, pitch, timestamp) for timestamp, ear, mar, pitch in zip(
+        stream["timestamp"].tolist(), stream["ear"].tolist(), stream["mar"].tolist(), stream["pitch"].tolist())
+    ], dtype=np.float64).reshape(-1, 3)
+    return {"timestamp": stream["timestamp"], "ear": values[:, 0], "mar": values[:, 1], "pitch": values[:, 2]}
+
+
+def load_events(path):
+    """
+    Labelled drowsiness events as an (N, 2) array of start/end times in
+    the stream's timestamp clock, from a CSV with one "start,end" per line.
+    """
+    events = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                events.append((float(row[0]), float(row[1])))
+            except ValueError:
+                continue  # Header line
+    return np.asarray(events, dtype=np.float64).reshape(-1, 2)
+
+
+def parse_grid(specs, mode):
+    """
+    Turns NAME=v1,v2,... or NAME=start:stop:step (stop inclusive) specs
+    into value arrays. Unlisted parameters stay at their config.py value.
+    """
+    names = parameter_names(mode)
+    grid = {name: np.array([getattr(config, name)], dtype=np.float64) for name in names}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in grid:
+            raise ValueError(f"Unknown parameter {name} for {mode} mode, expected one of {names}")
+        if ":" in values:
+            start, stop, step = (float(v) for v in values.split(":"))
+            grid[name] = np.arange(start, stop + step / 2, step)
+        else:
+            grid[name] = np.array([float(v) for v in values.split(",")])
+    return grid
+
+
+def run_lengths(active, dt=None):
+    """
+    Per frame, the length of the current run of active frames: a frame
+    count, or with `dt` the accumulated clamped time the way
+    StateTracker sums it (sequentially, so the floats match exactly).
+    """
+    if dt is None:
+        index = np.arange(len(active))
+        run_start = np.maximum.accumulate(np.where(active, -1, index))
+        return np.where(active, index - run_start, 0)
+    out = np.zeros(len(active))
+    total = 0.0
+    for i, (is_active, step) in enumerate(zip(active.tolist(), dt.tolist())):
+        total = total + step if is_active else 0.0
+        out[i] = total
+    return out
+
+
+def signal_states(stream, signal, thresholds, lows, highs, dt):
+    """
+    State codes for every (threshold, low, high) combination of one signal,
+    shape (combinations, frames). A signal's state depends only on its own
+    run length, so this needs no per-frame loop.
+    """
+    feature, below = FEATURES[signal]
+    values = stream[feature]
+    states = []
+    for threshold in thresholds:
+        active = values < threshold if below else values > threshold
+        run = run_lengths(active, dt)[None, :]
+        low = lows[:, None]
+        high = highs[:, None]
+        if signal == "eye":
+            # Blink limit is inclusive: closed <= BLINK_MAX is still a blink
+            state = np.where(run <= low, NONE, np.where(run < high, WARNING, CRITICAL))
+        else:
+            state = np.where(run < low, NONE, np.where(run < high, WARNING, CRITICAL))
+        state = np.where(active[None, :], state, NONE)
+        states.append(state.astype(np.int8))
+    return np.concatenate(states)
+
+
+def alarm_actions(overall, times, cooldowns):
+    """
+    StateTracker's alarm logic for many parameter sets at once.
+    overall: (combos, frames) state codes; cooldowns: (combos,).
+    The cooldown makes this sequential in time, so it steps through the
+    frames where any combination could alarm, with the combinations as
+    one vector.
+    """
+    # Frame-major, so each step reads contiguous rows
+    overall = np.ascontiguousarray(overall.T)
+    frames, combos = overall.shape
+    previous = np.empty_like(overall)
+    previous[0] = NORMAL
+    previous[1:] = overall[:-1]
+
+    warn_start = (previous == NORMAL) & (overall == WARNING)
+    critical = overall == CRITICAL
+    critical_start = critical & (previous != CRITICAL)
+
+    actions = np.zeros((frames, combos), dtype=np.int8)
+    last_alarm = np.full(combos, -np.inf)
+    for t in np.flatnonzero((warn_start | critical).any(axis=1)).tolist():
+        cooled = times[t] - last_alarm > cooldowns
+        short = warn_start[t] & cooled
+        long = critical[t] & (critical_start[t] | cooled)
+        last_alarm[short | long] = times[t]
+        actions[t] = np.where(long, LONG, np.where(short, SHORT, 0))
+    return actions.T
+
+
+def score(actions, times, events, tolerance):
+    """
+    Per combination: detected and missed events, false alarms, and the mean
+    delay from event start to the first alarm. An alarm counts for an event
+    if it fires between its start and `tolerance` seconds after its end.
+    """
+    alarms = actions > 0
+    combos = len(alarms)
+    detected = np.zeros(combos, dtype=np.int64)
+    delay_sum = np.zeros(combos)
+    explained = np.zeros(alarms.shape[1], dtype=bool)
+    for start, end in events:
+        window = (times >= start) & (times <= end + tolerance)
+        if not window.any():
+            continue
+        explained |= window
+        in_window = alarms[:, window]
+        hit = in_window.any(axis=1)
+        detected += hit
+        first = times[window][in_window.argmax(axis=1)] - start
+        delay_sum += np.where(hit, first, 0.0)
+    return {
+        "detected": detected,
+        "missed": len(events) - detected,
+        "false_alarms": (alarms & ~explained).sum(axis=1),
+        "alarms": alarms.sum(axis=1),
+        "delay_sum": delay_sum,
+    }
+
+
+def _combinations(grid, mode):
+    """
+    Expands the grid. Returns (params, signal_grids, index): the flat
+    per-combination values, each signal's thresholds and (low, high)
+    pairs, and each combination's row into every signal's states and
+    into the cooldowns.
+    """
+    signals = SIGNALS[mode]
+
+    # Per-signal combinations: threshold-major, then (low, high)
+    signal_grids = []
+    for signal, threshold, low, high in signals:
+        pairs = np.array(list(itertools.product(grid[low], grid[high])), dtype=np.float64).reshape(-1, 2)
+        signal_grids.append((signal, grid[threshold], pairs))
+    cooldowns = grid["ALARM_COOLDOWN"]
+
+    sizes = [len(thresholds) * len(pairs) for _, thresholds, pairs in signal_grids] + [len(cooldowns)]
+    index = np.indices(sizes).reshape(len(sizes), -1)
+
+    params = {}
+    for (signal, thresholds, pairs), (_, threshold, low, high), idx in zip(signal_grids, signals, index):
+        params[threshold] = thresholds[idx // len(pairs)]
+        params[low] = pairs[idx % len(pairs), 0]
+        params[high] = pairs[idx % len(pairs), 1]
+    params["ALARM_COOLDOWN"] = cooldowns[index[-1]]
+    return params, signal_grids, index
+
+
+def _stream_actions(stream, params, signal_grids, index, mode):
+    """
+    Yields (combination slice, actions) over one stream, a chunk of
+    combinations at a time.
+    """
+    times = stream["timestamp"]
+    dt = None
+    if mode == StateTracker.MODE_TIME:
+        dt = np.minimum(np.maximum(np.diff(times, prepend=times[:1]), 0.0), config.MAX_FRAME_GAP_SEC)
+
+    per_signal = [signal_states(stream, signal, thresholds, pairs[:, 0], pairs[:, 1], dt)
+                  for signal, thresholds, pairs in signal_grids]
+
+    combos = index.shape[1]
+    chunk = max(1, CHUNK_CELLS // max(len(times), 1))
+    for begin in range(0, combos, chunk):
+        part = slice(begin, begin + chunk)
+        overall = np.maximum.reduce([states[idx[part]] for states, idx in zip(per_signal, index)])
+        overall = np.maximum(overall, NORMAL)
+        yield part, alarm_actions(overall, times, params["ALARM_COOLDOWN"][part])
+
+
+def simulate(stream, values, mode=None):
+    """
+    Alarm action codes per frame for one set of config values.
+    """
+    mode = mode or config.TRACKER_MODE
+    grid = {name: np.array([values.get(name, getattr(config, name))], dtype=np.float64)
+            for name in parameter_names(mode)}
+    params, signal_grids, index = _combinations(grid, mode)
+    (_, actions), = _stream_actions(stream, params, signal_grids, index, mode)
+    return actions[0]
+
+
+def sweep(streams, grid, mode=None, tolerance=2.0):
+    """
+    Evaluates every combination in `grid` against the labelled streams.
+    streams: list of (stream, events) from load_stream/load_events.
+    Returns (params, totals): params maps each name to a (combos,) array,
+    totals holds the summed score() columns.
+    """
+    mode = mode or config.TRACKER_MODE
+    params, signal_grids, index = _combinations(grid, mode)
+    combos = index.shape[1]
+
+    totals = None
+    for stream, events in streams:
+        times = stream["timestamp"]
+        stream_scores = [score(actions, times, events, tolerance)
+                         for _, actions in _stream_actions(stream, params, signal_grids, index, mode)]
+
+        merged = {name: np.concatenate([s[name] for s in stream_scores]) for name in stream_scores[0]}
+        merged["events"] = np.full(combos, len(events))
+        totals = merged if totals is None else {name: totals[name] + merged[name] for name in totals}
+
+    totals["mean_delay"] = np.where(totals["detected"] > 0,
+                                    totals["delay_sum"] / np.maximum(totals["detected"], 1), np.nan)
+    del totals["delay_sum"]
+    return params, totals
+
+
+def reference_actions(stream, values, mode=None):
+    """
+    Runs the scalar StateTracker with the given config values, for
+    checking the sweep against.
+    """
+    saved = {name: getattr(config, name) for name in values}
+    try:
+        for name, value in values.items():
+            setattr(config, name, value)
+        tracker = StateTracker(mode=mode)
+        return np.array([
+            StateTracker.ACTION_CODES[tracker.update(e, m, p, t)["action"]]
+            for t, e, m, p in zip(stream["timestamp"].tolist(), stream["ear"].tolist(),
+                                  stream["mar"].tolist(), stream["pitch"].tolist())
+        ], dtype=np.int8)
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+def pareto_front(totals):
+    """
+    Indices of the combinations no other combination beats on both
+    missed events and false alarms, fewest missed first.
+    """
+    order = np.lexsort((totals["false_alarms"], totals["missed"]))
+    front = []
+    best_false = np.inf
+    for i in order.tolist():
+        if totals["false_alarms"][i] < best_false:
+            front.append(i)
+            best_false = totals["false_alarms"][i]
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep tracker thresholds over recorded feature streams.")
+    parser.add_argument("streams", nargs="+", help="analyze.py output (.npz/.parquet) or telemetry files")
+    parser.add_argument("-l", "--labels", nargs="+", required=True,
+                        help="Event CSV (start,end seconds) per stream, in the same order")
+    parser.add_argument("-g", "--grid", nargs="*", default=[],
+                        help="NAME=v1,v2,... or NAME=start:stop:step; other parameters keep their config value")
+    parser.add_argument("--mode", choices=[StateTracker.MODE_FRAMES, StateTracker.MODE_TIME],
+                        help="Tracker mode (default: config.TRACKER_MODE)")
+    parser.add_argument("--tolerance", type=float, default=2.0,
+                        help="Seconds after an event's end an alarm still counts for it")
+    parser.add_argument("-o", "--output", default="sweep.csv", help="CSV with every combination's scores")
+    parser.add_argument("--verify", type=int, default=0, metavar="N",
+                        help="Check N random combinations against the scalar StateTracker")
+    args = parser.parse_args()
+
+    if len(args.labels) != len(args.streams):
+        parser.error("Give one labels file per stream")
+    mode = args.mode or config.TRACKER_MODE
+    grid = parse_grid(args.grid, mode)
+    streams = [(load_stream(path), load_events(labels)) for path, labels in zip(args.streams, args.labels)]
+
+    start = time.perf_counter()
+    params, totals = sweep(streams, grid, mode, args.tolerance)
+    elapsed = time.perf_counter() - start
+    combos = len(totals["alarms"])
+    frames = sum(len(stream["timestamp"]) for stream, _ in streams)
+    print(f"{combos} combinations x {frames} frames in {elapsed:.2f} s")
+
+    names = list(params)
+    columns = names + ["events", "detected", "missed", "false_alarms", "alarms", "mean_delay"]
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for i in range(combos):
+            writer.writerow([params[name][i] for name in names] + [totals[name][i] for name in columns[len(names):]])
+    print(f"Scores written to {args.output}")
+
+    print("Missed / false alarm trade-off (Pareto front):")
+    for i in pareto_front(totals):
+        settings = " ".join(f"{name}={params[name][i]:g}" for name in names if len(grid[name]) > 1)
+        print(f"  missed {totals['missed'][i]:4d}/{totals['events'][i]}  false {totals['false_alarms'][i]:5d}  "
+              f"delay {totals['mean_delay'][i]:6.2f} s  {settings}")
+
+    if args.verify:
+        rng = np.random.default_rng(0)
+        failures = 0
+        for i in rng.choice(combos, size=min(args.verify, combos), replace=False).tolist():
+            values = {name: float(params[name][i]) for name in names}
+            for stream, _ in streams:
+                if not np.array_equal(simulate(stream, values, mode), reference_actions(stream, values, mode)):
+                    failures += 1
+        print(f"Verified {min(args.verify, combos)} combinations against StateTracker: {failures} mismatches")
+
+
+if __name__ == "__main__":
+    main()